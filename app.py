@@ -1,359 +1,3524 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, make_response, send_file, abort, g, has_request_context, Response, stream_with_context, before_render_template, template_rendered, get_template_attribute, appcontext_pushed
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy import tuple_, func, case, event, text, inspect as sa_inspect
+from sqlalchemy.orm import configure_mappers
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
+from werkzeug.exceptions import HTTPException, TooManyRequests
+from werkzeug.middleware.proxy_fix import ProxyFix
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
 import os
 from flask_mail import Mail, Message
 import json
 import uuid
-import requests
-from threading import Thread
+import base64
+import re
+import bisect
+import hashlib
+import hmac
+import gzip
+import contextlib
+import mimetypes
+import time
+from collections import OrderedDict, Counter, deque
+from functools import wraps
+import click
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Thread, Lock, RLock, Event, get_ident, local as threading_local
 from urllib.parse import quote
+import random
+import math
+import heapq
+import socket
+import sys
+import sqlite3
+import csv
+import shutil
+import io
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; compressed responses fall back to gzip without it
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; concurrent chunks for one resumable upload aren't serialized there
+    fcntl = None
+
+try:
+    from PIL import Image, ImageOps, features as pil_features
+except ImportError:  # Pillow is optional; without it no derivatives are generated
+    Image = None
 
 app = Flask(__name__)
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+def send_email(msg, commit=True):
+    """Queue an email for the background job workers (see enqueue_job for `commit`)."""
+    enqueue_job('send_email', {
+        'subject': msg.subject,
+        'recipients': msg.recipients,
+        'body': msg.body,
+        'html': msg.html,
+        'sender': msg.sender,
+        'reply_to': msg.reply_to,
+    }, commit=commit)
+
+# --- Mail Configuration ---
+app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
+app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', '1') == '1'
+app.config['MAIL_USERNAME'] = 'your_email@gmail.com'  # Replace with your Gmail
+app.config['MAIL_PASSWORD'] = 'your_app_password'      # Use App Password
+app.config['MAIL_DEFAULT_SENDER'] = ('Sweet Treats Bakery', 'your_email@gmail.com')
+
+# Extensions are bound to the app by init_extensions(), on first use
+mail = Mail()
+
+# --- Configuration ---
+app.config['SECRET_KEY'] = 'your_super_secret_key_change_in_production'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///pastrystore.db')
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# create_app() brings the schema up to date (see migrate_schema); `flask migrate` does the same by hand
+app.config['MIGRATE_ON_START'] = os.environ.get('MIGRATE_ON_START', '1') == '1'
+
+# Database engine. Public pages read through the 'read' bind: DATABASE_READ_URL
+# (e.g. a Postgres replica) or, for a SQLite file, a second pool of query-only
+# connections to the same file. A stray write from a public page fails loudly:
+# see RoutingSession
+def database_config(uri):
+    """Engine options and binds for the database at `uri`"""
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return {}  # in-memory SQLite uses a single static connection
+    return {
+        'SQLALCHEMY_ENGINE_OPTIONS': {
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+            'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+            'pool_pre_ping': url.get_backend_name() != 'sqlite',
+        },
+        'SQLALCHEMY_BINDS': {'read': os.environ.get('DATABASE_READ_URL', uri)},
+    }
+
+app.config.update(database_config(app.config['SQLALCHEMY_DATABASE_URI']))
+app.config['READ_ONLY_PUBLIC_ROUTES'] = os.environ.get('READ_ONLY_PUBLIC_ROUTES', '1') == '1'
+# Applied to every new SQLite connection. WAL lets readers run alongside a writer;
+# busy_timeout makes a second writer wait for the lock instead of failing
+app.config['SQLITE_PRAGMAS'] = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'cache_size': -16000,  # KiB
+    'temp_store': 'memory',
+}
+
+# Catalog pagination (keyset on category, id)
+app.config['PASTRIES_PER_PAGE'] = 24
+app.config['ADMIN_PASTRIES_PER_PAGE'] = 50
+app.config['MAX_PASTRIES_PER_PAGE'] = 100
+app.config['API_PAGE_SIZE'] = 50  # /api/pastries default; ?per_page is clamped like the HTML pages
+
+# On-the-fly compression of dynamic responses (JSON API)
+app.config['COMPRESS_MIN_BYTES'] = 1024  # smaller bodies are sent as-is
+app.config['COMPRESS_GZIP_LEVEL'] = 6
+app.config['COMPRESS_BROTLI_QUALITY'] = 5
+
+# Rendered-page cache for anonymous visitors: 'memory', 'filesystem' or 'none'
+app.config['PAGE_CACHE_BACKEND'] = os.environ.get('PAGE_CACHE_BACKEND', 'memory')
+app.config['PAGE_CACHE_MAX_BYTES'] = 32 * 1024 * 1024  # LRU budget, in memory or on disk
+# Marketing/tracking query args that never change a page: left out of the cache key instead of
+# making the page uncacheable (see cached_page)
+app.config['PAGE_CACHE_IGNORED_ARGS'] = {'fbclid', 'gclid', 'igshid', 'ref', 'utm_source', 'utm_medium',
+                                         'utm_campaign', 'utm_term', 'utm_content'}
+app.config['PAGE_CACHE_DIR'] = os.environ.get('PAGE_CACHE_DIR')  # defaults to instance/page_cache
+
+# ASGI mode (asgi.py): threads running Flask views, and the largest response
+# collected in that thread before sending, so a slow client doesn't hold it
+app.config['ASGI_THREADS'] = int(os.environ.get('ASGI_THREADS', 8))
+app.config['ASGI_BUFFER_BYTES'] = 1024 * 1024
+
+# Rendered pastry cards (templates/_cards.html), reused until the pastry changes
+app.config['CARD_CACHE_MAX_BYTES'] = 8 * 1024 * 1024  # 0 disables
+# Compiled templates are kept on disk so new workers don't recompile them; '' disables
+app.config['TEMPLATE_BYTECODE_DIR'] = os.environ.get('TEMPLATE_BYTECODE_DIR', os.path.join(app.instance_path, 'jinja_cache'))
+
+# Mirror ingredients/allergens/features into normalized link tables on every write
+app.config['NORMALIZED_ATTRIBUTES'] = os.environ.get('NORMALIZED_ATTRIBUTES', '0') == '1'
+
+# Full-text search (SQLite FTS5)
+app.config['SEARCH_RESULTS_LIMIT'] = 48
+app.config['AUTOCOMPLETE_LIMIT'] = 8
+app.config['AUTOCOMPLETE_CANDIDATES'] = 500  # matches ranked per keystroke; bounds latency on broad prefixes
+
+# Keep per-category dashboard totals in the category_stats table, updated on every write
+app.config['MATERIALIZED_STATS'] = os.environ.get('MATERIALIZED_STATS', '0') == '1'
+
+# Session cart and checkout
+app.config['CART_MAX_LINES'] = 50  # distinct pastries per cart
+app.config['CART_MAX_QUANTITY'] = 99  # per pastry
+app.config['ORDER_NOTIFY_EMAIL'] = os.environ.get('ORDER_NOTIFY_EMAIL', 'your_email@gmail.com')
+app.config['LOW_STOCK_THRESHOLD'] = 5  # detail pages show "only N left" at or below this
+
+# Rate limits on admin login and the contact form, as (requests, window seconds) sliding windows.
+# Store: 'memory' (per worker), 'sqlite' (RATE_LIMIT_DB, shared by every worker on the host) or 'none'
+app.config['RATE_LIMIT_BACKEND'] = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+app.config['RATE_LIMIT_DB'] = os.environ.get('RATE_LIMIT_DB')  # defaults to instance/ratelimit.db
+app.config['RATE_LIMITS'] = {
+    'login_ip': (20, 600),  # login attempts per client IP
+    'login_user': (5, 600),  # attempts per username, cleared by logging in; also locks the real user out under attack
+    'contact_ip': (5, 3600),  # contact messages per client IP
+}
+# Behind a reverse proxy, trust this many X-Forwarded-For hops for the client IP (0: use the socket address)
+app.config['PROXY_FIX_X_FOR'] = int(os.environ.get('PROXY_FIX_X_FOR', 0))
+
+# WhatsApp Business Configuration
+WHATSAPP_NUMBER = '2348012345678'  # Replace with your WhatsApp number (include country code, no + or spaces)
+
+# Directory for uploaded images. Absolute, so every use resolves it the same way whatever the working directory
+UPLOAD_FOLDER = os.path.join(app.root_path, 'static', 'uploads')
+app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+
+# Request bodies over MAX_CONTENT_LENGTH get 413 before they are read
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 64 * 1024 * 1024))
+app.config['UPLOAD_MAX_FILE_BYTES'] = 16 * 1024 * 1024  # per image, whether posted whole or in chunks
+app.config['UPLOAD_WORKERS'] = 4  # gallery images stored in parallel
+# Resumable uploads (/admin/uploads), assembled outside the served tree. Finished files are
+# renamed into UPLOAD_FOLDER, so this must be on the same filesystem
+app.config['UPLOAD_INCOMING_FOLDER'] = os.environ.get('UPLOAD_INCOMING_FOLDER',
+                                                      os.path.join(app.instance_path, 'uploads_incoming'))
+app.config['UPLOAD_CHUNK_BYTES'] = 4 * 1024 * 1024  # chunk size suggested to clients
+app.config['UPLOAD_SESSION_TTL'] = 24 * 3600  # unfinished uploads older than this are removed by gc-uploads
+
+# Responsive image derivatives, written to static/uploads/derived/
+app.config['DERIVATIVE_WIDTHS'] = [200, 400, 800]
+app.config['DERIVATIVE_FORMATS'] = ['avif', 'webp']  # generated alongside a resized original
+
+# Background jobs (email, image work), persisted in the job table
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))  # in-process worker threads; 0 to disable
+app.config['JOB_POLL_SECONDS'] = 1.0
+app.config['JOB_MAX_ATTEMPTS'] = 5
+app.config['JOB_BACKOFF_SECONDS'] = 30  # doubled on each retry
+app.config['JOB_LOCK_TIMEOUT'] = 600  # running jobs older than this are assumed lost and requeued
+# Done jobs are deleted this long after they ran (dead ones are kept for requeue-dead-jobs);
+# the job workers sweep every JOB_PURGE_INTERVAL seconds
+app.config['JOB_RETENTION_SECONDS'] = int(os.environ.get('JOB_RETENTION_SECONDS', 7 * 24 * 3600))
+app.config['JOB_PURGE_INTERVAL'] = 3600
+app.config['JOB_REQUEUE_INTERVAL'] = 60  # how often the first job worker looks for stale running jobs
+app.config['EMAIL_BATCH_SIZE'] = 20  # messages sent per SMTP connection
+
+# Related pastries: top-K most similar items per pastry, stored in pastry_neighbor
+app.config['RELATED_PASTRIES'] = 3  # shown on the detail page
+app.config['SIMILARITY_NEIGHBORS'] = 6  # stored per pastry, so a removal rarely leaves a list short
+app.config['SIMILARITY_FIELD_WEIGHTS'] = {'category': 1.0, 'ingredient': 1.0, 'feature': 1.5, 'word': 0.5}
+app.config['SIMILARITY_EXACT_LIMIT'] = 500  # below this many pastries, compare every pair
+app.config['SIMILARITY_PERMUTATIONS'] = 4  # sorted orderings used to find candidates in larger catalogs
+app.config['SIMILARITY_WINDOW'] = 6  # neighbours on each side taken as candidates in each ordering
+app.config['SIMILARITY_CORPUS_MAX_AGE'] = 600  # seconds before refresh_similarity re-reads the whole catalog
+
+# Request metrics at /metrics in Prometheus text format (per worker process)
+# Scrapers send METRICS_TOKEN as "Authorization: Bearer <token>"; without one only a logged-in admin can read it
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+# Opt-in sampling profiler: requests slower than this dump folded stacks for flamegraph.pl/speedscope
+app.config['PROFILE_SLOW_REQUEST_MS'] = int(os.environ.get('PROFILE_SLOW_REQUEST_MS', 0))  # 0 disables
+app.config['PROFILE_SAMPLE_INTERVAL_MS'] = 5
+app.config['PROFILE_DIR'] = os.path.join(app.instance_path, 'profiles')
+app.config['PROFILE_MAX_DUMPS'] = 200  # oldest dumps are deleted beyond this
+
+# Bulk catalog import/export ('flask catalog import/export', /admin/catalog)
+app.config['IMPORT_BATCH_SIZE'] = 1000  # rows validated, downloaded and upserted per transaction
+app.config['IMPORT_MAX_REPORTED_ERRORS'] = 200  # per-line errors kept for the report; all are counted
+app.config['IMPORT_MAX_CONTENT_LENGTH'] = 512 * 1024 * 1024  # /admin/catalog accepts larger bodies
+
+# SQL statements a public page may issue once caches are warm; see `flask check-query-budget`
+app.config['PUBLIC_QUERY_BUDGET'] = 4
+app.config['ENFORCE_QUERY_BUDGET'] = os.environ.get('ENFORCE_QUERY_BUDGET') == '1'  # fail over-budget requests
+app.config['PASTRY_LINK_CACHE_SIZE'] = 10000  # pastries whose image/WhatsApp URLs are kept precomputed
+
+# Uploads are content-addressed, so they never change under the same URL
+app.config['IMMUTABLE_MAX_AGE'] = 365 * 24 * 3600
+# Hand file bytes to the front proxy: None, 'x-sendfile' (Apache/lighttpd) or 'x-accel' (nginx)
+app.config['SENDFILE_MODE'] = os.environ.get('SENDFILE_MODE') or None
+app.config['USE_X_SENDFILE'] = app.config['SENDFILE_MODE'] == 'x-sendfile'
+app.config['X_ACCEL_PREFIX'] = os.environ.get('X_ACCEL_PREFIX', '/_protected/')  # nginx internal location
+
+# Orphaned uploads younger than this are left alone by 'flask gc-uploads'
+app.config['UPLOAD_GC_GRACE_SECONDS'] = 3600
+
+# Seed image downloads (populate_initial_data)
+app.config['SEED_DOWNLOAD_WORKERS'] = 8
+app.config['SEED_DOWNLOAD_RETRIES'] = 3
+app.config['SEED_DOWNLOAD_BACKOFF'] = 0.5  # seconds, doubled on each retry
+app.config['SEED_MANIFEST'] = os.path.join(app.instance_path, 'seed_manifest.json')
+app.config['SEED_SNAPSHOT'] = os.environ.get('SEED_SNAPSHOT', os.path.join(app.root_path, 'seed'))  # see `flask seed`
+
+if not os.path.exists(UPLOAD_FOLDER):
+    os.makedirs(UPLOAD_FOLDER)
+
+if app.config['TEMPLATE_BYTECODE_DIR']:
+    os.makedirs(app.config['TEMPLATE_BYTECODE_DIR'], exist_ok=True)
+    # Read when app.jinja_env is first created, so this must come before any template setup
+    app.jinja_options = {**app.jinja_options,
+                         'bytecode_cache': FileSystemBytecodeCache(app.config['TEMPLATE_BYTECODE_DIR'])}
+
+class RoutingSession(FlaskSQLAlchemySession):
+    """Session that sends queries from read-only views to the 'read' bind.
+
+    Statements executed directly land on the read bind's query-only
+    connections and fail there; an ORM flush raises here instead, since it
+    would otherwise go to the primary and succeed.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and has_request_context()
+                and g.get('db_read_only') and 'read' in self._db.engines):
+            if self._flushing:
+                raise RuntimeError(f'{request.endpoint} is a read-only view (see read_only_view) but flushed a write')
+            return self._db.engines['read']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def sqlite_pragma_listener(query_only):
+    def apply_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        for name, value in app.config['SQLITE_PRAGMAS'].items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        if query_only:
+            cursor.execute('PRAGMA query_only = ON')
+        cursor.close()
+    return apply_pragmas
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+login_manager = LoginManager()
+login_manager.login_view = 'admin_login'
+login_manager.login_message_category = 'info'
+
+# --- Application Factory ---
+# Routes and handlers are registered on the module-level app as it is
+# imported; the extensions are only bound to it when an app context is first
+# pushed (or create_app() is called), so config can still be changed until then.
+_extensions_ready = False
+_extensions_lock = RLock()
+_schema_migrated = False
+
+def init_extensions():
+    """Bind the database, mail and login extensions to the app, once"""
+    global _extensions_ready
+    if _extensions_ready:
+        return
+    with _extensions_lock:
+        if _extensions_ready or 'sqlalchemy' in app.extensions:
+            return  # already bound, or being bound further up this thread's stack
+        mail.init_app(app)
+        login_manager.init_app(app)
+        db.init_app(app)
+        with app.app_context():
+            for bind_key, engine in db.engines.items():
+                if engine.dialect.name == 'sqlite':
+                    event.listen(engine, 'connect', sqlite_pragma_listener(query_only=bind_key == 'read'))
+        _extensions_ready = True
+
+@appcontext_pushed.connect_via(app)
+def _bind_extensions(sender, **extra):
+    init_extensions()
+
+def create_app(config=None):
+    """The application, ready to serve: `gunicorn 'app:create_app()'`.
+
+    `config` overrides settings before the extensions read them. The app is
+    a single module-level instance, so later calls return it unchanged, and
+    passing settings that differ once the extensions are bound (by an
+    earlier call or app context) raises RuntimeError rather than ignoring them.
+    """
+    if config and (_extensions_ready or 'sqlalchemy' in app.extensions):
+        changed = sorted(key for key, value in config.items() if app.config.get(key, object()) != value)
+        if changed:
+            raise RuntimeError(f"create_app() got {', '.join(changed)} after the extensions were bound; "
+                               "set config before the first create_app() call or app context")
+    elif config:
+        if 'SQLALCHEMY_DATABASE_URI' in config:
+            app.config.pop('SQLALCHEMY_ENGINE_OPTIONS', None)
+            app.config.pop('SQLALCHEMY_BINDS', None)
+            app.config.update(database_config(config['SQLALCHEMY_DATABASE_URI']))
+        app.config.update(config)
+    global _schema_migrated
+    init_extensions()
+    if app.config['MIGRATE_ON_START'] and not _schema_migrated:
+        with app.app_context():
+            migrate_schema()
+        _schema_migrated = True
+    # Done here rather than on the first query, so a preloading server does it once before forking
+    configure_mappers()
+    return app
+
+# --- Helper Functions ---
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+class UploadRejected(ValueError):
+    """An upload that is not a supported image or is over the size limit"""
+
+IMAGE_SIGNATURES = [(b'\x89PNG\r\n\x1a\n', '.png'), (b'\xff\xd8\xff', '.jpg'),
+                    (b'GIF87a', '.gif'), (b'GIF89a', '.gif')]
+
+def sniff_image_extension(head):
+    """Extension for an image recognised by its leading bytes (at least 12), or None"""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    return None
+
+def publish_upload(tmp_path, filename):
+    """Rename a fully written temporary file to `filename` in the upload folder, returning (filename, is_new).
+
+    Identical content already on disk is reused instead of being stored twice.
+    """
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if os.path.exists(file_path):
+        os.remove(tmp_path)
+        os.utime(file_path)  # a fresh reference; keep it out of the GC grace window
+        return filename, False
+    os.replace(tmp_path, file_path)
+    return filename, True
+
+def store_upload(chunks, max_bytes=None):
+    """Stream `chunks` into the upload folder under their SHA-256, returning (filename, is_new).
+
+    The content is hashed while it is written to a temporary file, which is
+    then renamed to <sha256><ext>. The extension comes from the content's
+    magic bytes, not from a client-supplied name or Content-Type; content
+    that is not a supported image, or runs past `max_bytes`, raises
+    UploadRejected and leaves nothing behind.
+    """
+    tmp_path = os.path.join(app.config['UPLOAD_FOLDER'], f'.{uuid.uuid4().hex}.part')
+    digest = hashlib.sha256()
+    head = b''
+    size = 0
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise UploadRejected(f'larger than {max_bytes / (1024 * 1024):g} MB')
+                if len(head) < 16:
+                    head += chunk[:16 - len(head)]
+                digest.update(chunk)
+                f.write(chunk)
+        extension = sniff_image_extension(head)
+        if extension is None:
+            raise UploadRejected('not a PNG, JPEG, GIF or WebP image')
+    except BaseException:
+        # open() itself may have failed; don't let a missing temp file hide the real error
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+    return publish_upload(tmp_path, digest.hexdigest() + extension)
+
+def _store_file_storage(file):
+    return store_upload(iter(lambda: file.stream.read(65536), b''), app.config['UPLOAD_MAX_FILE_BYTES'])
+
+def save_uploaded_file(file):
+    """Store an uploaded image, returning its filename (None if no file was sent)"""
+    if not file or not file.filename:
+        return None
+    filename, is_new = _store_file_storage(file)
+    if is_new:
+        schedule_derivatives(filename)
+    return filename
+
+def save_uploaded_files(files):
+    """Store several uploaded images in parallel, returning their filenames in order.
+
+    Only the copying and hashing run on the pool; derivative jobs are queued
+    from the calling thread, in its transaction.
+    """
+    files = [file for file in files if file and file.filename]
+    if len(files) > 1:
+        with ThreadPoolExecutor(max_workers=app.config['UPLOAD_WORKERS']) as pool:
+            stored = list(pool.map(_store_file_storage, files))
+    else:
+        stored = [_store_file_storage(file) for file in files]
+    for filename, is_new in stored:
+        if is_new:
+            schedule_derivatives(filename)
+    return [filename for filename, _ in stored]
+
+def finished_upload(filename):
+    """`filename` if it names an image already in the upload folder (e.g. from /admin/uploads), else None"""
+    if (filename and re.fullmatch(r'[0-9a-f]{64}\.(png|jpg|gif|webp)', filename)
+            and os.path.isfile(os.path.join(app.config['UPLOAD_FOLDER'], filename))):
+        return filename
+    return None
+
+def make_http_session(pool_size):
+    """requests.Session whose connection pool can serve `pool_size` threads at once"""
+    # Imported here: only downloads need requests, and it adds ~80 ms to every worker's startup
+    import requests
+    from requests.adapters import HTTPAdapter
+    http = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    http.mount('http://', adapter)
+    http.mount('https://', adapter)
+    return http
+
+def download_and_save_image(image_url, http=None, retries=0, backoff=0.5):
+    """Download an image into the upload folder, returning (filename, sha256) or None"""
+    if not image_url:
+        return None
+    if http is None:
+        import requests
+        http = requests
+    for attempt in range(retries + 1):
+        try:
+            response = http.get(image_url, stream=True, timeout=10)
+            response.raise_for_status()
+            filename, _ = store_upload(response.iter_content(chunk_size=65536), app.config['UPLOAD_MAX_FILE_BYTES'])
+            return filename, os.path.splitext(filename)[0]
+        except Exception as e:
+            status = getattr(getattr(e, 'response', None), 'status_code', None)
+            permanent = isinstance(e, UploadRejected) or (status is not None and 400 <= status < 500 and status != 429)
+            if attempt < retries and not permanent:
+                time.sleep(backoff * (2 ** attempt))
+                continue
+            print(f"Error downloading image {image_url}: {e}")
+            return None
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_seed_manifest(path):
+    """Manifest of previously seeded images: {url: {'filename': ..., 'sha256': ...}}"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_seed_manifest(path, manifest):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def download_images(urls, workers=None, manifest_path=None):
+    """Download `urls` concurrently, returning {url: filename} for every success.
+
+    URLs already recorded in the manifest are skipped as long as their file
+    is still on disk with the recorded content hash, so an interrupted seed
+    can simply be re-run. The manifest is saved after every download.
+    """
+    workers = workers or app.config['SEED_DOWNLOAD_WORKERS']
+    manifest_path = manifest_path or app.config['SEED_MANIFEST']
+    manifest = load_seed_manifest(manifest_path)
+
+    results = {}
+    pending = []
+    for url in dict.fromkeys(u for u in urls if u):
+        entry = manifest.get(url)
+        if entry:
+            path = os.path.join(app.config['UPLOAD_FOLDER'], entry['filename'])
+            if os.path.exists(path):
+                if file_sha256(path) == entry['sha256']:
+                    results[url] = entry['filename']
+                    continue
+                os.remove(path)  # damaged; publish_upload would otherwise keep it over the fresh copy
+        pending.append(url)
+
+    total = len(results) + len(pending)
+    if results:
+        print(f"Reusing {len(results)} of {total} images from {manifest_path}")
+    if not pending:
+        return results
+
+    done = len(results)
+    with make_http_session(workers) as http, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(download_and_save_image, url, http,
+                        app.config['SEED_DOWNLOAD_RETRIES'], app.config['SEED_DOWNLOAD_BACKOFF']): url
+            for url in pending
+        }
+        for future in as_completed(futures):
+            url = futures[future]
+            done += 1
+            downloaded = future.result()
+            if downloaded:
+                filename, sha256 = downloaded
+                results[url] = filename
+                manifest[url] = {'filename': filename, 'sha256': sha256}
+                save_seed_manifest(manifest_path, manifest)
+                print(f"[{done}/{total}] {url} -> {filename}")
+            else:
+                print(f"[{done}/{total}] {url} failed")
+    return results
+
+# --- Upload Serving ---
+def upload_url(filename):
+    """URL for an uploaded file. Uploads are never rewritten under the same
+    name (new ones are content-addressed), so the name is the fingerprint."""
+    return url_for('uploaded_file', filename=filename)
+
+def send_immutable(directory, filename):
+    """Serve a file with long-lived cache headers and optional X-Sendfile /
+    X-Accel-Redirect handoff to the front proxy."""
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    if app.config['SENDFILE_MODE'] == 'x-accel':
+        relative = os.path.relpath(path, app.root_path).replace(os.sep, '/')
+        response = make_response('')
+        response.headers['X-Accel-Redirect'] = app.config['X_ACCEL_PREFIX'] + relative
+        response.mimetype = mimetype
+    else:
+        # With USE_X_SENDFILE set, send_file emits X-Sendfile instead of the body
+        response = send_file(path, mimetype=mimetype, conditional=True, etag=True)
+    response.headers['Cache-Control'] = f"public, max-age={app.config['IMMUTABLE_MAX_AGE']}, immutable"
+    return response
+
+# --- Resumable Uploads ---
+# A client declares the file size, then PATCHes the bytes in order, each
+# chunk carrying the offset it starts at. The upload's progress is simply the
+# size of its .part file, so after a dropped connection the client asks for
+# the offset and carries on from there. The finished file goes through the
+# same sniff/hash/rename as any other upload.
+def incoming_folder():
+    return app.config['UPLOAD_INCOMING_FOLDER']
+
+def upload_session_paths(upload_id):
+    """(.part path, .json path) for an upload id, or None if the id is malformed"""
+    if not re.fullmatch(r'[0-9a-f]{32}', upload_id or ''):
+        return None
+    base = os.path.join(incoming_folder(), upload_id)
+    return base + '.part', base + '.json'
+
+def create_upload_session(size):
+    max_bytes = app.config['UPLOAD_MAX_FILE_BYTES']
+    if not 0 < size <= max_bytes:
+        raise UploadRejected(f'size must be between 1 byte and {max_bytes / (1024 * 1024):g} MB')
+    upload_id = uuid.uuid4().hex
+    part_path, meta_path = upload_session_paths(upload_id)
+    os.makedirs(incoming_folder(), exist_ok=True)
+    open(part_path, 'wb').close()
+    with open(meta_path, 'w') as f:
+        json.dump({'size': size, 'created': time.time()}, f)
+    return upload_id
+
+def get_upload_session(upload_id):
+    """{'size', 'offset', ...} for an unfinished upload, or None"""
+    paths = upload_session_paths(upload_id)
+    if paths is None:
+        return None
+    try:
+        with open(paths[1]) as f:
+            info = json.load(f)
+        info['offset'] = os.path.getsize(paths[0])
+    except (OSError, ValueError):
+        return None
+    return info
+
+class UploadOffsetMismatch(Exception):
+    """A chunk whose offset isn't where the upload currently ends (a retry, or a parallel PATCH)"""
+
+    def __init__(self, offset):
+        super().__init__(offset)
+        self.offset = offset
+
+def append_upload_chunk(upload_id, info, stream, offset):
+    """Append a request body starting at `offset` to an upload, returning the new offset.
+
+    The .part file is locked while the chunk is written, and the offset is
+    checked again under the lock: of two PATCHes for the same offset, the
+    second raises UploadOffsetMismatch. A chunk that would run past the
+    declared size is discarded.
+    """
+    part_path, _ = upload_session_paths(upload_id)
+    # r+b, not ab: if a parallel PATCH has just finished the upload, don't recreate its .part
+    with open(part_path, 'r+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)  # released when the file is closed
+        if f.seek(0, os.SEEK_END) != offset:
+            raise UploadOffsetMismatch(f.tell())
+        for chunk in iter(lambda: stream.read(65536), b''):
+            if f.tell() + len(chunk) > info['size']:
+                f.truncate(offset)
+                raise UploadRejected('chunk runs past the declared size')
+            f.write(chunk)
+        return f.tell()
+
+def finish_upload_session(upload_id):
+    """Move a complete upload into the upload folder, returning (filename, is_new)"""
+    part_path, meta_path = upload_session_paths(upload_id)
+    with open(part_path, 'rb') as f:
+        extension = sniff_image_extension(f.read(16))
+    if extension is None:
+        discard_upload_session(upload_id)
+        raise UploadRejected('not a PNG, JPEG, GIF or WebP image')
+    os.remove(meta_path)
+    return publish_upload(part_path, file_sha256(part_path) + extension)
+
+def discard_upload_session(upload_id):
+    for path in upload_session_paths(upload_id):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+# --- Upload Garbage Collection ---
+def referenced_uploads():
+    """Every upload filename referenced by a pastry's main image or gallery"""
+    names = set()
+    for image, gallery_json in db.session.query(Pastry.image, Pastry.gallery_json).yield_per(5000):
+        if image:
+            names.add(image)
+        if gallery_json:
+            names.update(json.loads(gallery_json))
+    return names
+
+def find_orphaned_uploads(grace_seconds=None):
+    """Mark-and-sweep: (path, size) for uploads, derivatives, stale temp files and abandoned
+    resumable uploads that nothing references.
+
+    Files modified within the grace period are skipped, which covers uploads
+    whose pastry hasn't been committed yet and deduplicated re-uploads.
+    """
+    if grace_seconds is None:
+        grace_seconds = app.config['UPLOAD_GC_GRACE_SECONDS']
+    cutoff = time.time() - grace_seconds
+    live = referenced_uploads()
+    live_stems = {os.path.splitext(name)[0] for name in live}
+
+    orphans = []
+    def sweep(folder, is_live, cutoff=cutoff):
+        try:
+            entries = list(os.scandir(folder))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if not entry.is_file() or is_live(entry.name):
+                continue
+            stat = entry.stat()
+            if stat.st_mtime < cutoff:
+                orphans.append((entry.path, stat.st_size))
+
+    sweep(app.config['UPLOAD_FOLDER'], lambda name: name in live)
+    sweep(derived_folder(), lambda name: re.sub(r'-\d+w\.\w+$', '', name) in live_stems)
+    # Abandoned resumable uploads; an active one is touched by every chunk
+    sweep(incoming_folder(), lambda name: False, cutoff=time.time() - app.config['UPLOAD_SESSION_TTL'])
+    return sorted(orphans)
+
+def collect_upload_garbage(dry_run=True, grace_seconds=None):
+    """Delete orphaned uploads (unless dry_run), returning what was found"""
+    orphans = find_orphaned_uploads(grace_seconds)
+    if not dry_run:
+        for path, _ in orphans:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        derived = [re.match(r'(.+)-\d+w\.\w+$', os.path.basename(path)) for path, _ in orphans
+                   if os.path.dirname(path) == derived_folder()]
+        record_derivatives({match.group(1): {} for match in derived if match})
+    return orphans
+
+# --- Image Derivatives ---
+DERIVATIVE_MIMETYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'jpg': 'image/jpeg', 'png': 'image/png'}
+DERIVATIVE_SAVE_OPTIONS = {
+    'avif': {'quality': 60},
+    'webp': {'quality': 80, 'method': 4},
+    'jpg': {'quality': 82, 'optimize': True, 'progressive': True},
+    'png': {'optimize': True},
+}
+
+def derived_folder():
+    return os.path.join(app.config['UPLOAD_FOLDER'], 'derived')
+
+def derivative_name(filename, width, fmt):
+    return f'{os.path.splitext(filename)[0]}-{width}w.{fmt}'
+
+def derivative_formats():
+    """Formats to generate: the configured modern formats Pillow can write, plus a resized original"""
+    if Image is None:
+        return []
+    formats = [fmt for fmt in app.config['DERIVATIVE_FORMATS'] if pil_features.check(fmt)]
+    return formats + ['fallback']
+
+def generate_derivatives(filename):
+    """Write every missing width/format variant of an uploaded image, returning how many were created"""
+    if Image is None:
+        return 0
+    source = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    os.makedirs(derived_folder(), exist_ok=True)
+    created = 0
+    variants = {}
+    try:
+        with Image.open(source) as original:
+            original = ImageOps.exif_transpose(original)
+            fallback = 'png' if original.mode in ('RGBA', 'LA', 'P') else 'jpg'
+            # Widths past the original are capped to it, so the largest variant is full size
+            for width in sorted({min(w, original.width) for w in app.config['DERIVATIVE_WIDTHS']}):
+                resized = None
+                for fmt in derivative_formats():
+                    fmt = fallback if fmt == 'fallback' else fmt
+                    target = os.path.join(derived_folder(), derivative_name(filename, width, fmt))
+                    if os.path.exists(target):
+                        variants.setdefault(fmt, []).append(width)
+                        continue
+                    if resized is None:
+                        height = round(original.height * width / original.width)
+                        resized = original if width == original.width else original.resize((width, height), Image.LANCZOS)
+                    image = resized.convert('RGB') if fmt == 'jpg' and resized.mode != 'RGB' else resized
+                    tmp_path = f'{target}.{uuid.uuid4().hex}.tmp'
+                    image.save(tmp_path, format='JPEG' if fmt == 'jpg' else fmt.upper(),
+                               **DERIVATIVE_SAVE_OPTIONS[fmt])
+                    os.replace(tmp_path, target)
+                    variants.setdefault(fmt, []).append(width)
+                    created += 1
+    except (OSError, ValueError) as e:
+        print(f"Error generating derivatives for {filename}: {e}")
+    if variants:
+        record_derivatives({os.path.splitext(filename)[0]: variants})
+    return created
+
+def scan_derived_folder():
+    """{stem: {format: [widths]}} for every file in the derived folder (migrations only, not requests)"""
+    variants = {}
+    try:
+        names = os.listdir(derived_folder())
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        match = re.match(r'(.+)-(\d+)w\.(\w+)$', name)
+        if match:
+            stem, width, fmt = match.group(1), int(match.group(2)), match.group(3)
+            variants.setdefault(stem, {}).setdefault(fmt, []).append(width)
+    return variants
+
+def record_derivatives(variants):
+    """Store {stem: {format: [widths]}} in image_derivatives and let every process's index pick it up.
+
+    Pushes its own app context, so backfill threads can call it too.
+    """
+    if not variants:
+        return
+    now = time.time()
+    rows = [{'stem': stem, 'variants_json': json.dumps({fmt: sorted(widths) for fmt, widths in formats.items()}),
+             'updated_at': now} for stem, formats in variants.items()]
+    table = ImageDerivatives.__table__
+    with app.app_context(), db.engine.begin() as connection:
+        stems = list(variants)
+        for start in range(0, len(stems), 500):
+            connection.execute(table.delete().where(table.c.stem.in_(stems[start:start + 500])))
+        connection.execute(table.insert(), rows)
+    _bump_versions(['derivatives'])
+
+class DerivativeIndex:
+    """Which derivatives exist for each upload, mirrored from the image_derivatives table.
+
+    Templates ask for srcsets on every card, so lookups are dict reads. Once
+    per request the derivatives version (bumped by record_derivatives in any
+    process) is checked, and only if it moved are the rows written since the
+    last sync read.
+    """
+    SYNC_OVERLAP = 60  # seconds re-read before the last sync, for rows committed while it ran
+
+    def __init__(self):
+        self._lock = Lock()
+        self._variants = {}
+        self._version = None
+        self._synced_at = 0.0
+
+    def refresh(self):
+        if has_request_context():
+            if g.get('derivative_index_checked'):
+                return
+            g.derivative_index_checked = True
+        version = _read_version('derivatives')
+        if version == self._version:
+            return
+        with self._lock:
+            started = time.time()
+            rows = db.session.execute(db.select(ImageDerivatives.stem, ImageDerivatives.variants_json).where(
+                ImageDerivatives.updated_at >= self._synced_at - self.SYNC_OVERLAP)).all()
+            variants = dict(self._variants)
+            for stem, variants_json in rows:
+                formats = json.loads(variants_json)
+                if formats:
+                    variants[stem] = formats
+                else:
+                    variants.pop(stem, None)
+            self._variants = variants
+            self._version, self._synced_at = version, started
+
+    def variants(self, filename):
+        """{format: [widths]} available for `filename`"""
+        self.refresh()
+        return self._variants.get(os.path.splitext(filename)[0], {})
+
+derivative_index = DerivativeIndex()
+
+def schedule_derivatives(filename):
+    """Queue derivative generation so uploads don't wait on image encoding"""
+    if Image is None or not filename:
+        return None
+    # Rides along with the caller's commit, so a half-edited pastry is never flushed early
+    return enqueue_job('generate_derivatives', {'filename': filename}, commit=False)
+
+def responsive_sources(filename):
+    """srcset data for an uploaded image: {'srcset': ..., 'sources': [(mimetype, srcset), ...]}"""
+    result = {'srcset': '', 'sources': []}
+    if not filename:
+        return result
+    for fmt, widths in derivative_index.variants(filename).items():
+        srcset = ', '.join(
+            f"{upload_url('derived/' + derivative_name(filename, w, fmt))} {w}w"
+            for w in widths)
+        if fmt in ('jpg', 'png'):
+            result['srcset'] = srcset
+        else:
+            result['sources'].append((DERIVATIVE_MIMETYPES[fmt], srcset))
+    # Prefer AVIF over WebP when the browser supports both
+    result['sources'].sort(key=lambda source: source[0] != 'image/avif')
+    return result
+
+def encode_cursor(category, pastry_id):
+    """Encode a (category, id) position as an opaque URL-safe token"""
+    raw = json.dumps([category, pastry_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(token):
+    """Decode a cursor token, returning None if it is missing or malformed"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        category, pastry_id = json.loads(raw)
+        return str(category), int(pastry_id)
+    except (ValueError, TypeError):
+        return None
+
+def get_page_size(default_key):
+    """Read ?per_page from the request, clamped to the configured maximum"""
+    per_page = request.args.get('per_page', type=int) or app.config[default_key]
+    return max(1, min(per_page, app.config['MAX_PASTRIES_PER_PAGE']))
+
+def paginate_pastries(query, per_page, after=None, before=None):
+    """Keyset-paginate a Pastry query ordered by (category, id).
+
+    Only one of `after`/`before` is honoured. Returns the page items together
+    with cursors for the next and previous pages (None when there is none).
+    """
+    key = tuple_(Pastry.category, Pastry.id)
+    after = decode_cursor(after)
+    before = None if after else decode_cursor(before)
+
+    if before:
+        rows = query.filter(key < before).order_by(
+            Pastry.category.desc(), Pastry.id.desc()).limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        has_next, has_prev = True, has_more
+    else:
+        if after:
+            query = query.filter(key > after)
+        rows = query.order_by(Pastry.category, Pastry.id).limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        items = rows[:per_page]
+        has_next, has_prev = has_more, after is not None
+
+    next_cursor = encode_cursor(items[-1].category, items[-1].id) if items and has_next else None
+    prev_cursor = encode_cursor(items[0].category, items[0].id) if items and has_prev else None
+    return items, next_cursor, prev_cursor
+
+PLACEHOLDER_IMAGE_URL = 'https://placehold.co/400x400/cccccc/333333?text=No+Image'
+
+def generate_whatsapp_link(pastry_name, pastry_price):
+    """Generate WhatsApp link with pre-filled message"""
+    message = f"Hello! I'm interested in ordering {pastry_name} priced at ₦{pastry_price:,.0f}. Is it available?"
+    encoded_message = quote(message)
+    return f"https://wa.me/{WHATSAPP_NUMBER}?text={encoded_message}"
+
+# --- Database Models ---
+class JSONListColumn:
+    """List view of a *_json text column.
+
+    The decoded value is memoized on the instance and reused until the
+    underlying column value changes (assignment through this descriptor,
+    a direct column write, or a refresh from the database).
+    """
+
+    def __init__(self, column_name):
+        self.column_name = column_name
+        self.cache_name = f'_{column_name}_decoded'
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        raw = getattr(obj, self.column_name)
+        cached = obj.__dict__.get(self.cache_name)
+        if cached is not None and cached[0] is raw:
+            return cached[1]
+        value = json.loads(raw) if raw else []
+        obj.__dict__[self.cache_name] = (raw, value)
+        return value
+
+    def __set__(self, obj, value):
+        value = list(value)
+        raw = json.dumps(value)
+        setattr(obj, self.column_name, raw)
+        obj.__dict__[self.cache_name] = (raw, value)
+
+class User(db.Model, UserMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(20), unique=True, nullable=False)
+    password_hash = db.Column(db.String(128), nullable=False)
+
+    def set_password(self, password):
+        self.password_hash = generate_password_hash(password)
+
+    def check_password(self, password):
+        return check_password_hash(self.password_hash, password)
+
+class Ingredient(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+
+class Allergen(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+
+class Feature(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+
+def _pastry_link_table(name, target):
+    return db.Table(
+        name,
+        db.Column('pastry_id', db.Integer, db.ForeignKey('pastry.id', ondelete='CASCADE'), primary_key=True),
+        db.Column(f'{target}_id', db.Integer, db.ForeignKey(f'{target}.id', ondelete='CASCADE'), primary_key=True),
+        db.Index(f'ix_{name}_{target}_id', f'{target}_id', 'pastry_id'),
+    )
+
+pastry_ingredients = _pastry_link_table('pastry_ingredient', 'ingredient')
+pastry_allergens = _pastry_link_table('pastry_allergen', 'allergen')
+pastry_features = _pastry_link_table('pastry_feature', 'feature')
+
+class Pastry(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    category = db.Column(db.String(50), nullable=False, index=True)  # Cakes, Cookies, Bread, Donuts, etc.
+    price = db.Column(db.Float, nullable=False)
+    image = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text, nullable=False)
+    serving_size = db.Column(db.String(50), nullable=True)  # e.g., "Serves 10-12", "6 pieces", etc.
+    available = db.Column(db.Boolean, default=True, index=True)  # Is it currently available?
+    stock = db.Column(db.Integer, nullable=True)  # Units left to sell; None means made to order (not tracked)
+    
+    gallery_json = db.Column(db.Text, nullable=True)
+    ingredients_json = db.Column(db.Text, nullable=True)  # List of ingredients
+    allergens_json = db.Column(db.Text, nullable=True)  # List of allergens
+    features_json = db.Column(db.Text, nullable=True)  # Special features (e.g., "Sugar-free", "Gluten-free")
+
+    # Backs keyset pagination over (category, id)
+    __table_args__ = (db.Index('ix_pastry_category_id', 'category', 'id'),)
+
+    gallery = JSONListColumn('gallery_json')
+    ingredients = JSONListColumn('ingredients_json')
+    allergens = JSONListColumn('allergens_json')
+    features = JSONListColumn('features_json')
+
+    # Normalized copies of ingredients/allergens/features, kept in sync when
+    # NORMALIZED_ATTRIBUTES is enabled so they can be filtered in SQL
+    ingredient_tags = db.relationship('Ingredient', secondary=pastry_ingredients, backref='pastries')
+    allergen_tags = db.relationship('Allergen', secondary=pastry_allergens, backref='pastries')
+    feature_tags = db.relationship('Feature', secondary=pastry_features, backref='pastries')
+    
+    @property
+    def image_url(self):
+        return pastry_links.get(self)['image_url']
+
+    @property
+    def image_sources(self):
+        return responsive_sources(self.image)
+
+    @property
+    def gallery_urls(self):
+        return pastry_links.get(self)['gallery_urls']
+
+    @property
+    def gallery_sources(self):
+        return [responsive_sources(filename) for filename in self.gallery]
+
+    @property
+    def in_stock(self):
+        """Can be ordered: available, and not sold out if its stock is tracked"""
+        return self.available and self.stock != 0
+    
+    @property
+    def whatsapp_link(self):
+        return pastry_links.get(self)['whatsapp_link']
+
+class Job(db.Model):
+    """A unit of background work; failed jobs are retried, then dead-lettered"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload_json = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending, running, done, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.Float, nullable=False, default=time.time)
+    locked_by = db.Column(db.String(100), nullable=True)
+    locked_at = db.Column(db.Float, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.Float, nullable=False, default=time.time)
+
+    __table_args__ = (db.Index('ix_job_status_run_at', 'status', 'run_at'),)
+
+    @property
+    def payload(self):
+        return json.loads(self.payload_json)
+
+class ImageDerivatives(db.Model):
+    """The width/format variants generated for an upload, so pages never list the derived folder"""
+    __tablename__ = 'image_derivatives'
+    stem = db.Column(db.String(200), primary_key=True)  # upload filename without its extension
+    variants_json = db.Column(db.Text, nullable=False)  # {format: [widths]}; {} once they were removed
+    updated_at = db.Column(db.Float, nullable=False, index=True)
+
+class PastryNeighbor(db.Model):
+    """One entry of a pastry's precomputed most-similar list, rank 0 being the closest"""
+    __tablename__ = 'pastry_neighbor'
+    pastry_id = db.Column(db.Integer, db.ForeignKey('pastry.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    neighbor_id = db.Column(db.Integer, db.ForeignKey('pastry.id', ondelete='CASCADE'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+
+    # Finds the lists a changed pastry appears in
+    __table_args__ = (db.Index('ix_pastry_neighbor_neighbor_id', 'neighbor_id'),)
+
+class Order(db.Model):
+    """A checked-out cart. Items keep the name and price they were ordered at."""
+    __tablename__ = 'orders'
+    id = db.Column(db.Integer, primary_key=True)
+    reference = db.Column(db.String(16), unique=True, nullable=False,
+                          default=lambda: uuid.uuid4().hex[:12].upper())
+    customer_name = db.Column(db.String(100), nullable=False)
+    phone = db.Column(db.String(30), nullable=False)
+    email = db.Column(db.String(120), nullable=True)
+    note = db.Column(db.Text, nullable=True)
+    total = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='new')
+    created_at = db.Column(db.Float, nullable=False, default=time.time, index=True)
+
+    items = db.relationship('OrderItem', backref='order', cascade='all, delete-orphan', order_by='OrderItem.id')
+
+    @property
+    def placed_at(self):
+        return time.strftime('%Y-%m-%d %H:%M', time.localtime(self.created_at))
+
+class OrderItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id', ondelete='CASCADE'), nullable=False, index=True)
+    pastry_id = db.Column(db.Integer, db.ForeignKey('pastry.id', ondelete='SET NULL'), nullable=True)
+    name = db.Column(db.String(100), nullable=False)
+    unit_price = db.Column(db.Float, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+
+    @property
+    def subtotal(self):
+        return self.unit_price * self.quantity
+
+class CategoryStats(db.Model):
+    """Materialized per-category totals maintained alongside Pastry writes"""
+    __tablename__ = 'category_stats'
+    category = db.Column(db.String(50), primary_key=True)
+    pastry_count = db.Column(db.Integer, nullable=False, default=0)
+    available_count = db.Column(db.Integer, nullable=False, default=0)
+    total_price = db.Column(db.Float, nullable=False, default=0)
+
+# --- Normalized Attributes ---
+# (JSON column, relationship, tag model) for each normalized list attribute
+PASTRY_TAG_ATTRIBUTES = [
+    ('ingredients_json', 'ingredient_tags', Ingredient),
+    ('allergens_json', 'allergen_tags', Allergen),
+    ('features_json', 'feature_tags', Feature),
+]
+
+def get_or_create_tags(session, model, names, created):
+    """Tag rows for `names`, creating any that don't exist yet.
+
+    `created` carries tags made earlier in the same flush so that two new
+    pastries sharing a new allergen don't both insert it.
+    """
+    names = list(dict.fromkeys(n for n in names if n))
+    tags = {name: created[(model, name)] for name in names if (model, name) in created}
+    missing = [name for name in names if name not in tags]
+    if missing:
+        with session.no_autoflush:
+            for tag in session.query(model).filter(model.name.in_(missing)):
+                tags[tag.name] = tag
+        for name in missing:
+            if name not in tags:
+                tag = model(name=name)
+                session.add(tag)
+                tags[name] = created[(model, name)] = tag
+    return [tags[name] for name in names]
+
+def sync_pastry_tags(session, pastry, created, force=False):
+    state = sa_inspect(pastry)
+    for column, relationship, model in PASTRY_TAG_ATTRIBUTES:
+        if force or state.attrs[column].history.has_changes():
+            raw = getattr(pastry, column)
+            setattr(pastry, relationship, get_or_create_tags(session, model, json.loads(raw) if raw else [], created))
+
+@event.listens_for(db.session, 'before_flush')
+def sync_normalized_attributes(session, flush_context, instances):
+    """Mirror changed *_json lists into the normalized link tables"""
+    if not app.config['NORMALIZED_ATTRIBUTES']:
+        return
+    created = {}
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Pastry):
+            sync_pastry_tags(session, obj, created)
+
+def migrate_normalized_attributes(batch_size=500):
+    """Populate the link tables from the existing *_json columns"""
+    created = {}
+    last_id = 0
+    while True:
+        batch = Pastry.query.filter(Pastry.id > last_id).order_by(Pastry.id).limit(batch_size).all()
+        if not batch:
+            break
+        for pastry in batch:
+            sync_pastry_tags(db.session, pastry, created, force=True)
+        db.session.commit()
+        last_id = batch[-1].id
+        created.clear()
+
+# --- Catalog Statistics ---
+def category_stats_select():
+    """Per-category (count, available count, price sum) in a single GROUP BY"""
+    return db.select(
+        Pastry.category,
+        func.count(Pastry.id),
+        func.coalesce(func.sum(case((Pastry.available, 1), else_=0)), 0),
+        func.coalesce(func.sum(Pastry.price), 0),
+    ).group_by(Pastry.category)
+
+def query_category_stats():
+    return db.session.execute(category_stats_select()).all()
+
+def get_catalog_stats():
+    """Dashboard totals, read from category_stats when materialized stats are enabled"""
+    if app.config['MATERIALIZED_STATS']:
+        rows = db.session.query(
+            CategoryStats.category, CategoryStats.pastry_count,
+            CategoryStats.available_count, CategoryStats.total_price
+        ).filter(CategoryStats.pastry_count > 0).all()
+    else:
+        rows = query_category_stats()
+
+    category_counts = {category: count for category, count, _, _ in rows}
+    return {
+        'total_pastries': sum(category_counts.values()),
+        'total_categories': len(category_counts),
+        'total_value': sum(price for _, _, _, price in rows),
+        'available': sum(available for _, _, available, _ in rows),
+        'category_counts': category_counts,
+    }
+
+def rebuild_category_stats():
+    """Recompute the category_stats table from scratch"""
+    db.session.query(CategoryStats).delete()
+    for category, count, available, price in query_category_stats():
+        db.session.add(CategoryStats(category=category, pastry_count=count,
+                                     available_count=available, total_price=price))
+    db.session.commit()
+
+def _pastry_stat_values(state, committed):
+    """(category, available, price) for a Pastry before (committed) or after a flush"""
+    values = []
+    for attr in ('category', 'available', 'price'):
+        history = state.attrs[attr].history
+        if committed:
+            if history.deleted:
+                values.append(history.deleted[0])
+            elif history.unchanged:
+                values.append(history.unchanged[0])
+            else:
+                return None
+        else:
+            values.append(state.dict.get(attr))
+    category, available, price = values
+    return category, bool(available), price or 0
+
+@event.listens_for(db.session, 'after_flush')
+def update_category_stats(session, flush_context):
+    """Apply count/availability/price deltas for flushed Pastry rows to category_stats"""
+    if not app.config['MATERIALIZED_STATS']:
+        return
+
+    deltas = {}
+    def add(values, sign):
+        category, available, price = values
+        count, avail, total = deltas.get(category, (0, 0, 0))
+        deltas[category] = (count + sign, avail + (sign if available else 0), total + sign * price)
+
+    for obj in session.new:
+        if isinstance(obj, Pastry):
+            add(_pastry_stat_values(sa_inspect(obj), committed=False), 1)
+    for obj in list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, Pastry):
+            continue
+        state = sa_inspect(obj)
+        before = _pastry_stat_values(state, committed=True)
+        if before is None:
+            # Prior values were never loaded, so the delta can't be computed
+            deltas = None
+            break
+        add(before, -1)
+        if obj not in session.deleted:
+            add(_pastry_stat_values(state, committed=False), 1)
+
+    table = CategoryStats.__table__
+    connection = session.connection()
+    if deltas is None:
+        connection.execute(table.delete())
+        for category, count, available, price in connection.execute(category_stats_select()):
+            connection.execute(table.insert().values(
+                category=category, pastry_count=count, available_count=available, total_price=price))
+        return
+
+    for category, (count, available, price) in deltas.items():
+        if not (count or available or price):
+            continue
+        result = connection.execute(
+            table.update().where(table.c.category == category).values(
+                pastry_count=table.c.pastry_count + count,
+                available_count=table.c.available_count + available,
+                total_price=table.c.total_price + price))
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(
+                category=category, pastry_count=count, available_count=available, total_price=price))
+
+# --- Catalog Version ---
+def _catalog_version_path():
+    return os.path.join(app.instance_path, 'catalog.version')
+
+def catalog_version():
+    """Version of the catalog, taken from the mtime (ns) of instance/catalog.version"""
+    try:
+        return os.stat(_catalog_version_path()).st_mtime_ns
+    except FileNotFoundError:
+        os.makedirs(app.instance_path, exist_ok=True)
+        open(_catalog_version_path(), 'a').close()
+        return os.stat(_catalog_version_path()).st_mtime_ns
+
+def bump_catalog_version():
+    """Record a catalog write so every worker drops its cached categories and pages"""
+    previous = catalog_version()
+    version = max(time.time_ns(), previous + 1)
+    os.utime(_catalog_version_path(), ns=(version, version))
+    category_cache.invalidate()
+    attribute_index.advance(previous, version)
+    page_cache.clear()
+    return version
+
+# Finer-grained than the catalog version, for changes that don't touch the
+# catalog itself: each pastry has its own version (its detail page), the
+# details version covers every detail page and the listing version every page
+# that shows pastry cards. All are mtimes kept ahead of the catalog version,
+# so the larger of the two always moves.
+def _version_path(name):
+    return os.path.join(app.instance_path, 'versions', f'{name}.version')
+
+def _read_version(name):
+    try:
+        return os.stat(_version_path(name)).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+def _bump_versions(names):
+    os.makedirs(os.path.dirname(_version_path('listing')), exist_ok=True)
+    floor = catalog_version()
+    for name in names:
+        path = _version_path(name)
+        version = max(time.time_ns(), floor + 1, _read_version(name) + 1)
+        open(path, 'a').close()
+        os.utime(path, ns=(version, version))
+
+def pastry_version(pastry_id):
+    """Version of one pastry's detail page (0 until something bumps it)"""
+    return _read_version(f'pastry-{pastry_id}')
+
+def listing_version(**view_args):
+    """Version of the pages showing pastry cards: home, listings and search"""
+    return _read_version('listing')
+
+def detail_version(pastry_id):
+    """Version of a detail page: its pastry, every detail page, and the listing version for its related cards"""
+    return max(pastry_version(pastry_id), _read_version('details'), listing_version())
+
+def bump_pastry_versions(pastry_ids, listings=False):
+    """Record a change to these pastries that the catalog version doesn't cover, such as stock.
+
+    Their detail pages go stale (all of them if `pastry_ids` is None); with
+    `listings`, so does every page showing cards. Cheaper than
+    bump_catalog_version(), which also drops the category cache and the
+    attribute index.
+    """
+    names = ['details'] if pastry_ids is None else [f'pastry-{pastry_id}' for pastry_id in pastry_ids]
+    _bump_versions(names + (['listing'] if listings else []))
+
+def pastries_showing_images(filenames):
+    """(ids of pastries whose image or gallery is one of these uploads, whether any is a card image)"""
+    filenames = list(filenames)
+    if not filenames:
+        return [], False
+    rows = db.session.execute(db.select(Pastry.id, Pastry.image).where(db.or_(
+        Pastry.image.in_(filenames),
+        *(Pastry.gallery_json.contains(json.dumps(name), autoescape=True) for name in filenames)))).all()
+    return [row.id for row in rows], any(row.image in filenames for row in rows)
+
+# --- Category Cache ---
+class CategoryCache:
+    """Process-local cache of the distinct category list.
+
+    The cached copy is tied to the catalog version, so a write in any
+    worker (see bump_catalog_version) is seen by the others at the cost of
+    a single stat call.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._categories = None
+        self._stamp = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self):
+        stamp = catalog_version()  # read before the query, so a concurrent write still invalidates
+        with self._lock:
+            if self._categories is not None and stamp == self._stamp:
+                self.hits += 1
+                return self._categories
+            self.misses += 1
+        rows = db.session.query(Pastry.category).distinct().order_by(Pastry.category).all()
+        categories = [c[0] for c in rows]
+        with self._lock:
+            self._categories = categories
+            self._stamp = stamp
+        return categories
+
+    def invalidate(self):
+        with self._lock:
+            self._categories = None
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'cached': self._categories is not None}
+
+category_cache = CategoryCache()
+
+# --- Attribute Index ---
+class AttributeIndex:
+    """In-memory inverted index from allergen/feature name to pastry ids.
+
+    Alongside the postings it keeps every pastry's (category, id) key in
+    sorted order, so a filtered listing can be keyset-paginated without
+    sending the (possibly huge) matching id set to the database. The index
+    is rebuilt whenever the catalog version moves on without it, which is
+    how writes made by other workers are picked up.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._reset()
+
+    def _reset(self):
+        self.version = None
+        self._allergens = {}
+        self._features = {}
+        self._labels = {'allergens': {}, 'features': {}}
+        self._categories = {}
+        self._keys = []
+
+    @staticmethod
+    def _normalize(name):
+        return name.strip().lower()
+
+    def _add(self, pastry_id, category, allergens, features):
+        self._categories[pastry_id] = category
+        bisect.insort(self._keys, (category, pastry_id))
+        for kind, postings, names in (('allergens', self._allergens, allergens),
+                                      ('features', self._features, features)):
+            for name in names:
+                key = self._normalize(name)
+                postings.setdefault(key, set()).add(pastry_id)
+                self._labels[kind].setdefault(key, name.strip())
+
+    def _remove(self, pastry_id):
+        category = self._categories.pop(pastry_id, None)
+        if category is None:
+            return
+        i = bisect.bisect_left(self._keys, (category, pastry_id))
+        if i < len(self._keys) and self._keys[i] == (category, pastry_id):
+            del self._keys[i]
+        for postings in (self._allergens, self._features):
+            for ids in postings.values():
+                ids.discard(pastry_id)
+
+    def rebuild(self):
+        version = catalog_version()
+        rows = db.session.query(Pastry.id, Pastry.category, Pastry.allergens_json, Pastry.features_json)
+        with self._lock:
+            self._reset()
+            for pastry_id, category, allergens_json, features_json in rows.yield_per(5000):
+                self._categories[pastry_id] = category
+                self._keys.append((category, pastry_id))
+                for kind, postings, raw in (('allergens', self._allergens, allergens_json),
+                                            ('features', self._features, features_json)):
+                    for name in (json.loads(raw) if raw else []):
+                        key = self._normalize(name)
+                        postings.setdefault(key, set()).add(pastry_id)
+                        self._labels[kind].setdefault(key, name.strip())
+            self._keys.sort()
+            self.version = version
+
+    def ensure_current(self):
+        if self.version != catalog_version():
+            self.rebuild()
+
+    def invalidate(self):
+        """Force a rebuild on next use, after writes that bypass update()/remove()"""
+        with self._lock:
+            self.version = None
+
+    def update(self, pastry):
+        """Re-index one pastry after a committed write, ahead of bump_catalog_version()"""
+        with self._lock:
+            self._remove(pastry.id)
+            self._add(pastry.id, pastry.category, pastry.allergens, pastry.features)
+
+    def remove(self, pastry_id):
+        with self._lock:
+            self._remove(pastry_id)
+
+    def advance(self, previous, version):
+        """Follow a version bump, or force a rebuild if we were already behind"""
+        with self._lock:
+            self.version = version if self.version == previous else None
+
+    def labels(self, kind):
+        """Display names for every indexed allergen or feature, sorted"""
+        self.ensure_current()
+        with self._lock:
+            return sorted(self._labels[kind].values(), key=str.lower)
+
+    def match(self, allergens=(), exclude_allergens=(), features=(), exclude_features=()):
+        """Ids matching every include filter and none of the exclude filters.
+
+        Returns None when no filter is given, meaning "no restriction".
+        """
+        if not (allergens or exclude_allergens or features or exclude_features):
+            return None
+        self.ensure_current()
+        with self._lock:
+            includes = [self._allergens.get(self._normalize(n), set()) for n in allergens]
+            includes += [self._features.get(self._normalize(n), set()) for n in features]
+            if includes:
+                ids = set.intersection(*sorted(includes, key=len))
+            else:
+                ids = set(self._categories)
+            for name in exclude_allergens:
+                ids -= self._allergens.get(self._normalize(name), set())
+            for name in exclude_features:
+                ids -= self._features.get(self._normalize(name), set())
+            return ids
+
+    def page(self, ids, category, per_page, after=None, before=None):
+        """Keyset page of `ids` in (category, id) order.
+
+        Mirrors paginate_pastries(): returns (page ids, next cursor, prev cursor).
+        """
+        after = decode_cursor(after)
+        before = None if after else decode_cursor(before)
+        with self._lock:
+            keys = self._keys
+            lo, hi = 0, len(keys)
+            if category is not None:
+                lo = bisect.bisect_left(keys, (category,))
+                hi = bisect.bisect_left(keys, (category + '\0',))
+
+            found = []
+            if before:
+                i = bisect.bisect_left(keys, before, lo, hi) - 1
+                while i >= lo and len(found) <= per_page:
+                    if keys[i][1] in ids:
+                        found.append(keys[i])
+                    i -= 1
+                has_prev, has_next = len(found) > per_page, True
+                found = list(reversed(found[:per_page]))
+            else:
+                i = bisect.bisect_right(keys, after, lo, hi) if after else lo
+                while i < hi and len(found) <= per_page:
+                    if keys[i][1] in ids:
+                        found.append(keys[i])
+                    i += 1
+                has_next, has_prev = len(found) > per_page, after is not None
+                found = found[:per_page]
+
+        next_cursor = encode_cursor(*found[-1]) if found and has_next else None
+        prev_cursor = encode_cursor(*found[0]) if found and has_prev else None
+        return [pastry_id for _, pastry_id in found], next_cursor, prev_cursor
+
+attribute_index = AttributeIndex()
+
+def get_attribute_filters():
+    """Allergen/feature filters from the query string, repeated or comma-separated"""
+    def values(name):
+        return [v.strip() for arg in request.args.getlist(name) for v in arg.split(',') if v.strip()]
+    return {
+        'allergens': values('allergen'),
+        'exclude_allergens': values('exclude_allergen'),
+        'features': values('feature'),
+        'exclude_features': values('exclude_feature'),
+    }
+
+# --- Search ---
+# External-content FTS5 index over pastry, kept in sync by triggers so that
+# every write path (ORM, bulk inserts, raw SQL) updates it.
+SEARCH_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS pastry_fts USING fts5(
+        name, description, ingredients_json,
+        content='pastry', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS pastry_fts_ai AFTER INSERT ON pastry BEGIN
+        INSERT INTO pastry_fts(rowid, name, description, ingredients_json)
+        VALUES (new.id, new.name, new.description, new.ingredients_json);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS pastry_fts_ad AFTER DELETE ON pastry BEGIN
+        INSERT INTO pastry_fts(pastry_fts, rowid, name, description, ingredients_json)
+        VALUES ('delete', old.id, old.name, old.description, old.ingredients_json);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS pastry_fts_au AFTER UPDATE OF name, description, ingredients_json ON pastry BEGIN
+        INSERT INTO pastry_fts(pastry_fts, rowid, name, description, ingredients_json)
+        VALUES ('delete', old.id, old.name, old.description, old.ingredients_json);
+        INSERT INTO pastry_fts(rowid, name, description, ingredients_json)
+        VALUES (new.id, new.name, new.description, new.ingredients_json);
+    END""",
+]
+
+# bm25 column weights: name, description, ingredients
+SEARCH_WEIGHTS = (10.0, 1.0, 2.0)
+
+_search_index_ready = False
+
+def search_supported():
+    return db.engine.dialect.name == 'sqlite'
+
+def ensure_search_index():
+    """Create the FTS5 table and triggers, rebuilding the index if it's new (a migration step, not for requests)"""
+    global _search_index_ready
+    if not search_supported() or search_index_ready():
+        return
+    with db.engine.begin() as connection:
+        exists = connection.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'pastry_fts'")).first()
+        for statement in SEARCH_INDEX_DDL:
+            connection.execute(text(statement))
+        if not exists:
+            connection.execute(text("INSERT INTO pastry_fts(pastry_fts) VALUES ('rebuild')"))
+    _search_index_ready = True
+
+def search_index_ready():
+    """Whether the FTS5 index exists. A read-only lookup, cached once it's found; searches
+    fall back to LIKE on a database that hasn't been migrated (flask seed) yet."""
+    global _search_index_ready
+    if not _search_index_ready and search_supported():
+        _search_index_ready = db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'pastry_fts'")).first() is not None
+    return _search_index_ready
+
+def build_fts_query(q, column=None):
+    """Turn free text into an FTS5 query: every term must match, the last one as a prefix"""
+    terms = re.findall(r'\w+', q.lower())
+    if len(terms) > 1 and len(terms[-1]) < 2:
+        # A one-letter fragment still being typed would match half the index
+        terms.pop()
+    if not terms:
+        return None
+    parts = [f'"{term}"' for term in terms]
+    parts[-1] += '*'
+    query = ' AND '.join(parts)
+    return f'{column} : ({query})' if column else query
+
+def contains_pattern(q):
+    """LIKE pattern matching `q` anywhere, with its own wildcards escaped (use escape='\\')"""
+    return '%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+def search_pastry_ids(q, limit):
+    """Pastry ids matching `q`, best BM25 match first"""
+    if not search_index_ready():
+        pattern = contains_pattern(q)
+        rows = db.session.query(Pastry.id).filter(
+            Pastry.name.ilike(pattern, escape='\\')
+            | Pastry.description.ilike(pattern, escape='\\')).limit(limit)
+        return [r[0] for r in rows]
+    match = build_fts_query(q)
+    if match is None:
+        return []
+    rows = db.session.execute(text(
+        "SELECT rowid FROM pastry_fts WHERE pastry_fts MATCH :match "
+        "ORDER BY bm25(pastry_fts, :w_name, :w_description, :w_ingredients) LIMIT :limit"),
+        {'match': match, 'limit': limit, 'w_name': SEARCH_WEIGHTS[0],
+         'w_description': SEARCH_WEIGHTS[1], 'w_ingredients': SEARCH_WEIGHTS[2]})
+    return [r[0] for r in rows]
+
+def autocomplete_pastries(q, limit):
+    """Lightweight name suggestions for type-ahead, straight from SQL rows.
+
+    Short prefixes can match a large share of the catalog, so only the first
+    AUTOCOMPLETE_CANDIDATES matches are ranked by BM25.
+    """
+    if not search_index_ready():
+        rows = db.session.query(Pastry.id, Pastry.name, Pastry.category, Pastry.price).filter(
+            Pastry.name.ilike(contains_pattern(q), escape='\\')).limit(limit)
+    else:
+        match = build_fts_query(q, column='name')
+        if match is None:
+            return []
+        rows = db.session.execute(text(
+            "SELECT p.id, p.name, p.category, p.price FROM ("
+            "  SELECT rowid, rank FROM pastry_fts WHERE pastry_fts MATCH :match LIMIT :candidates"
+            ") AS m JOIN pastry AS p ON p.id = m.rowid ORDER BY m.rank LIMIT :limit"),
+            {'match': match, 'limit': limit, 'candidates': app.config['AUTOCOMPLETE_CANDIDATES']})
+    return [{'id': pastry_id, 'name': name, 'category': category, 'price': price,
+             'url': url_for('pastry_detail', pastry_id=pastry_id)}
+            for pastry_id, name, category, price in rows]
+
+# --- Related Pastries ---
+# Pastries are compared as TF-IDF vectors over category, ingredients, features
+# and description words. Small catalogs compare every pair; larger ones only
+# score candidates that sort next to each other under a few random orderings
+# of the vocabulary (a MinHash-style neighbourhood), which keeps a rebuild
+# roughly linear in the number of pastries.
+SIMILARITY_STOPWORDS = frozenset(
+    'and are but for from has have its our that the this with you your into all was'.split())
+
+def similarity_tokens(category, ingredients_json, features_json, description):
+    """{token: field weight} for one pastry"""
+    weights = app.config['SIMILARITY_FIELD_WEIGHTS']
+    tokens = {}
+    for word in re.findall(r'[a-z]{3,}', (description or '').lower()):
+        if word not in SIMILARITY_STOPWORDS:
+            tokens['w:' + word] = weights['word']
+    for name in json.loads(ingredients_json or '[]'):
+        tokens['i:' + name.lower()] = weights['ingredient']
+    for name in json.loads(features_json or '[]'):
+        tokens['f:' + name.lower()] = weights['feature']
+    tokens['c:' + category.lower()] = weights['category']
+    return tokens
+
+class SimilarityCorpus:
+    """Each pastry's tokens and the pastries sharing each token, cached per process.
+
+    rebuild_similarity loads the whole catalog; refresh_similarity then only
+    re-reads the pastries it was given. Document frequencies are the posting
+    list sizes; a cached vector keeps the IDF weights it was built with until
+    its pastry changes or the next full load. Edits refreshed by another
+    process are picked up when the pastry count no longer matches or the
+    cache is SIMILARITY_CORPUS_MAX_AGE seconds old.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.tokens = {}  # pastry_id -> {token: field weight}
+        self.postings = {}  # token -> set of pastry ids
+        self.vectors = {}  # pastry_id -> unit-length TF-IDF vector, built on first use
+        self.loaded_at = None
+
+    @staticmethod
+    def _rows(pastry_ids=None):
+        query = db.select(Pastry.id, Pastry.category, Pastry.ingredients_json, Pastry.features_json,
+                          Pastry.description)
+        if pastry_ids is None:
+            return db.session.execute(query.order_by(Pastry.id)).all()
+        pastry_ids = list(pastry_ids)
+        return [row for start in range(0, len(pastry_ids), 500)
+                for row in db.session.execute(query.where(Pastry.id.in_(pastry_ids[start:start + 500])))]
+
+    def _add(self, pastry_id, tokens):
+        self.tokens[pastry_id] = tokens
+        for token in tokens:
+            self.postings.setdefault(token, set()).add(pastry_id)
+
+    def _remove(self, pastry_id):
+        self.vectors.pop(pastry_id, None)
+        for token in self.tokens.pop(pastry_id, ()):
+            postings = self.postings[token]
+            postings.discard(pastry_id)
+            if not postings:
+                del self.postings[token]
+
+    def load(self):
+        self.tokens, self.postings, self.vectors = {}, {}, {}
+        for row in self._rows():
+            self._add(row[0], similarity_tokens(*row[1:]))
+        self.loaded_at = time.monotonic()
+
+    def update(self, pastry_ids):
+        """Re-read the given pastries, or the whole catalog if the cache is cold or stale"""
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > app.config['SIMILARITY_CORPUS_MAX_AGE']:
+            return self.load()
+        rows = self._rows(pastry_ids)
+        for pastry_id in pastry_ids:
+            self._remove(pastry_id)
+        for row in rows:
+            self._add(row[0], similarity_tokens(*row[1:]))
+        if len(self.tokens) != db.session.scalar(db.select(func.count(Pastry.id))):
+            self.load()
+
+    def vector(self, pastry_id):
+        """Unit-length TF-IDF vector"""
+        vector = self.vectors.get(pastry_id)
+        if vector is None:
+            total = len(self.tokens)
+            vector = {token: weight * (math.log((1 + total) / (1 + len(self.postings[token]))) + 1)
+                      for token, weight in self.tokens[pastry_id].items()}
+            norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+            vector = self.vectors[pastry_id] = {token: v / norm for token, v in vector.items()}
+        return vector
+
+    def sharing(self, pastry_id):
+        """Ids of the other pastries with a token in common, the only ones scoring above 0"""
+        return sorted(set().union(*(self.postings[token] for token in self.tokens[pastry_id])) - {pastry_id})
+
+similarity_corpus = SimilarityCorpus()
+
+def load_similarity_corpus():
+    """(ids, unit-length TF-IDF vectors) for every pastry, ordered by id"""
+    with similarity_corpus.lock:
+        similarity_corpus.load()
+        ids = sorted(similarity_corpus.tokens)
+        return ids, [similarity_corpus.vector(pastry_id) for pastry_id in ids]
+
+def cosine(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    get = b.get
+    return sum(weight * get(token, 0.0) for token, weight in a.items())
+
+def similarity_candidates(vectors):
+    """Candidate positions for each vector, from a few MinHash-style sorted orderings"""
+    window = app.config['SIMILARITY_WINDOW']
+    vocabulary = sorted({token for vector in vectors for token in vector})
+    rng = random.Random(0)  # fixed seed keeps rebuilds reproducible
+    candidates = [set() for _ in vectors]
+    for _ in range(app.config['SIMILARITY_PERMUTATIONS']):
+        # Exponential race: each token draws a random time and heavier tokens run
+        # faster, so two pastries put the same tokens first with probability
+        # close to their weighted Jaccard similarity
+        race = {token: rng.expovariate(1.0) for token in vocabulary}
+        keys = [sorted(vector, key=lambda token: race[token] / vector[token])[:3] for vector in vectors]
+        order = sorted(range(len(vectors)), key=keys.__getitem__)
+        for position, i in enumerate(order):
+            candidates[i].update(order[max(0, position - window):position + window + 1])
+    return candidates
+
+def top_neighbors(i, positions, ids, vectors):
+    """[(score, neighbor_id), ...] best first"""
+    vector = vectors[i]
+    scored = [(cosine(vector, vectors[j]), ids[j]) for j in positions if j != i]
+    return heapq.nlargest(app.config['SIMILARITY_NEIGHBORS'], (entry for entry in scored if entry[0] > 0),
+                          key=lambda entry: entry[0])
+
+def write_neighbor_lists(lists, replace=True):
+    """Store the lists in `lists` ({pastry_id: [(score, neighbor_id), ...]}), replacing existing ones"""
+    pastry_ids = list(lists) if replace else []
+    for start in range(0, len(pastry_ids), 500):
+        db.session.execute(db.delete(PastryNeighbor).where(
+            PastryNeighbor.pastry_id.in_(pastry_ids[start:start + 500])))
+    rows = [{'pastry_id': pastry_id, 'rank': rank, 'neighbor_id': neighbor_id, 'score': score}
+            for pastry_id, neighbors in lists.items()
+            for rank, (score, neighbor_id) in enumerate(neighbors)]
+    for start in range(0, len(rows), 5000):
+        db.session.execute(PastryNeighbor.__table__.insert(), rows[start:start + 5000])
+
+def rebuild_similarity():
+    """Recompute every pastry's neighbour list"""
+    ids, vectors = load_similarity_corpus()
+    if len(ids) <= app.config['SIMILARITY_EXACT_LIMIT']:
+        candidates = [range(i + 1, len(ids)) for i in range(len(ids))]
+    else:
+        candidates = similarity_candidates(vectors)
+    # Candidate sets are symmetric, so each pair is scored once for both sides
+    scored = [[] for _ in ids]
+    for i, vector in enumerate(vectors):
+        for j in candidates[i]:
+            if j > i:
+                score = cosine(vector, vectors[j])
+                if score > 0:
+                    scored[i].append((score, ids[j]))
+                    scored[j].append((score, ids[i]))
+    limit = app.config['SIMILARITY_NEIGHBORS']
+    lists = {ids[i]: heapq.nlargest(limit, entries, key=lambda entry: entry[0])
+             for i, entries in enumerate(scored)}
+    db.session.execute(db.delete(PastryNeighbor))
+    write_neighbor_lists(lists, replace=False)
+    db.session.commit()
+    return len(ids)
+
+def refresh_similarity(pastry_ids):
+    """Update neighbour lists after the given pastries were added, edited or deleted.
+
+    Each changed pastry is scored against the pastries sharing a token with
+    it. Other pastries' lists are rewritten only if a changed pastry now
+    belongs in them or was in them before. Returns the ids of the pastries
+    whose lists were rewritten, or None if there were none yet and every
+    list was built.
+    """
+    changed = set(pastry_ids)
+    if db.session.scalar(db.select(PastryNeighbor.pastry_id).limit(1)) is None:
+        rebuild_similarity()
+        return None
+
+    limit = app.config['SIMILARITY_NEIGHBORS']
+    lists = {}
+    gained = {}  # pastry_id -> [(score, changed_id), ...]
+    with similarity_corpus.lock:
+        similarity_corpus.update(changed)
+        for pastry_id in changed:
+            if pastry_id not in similarity_corpus.tokens:
+                lists[pastry_id] = []  # deleted
+                continue
+            vector = similarity_corpus.vector(pastry_id)
+            scored = []
+            for other_id in similarity_corpus.sharing(pastry_id):
+                score = cosine(vector, similarity_corpus.vector(other_id))
+                if score > 0:
+                    scored.append((score, other_id))
+                    if other_id not in changed:
+                        gained.setdefault(other_id, []).append((score, pastry_id))
+            lists[pastry_id] = heapq.nlargest(limit, scored, key=lambda entry: entry[0])
+
+    # Keep only the gains that beat the current last entry of a full list
+    candidates = list(gained)
+    for start in range(0, len(candidates), 500):
+        chunk = candidates[start:start + 500]
+        kth = {pastry_id: (count, lowest) for pastry_id, count, lowest in db.session.execute(
+            db.select(PastryNeighbor.pastry_id, func.count(), func.min(PastryNeighbor.score))
+            .where(PastryNeighbor.pastry_id.in_(chunk)).group_by(PastryNeighbor.pastry_id))}
+        for pastry_id in chunk:
+            count, lowest = kth.get(pastry_id, (0, 0.0))
+            entries = [entry for entry in gained[pastry_id] if count < limit or entry[0] > lowest]
+            if entries:
+                gained[pastry_id] = entries
+            else:
+                del gained[pastry_id]
+
+    affected = set(gained)
+    affected.update(db.session.scalars(db.select(PastryNeighbor.pastry_id).where(
+        PastryNeighbor.neighbor_id.in_(changed))))
+    affected -= changed
+    current = {}
+    affected_ids = list(affected)
+    for start in range(0, len(affected_ids), 500):
+        for row in db.session.execute(db.select(
+                PastryNeighbor.pastry_id, PastryNeighbor.score, PastryNeighbor.neighbor_id
+        ).where(PastryNeighbor.pastry_id.in_(affected_ids[start:start + 500]))):
+            current.setdefault(row.pastry_id, []).append((row.score, row.neighbor_id))
+    for pastry_id in affected:
+        kept = [entry for entry in current.get(pastry_id, []) if entry[1] not in changed]
+        merged = kept + gained.get(pastry_id, [])
+        lists[pastry_id] = sorted(merged, key=lambda entry: (-entry[0], entry[1]))[:limit]
+    write_neighbor_lists(lists)
+    db.session.commit()
+    return list(lists)
+
+# --- Catalog Repository ---
+# Public pages load pastries through these helpers so each page's SQL stays
+# a small fixed number of statements however many cards it renders
+def read_only_view(view):
+    """Run a view's queries on the 'read' bind (see READ_ONLY_PUBLIC_ROUTES)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = app.config['READ_ONLY_PUBLIC_ROUTES']
+        return view(*args, **kwargs)
+    return wrapper
+
+def get_featured_pastries(limit=6):
+    return Pastry.query.filter(Pastry.available.is_(True), db.or_(Pastry.stock.is_(None), Pastry.stock > 0)
+                               ).limit(limit).all()
+
+def get_pastries_by_ids(ids):
+    """Pastries for `ids` in the given order, skipping any that no longer exist"""
+    if not ids:
+        return []
+    by_id = {p.id: p for p in Pastry.query.filter(Pastry.id.in_(ids))}
+    return [by_id[i] for i in ids if i in by_id]
+
+def get_pastry_with_related(pastry_id, related_limit=None):
+    """A pastry and its most similar pastries, fetched in one statement.
+
+    Pastries without a neighbour list yet (added since the last rebuild and
+    before their refresh job ran) fall back to others from their category.
+    """
+    related_limit = related_limit or app.config['RELATED_PASTRIES']
+    neighbor_ids = db.select(PastryNeighbor.neighbor_id).where(
+        PastryNeighbor.pastry_id == pastry_id, PastryNeighbor.rank < related_limit)
+    rows = db.session.execute(
+        db.select(Pastry, PastryNeighbor.rank)
+        .outerjoin(PastryNeighbor, db.and_(PastryNeighbor.pastry_id == pastry_id,
+                                           PastryNeighbor.neighbor_id == Pastry.id))
+        .where(db.or_(Pastry.id == pastry_id, Pastry.id.in_(neighbor_ids)))
+    ).all()
+
+    pastry = next((p for p, _ in rows if p.id == pastry_id), None)
+    if pastry is None:
+        abort(404)
+    related = [p for p, _ in sorted((row for row in rows if row[0].id != pastry_id), key=lambda row: row[1])]
+    if not related:
+        related = Pastry.query.filter(
+            Pastry.category == pastry.category, Pastry.id != pastry_id
+        ).order_by(Pastry.id).limit(related_limit).all()
+    return pastry, related
+
+class PastryLinkCache:
+    """Precomputed image, WhatsApp and detail-page URLs per pastry.
+
+    Entries are stamped with the fields they are derived from, so an edit
+    made by another process is picked up on the next read; edits made here
+    also drop the entry explicitly.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, pastry):
+        script_root = request.script_root if has_request_context() else ''
+        stamp = (script_root, pastry.image, pastry.gallery_json, pastry.name, pastry.price)
+        with self._lock:
+            entry = self._entries.get(pastry.id)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(pastry.id)
+                return entry[1]
+        links = {
+            'image_url': upload_url(pastry.image) if pastry.image else PLACEHOLDER_IMAGE_URL,
+            'gallery_urls': [upload_url(filename) for filename in json.loads(pastry.gallery_json or '[]')],
+            'whatsapp_link': generate_whatsapp_link(pastry.name, pastry.price),
+            'detail_url': url_for('pastry_detail', pastry_id=pastry.id) if pastry.id is not None else None,
+        }
+        if pastry.id is not None:
+            with self._lock:
+                self._entries[pastry.id] = (stamp, links)
+                self._entries.move_to_end(pastry.id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return links
+
+    def invalidate(self, pastry_id=None):
+        with self._lock:
+            if pastry_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(pastry_id, None)
+
+pastry_links = PastryLinkCache(app.config['PASTRY_LINK_CACHE_SIZE'])
+
+# --- Card Fragment Cache ---
+class CardFragmentCache:
+    """Rendered pastry cards keyed on (macro, pastry id), bounded by total size.
+
+    As with PastryLinkCache, each entry is stamped with every value the card
+    shows, so an edit from any process re-renders the card on its next view
+    and a listing page is otherwise a join of cached HTML.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, stamp):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != stamp:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, stamp, html):
+        if len(html) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[1])
+            self._entries[key] = (stamp, html)
+            self._size += len(html)
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def invalidate(self, pastry_id=None):
+        with self._lock:
+            keys = list(self._entries) if pastry_id is None else [key for key in self._entries if key[1] == pastry_id]
+            for key in keys:
+                self._size -= len(self._entries.pop(key)[1])
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self._entries), 'bytes': self._size}
+
+card_fragments = CardFragmentCache(app.config['CARD_CACHE_MAX_BYTES'])
+
+def card_stamp(pastry):
+    """Every value a card's HTML depends on, including which image derivatives exist"""
+    variants = derivative_index.variants(pastry.image) if pastry.image else {}
+    return (request.script_root if has_request_context() else '',
+            pastry.name, pastry.category, pastry.price, pastry.description, pastry.serving_size,
+            pastry.available, pastry.stock, pastry.image, pastry.allergens_json,
+            tuple((fmt, tuple(widths)) for fmt, widths in variants.items()))
+
+@app.template_global()
+def pastry_card(macro, pastry):
+    """A pastry rendered by `macro` from _cards.html, reusing the cached HTML while it is unchanged"""
+    key = (macro, pastry.id)
+    stamp = card_stamp(pastry)
+    html = card_fragments.get(key, stamp)
+    if html is None:
+        html = str(get_template_attribute('_cards.html', macro)(pastry))
+        card_fragments.set(key, stamp, html)
+    return Markup(html)
+
+# --- Catalog Import/Export ---
+# One pastry per CSV row or JSON Lines object. Rows with the id of an existing
+# pastry update it (only the columns present are changed); other rows are
+# inserted. In CSV, list columns are '|'-separated or a JSON array. Image and
+# gallery entries may be http(s) URLs, downloaded concurrently per batch.
+CATALOG_FIELDS = ['id', 'name', 'category', 'price', 'description', 'serving_size', 'available',
+                  'image', 'gallery', 'ingredients', 'allergens', 'features']
+CATALOG_LIST_FIELDS = {'gallery': 'gallery_json', 'ingredients': 'ingredients_json',
+                       'allergens': 'allergens_json', 'features': 'features_json'}
+CATALOG_FORMATS = ('csv', 'jsonl')
+CATALOG_INSERT_DEFAULTS = {'serving_size': None, 'available': True, 'image': 'placeholder.png',
+                           'gallery_json': '[]', 'ingredients_json': '[]', 'allergens_json': '[]',
+                           'features_json': '[]'}
+
+class CatalogRowError(ValueError):
+    pass
+
+def catalog_format(filename, default='csv'):
+    extension = os.path.splitext(filename or '')[1].lower()
+    return {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}.get(extension, default)
+
+def is_image_url(value):
+    return isinstance(value, str) and value.startswith(('http://', 'https://'))
+
+def _parse_list(value):
+    if isinstance(value, list):
+        items = value
+    elif value is None or not str(value).strip():
+        items = []
+    elif str(value).lstrip().startswith('['):
+        try:
+            items = json.loads(value)
+        except ValueError:
+            raise CatalogRowError('invalid JSON list')
+        if not isinstance(items, list):
+            raise CatalogRowError('expected a list')
+    else:
+        items = str(value).split('|')
+    return [str(item).strip() for item in items if str(item).strip()]
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    text_value = str(value).strip().lower()
+    if text_value in ('', '1', 'true', 'yes', 'y', 'on'):
+        return True
+    if text_value in ('0', 'false', 'no', 'n', 'off'):
+        return False
+    raise CatalogRowError(f'invalid boolean {value!r}')
+
+def validate_catalog_row(raw):
+    """Pastry column values for one import row; raises CatalogRowError"""
+    values = {}
+    if raw.get('id') not in (None, ''):
+        try:
+            values['id'] = int(raw['id'])
+        except (TypeError, ValueError):
+            raise CatalogRowError(f"invalid id {raw['id']!r}")
+        if values['id'] < 1:
+            raise CatalogRowError('id must be positive')
+    for field, max_length in (('name', 100), ('category', 50)):
+        value = str(raw.get(field) or '').strip()
+        if not value:
+            raise CatalogRowError(f'{field} is required')
+        if len(value) > max_length:
+            raise CatalogRowError(f'{field} is longer than {max_length} characters')
+        values[field] = value
+    try:
+        values['price'] = float(raw.get('price'))
+    except (TypeError, ValueError):
+        raise CatalogRowError(f"invalid price {raw.get('price')!r}")
+    if not math.isfinite(values['price']) or values['price'] < 0:
+        raise CatalogRowError('price must be a non-negative number')
+    values['description'] = str(raw.get('description') or '').strip()
+    if not values['description']:
+        raise CatalogRowError('description is required')
+
+    if 'serving_size' in raw:
+        values['serving_size'] = str(raw['serving_size'] or '').strip()[:50] or None
+    if 'available' in raw:
+        values['available'] = _parse_bool(raw['available'])
+    if 'image' in raw:
+        image = str(raw['image'] or '').strip()
+        if image and not is_image_url(image) and secure_filename(image) != image:
+            raise CatalogRowError(f'invalid image filename {image!r}')
+        values['image'] = image or 'placeholder.png'
+    for field in CATALOG_LIST_FIELDS:
+        if field in raw:
+            try:
+                values[field] = _parse_list(raw[field])
+            except CatalogRowError as e:
+                raise CatalogRowError(f'{field}: {e}')
+    bad = [name for name in values.get('gallery', []) if not is_image_url(name) and secure_filename(name) != name]
+    if bad:
+        raise CatalogRowError(f'invalid gallery filename {bad[0]!r}')
+    return values
+
+def read_catalog_rows(stream, fmt):
+    """Yield (line_number, raw_row_or_CatalogRowError) from a text stream"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        unknown = set(reader.fieldnames or []) - set(CATALOG_FIELDS)
+        if unknown:
+            raise CatalogRowError(f"unknown CSV columns: {', '.join(sorted(unknown))}")
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, CatalogRowError(f'invalid JSON: {e}')
+                continue
+            if not isinstance(row, dict):
+                yield line_number, CatalogRowError('expected a JSON object')
+                continue
+            yield line_number, row
+
+class CatalogImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []  # (line, message), the first IMPORT_MAX_REPORTED_ERRORS
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < app.config['IMPORT_MAX_REPORTED_ERRORS']:
+            self.errors.append((line, str(message)))
+
+    def summary(self):
+        return f'{self.inserted} inserted, {self.updated} updated, {self.error_count} errors'
+
+def _import_catalog_batch(batch, report, allow_missing_images=False):
+    """Download the batch's images, then upsert it in one transaction"""
+    urls = [url for _, values in batch
+            for url in [values.get('image'), *values.get('gallery', [])] if is_image_url(url)]
+    images = download_images(urls) if urls else {}
+
+    rows = {}
+    for line, values in batch:
+        missing = [url for url in [values.get('image'), *values.get('gallery', [])]
+                   if is_image_url(url) and url not in images]
+        if missing and not allow_missing_images:
+            report.error(line, f'could not download {missing[0]}')
+            continue
+        if 'image' in values:
+            values['image'] = images.get(values['image'], 'placeholder.png' if values['image'] in missing
+                                         else values['image'])
+        for field, column in CATALOG_LIST_FIELDS.items():
+            if field in values:
+                items = values.pop(field)
+                values[column] = json.dumps([images.get(item, item) for item in items if item not in missing]
+                                            if field == 'gallery' else items)
+        # A later row for the same id replaces an earlier one in the same batch
+        rows[values.get('id', ('new', line))] = (line, values)
+    if not rows:
+        return
+
+    ids = [key for key in rows if isinstance(key, int)]
+    existing = set(db.session.scalars(db.select(Pastry.id).where(Pastry.id.in_(ids)))) if ids else set()
+    updates = [values for key, (_, values) in rows.items() if key in existing]
+    # Inserts share one set of keys so they go out as a single executemany
+    inserts = [{**CATALOG_INSERT_DEFAULTS, 'id': None, **values}
+               for key, (_, values) in rows.items() if key not in existing]
+    try:
+        if updates:
+            db.session.execute(db.update(Pastry), updates)
+        new_ids = db.session.scalars(db.insert(Pastry).returning(Pastry.id), inserts).all() if inserts else []
+        for filename in {images[url] for url in urls if url in images}:
+            schedule_derivatives(filename)
+        if app.config['NORMALIZED_ATTRIBUTES']:
+            # Bulk statements skip the before_flush hook that keeps the link tables in sync
+            created = {}
+            touched = [values['id'] for values in updates] + new_ids
+            for pastry in Pastry.query.filter(Pastry.id.in_(touched)):
+                sync_pastry_tags(db.session, pastry, created, force=True)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        for line, _ in rows.values():
+            report.error(line, f'batch failed: {e}')
+        return
+    report.updated += len(updates)
+    report.inserted += len(inserts)
+
+def import_catalog(stream, fmt, dry_run=False, allow_missing_images=False):
+    """Validate and upsert catalog rows from a text stream in batches, returning a CatalogImportReport.
+
+    With allow_missing_images, an image that can't be downloaded becomes the
+    placeholder (or is left out of the gallery) instead of failing its row.
+    """
+    report = CatalogImportReport()
+    batch_size = app.config['IMPORT_BATCH_SIZE']
+    batch = []
+    try:
+        for line, raw in read_catalog_rows(stream, fmt):
+            try:
+                if isinstance(raw, CatalogRowError):
+                    raise raw
+                values = validate_catalog_row(raw)
+            except CatalogRowError as e:
+                report.error(line, e)
+                continue
+            if dry_run:
+                continue
+            batch.append((line, values))
+            if len(batch) >= batch_size:
+                _import_catalog_batch(batch, report, allow_missing_images)
+                batch = []
+        if batch:
+            _import_catalog_batch(batch, report, allow_missing_images)
+    except (CatalogRowError, csv.Error, UnicodeDecodeError) as e:
+        report.error(0, e)
+    finally:
+        if report.inserted or report.updated:
+            finish_catalog_write()
+    return report
+
+def finish_catalog_write():
+    """Bring caches and derived tables up to date after a bulk write"""
+    if app.config['MATERIALIZED_STATS']:
+        rebuild_category_stats()
+    attribute_index.invalidate()
+    bump_catalog_version()
+    if Job.query.filter_by(kind='rebuild_similarity', status='pending').first() is None:
+        enqueue_job('rebuild_similarity', {})
+
+def export_catalog(fmt):
+    """Yield the whole catalog as CSV or JSON Lines text chunks, in id order"""
+    columns = [Pastry.id, Pastry.name, Pastry.category, Pastry.price, Pastry.description,
+               Pastry.serving_size, Pastry.available, Pastry.image, Pastry.gallery_json,
+               Pastry.ingredients_json, Pastry.allergens_json, Pastry.features_json]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == 'csv':
+        writer.writerow(CATALOG_FIELDS)
+    last_id = 0
+    while True:
+        rows = db.session.execute(db.select(*columns).where(Pastry.id > last_id)
+                                  .order_by(Pastry.id).limit(1000)).all()
+        if not rows:
+            break
+        for row in rows:
+            record = dict(zip(CATALOG_FIELDS, row))
+            for field in CATALOG_LIST_FIELDS:
+                record[field] = json.loads(record[field]) if record[field] else []
+            if fmt == 'csv':
+                writer.writerow([
+                    '|'.join(record[field]) if field in CATALOG_LIST_FIELDS
+                    else int(record[field]) if field == 'available'
+                    else '' if record[field] is None else record[field]
+                    for field in CATALOG_FIELDS])
+            else:
+                buffer.write(json.dumps(record, ensure_ascii=False) + '\n')
+        last_id = rows[-1].id
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+# --- Catalog API ---
+# Pastries are serialized straight from the selected columns. The stored
+# ingredients/allergens/features text is already a JSON array, so it is
+# spliced into the output as-is rather than decoded and re-encoded.
+_encode_json = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+# The link fields come from pastry_links, which is keyed on these columns
+_API_LINK_COLUMNS = [Pastry.id, Pastry.image, Pastry.gallery_json, Pastry.name, Pastry.price]
+
+# field -> (columns it needs, (row, links) -> value)
+API_FIELDS = {
+    'id': ([Pastry.id], lambda row, links: row.id),
+    'name': ([Pastry.name], lambda row, links: row.name),
+    'category': ([Pastry.category], lambda row, links: row.category),
+    'price': ([Pastry.price], lambda row, links: row.price),
+    'description': ([Pastry.description], lambda row, links: row.description),
+    'serving_size': ([Pastry.serving_size], lambda row, links: row.serving_size),
+    'available': ([Pastry.available], lambda row, links: bool(row.available)),
+    'image_url': (_API_LINK_COLUMNS, lambda row, links: links['image_url']),
+    'gallery_urls': (_API_LINK_COLUMNS, lambda row, links: links['gallery_urls']),
+    'ingredients': ([Pastry.ingredients_json], None),
+    'allergens': ([Pastry.allergens_json], None),
+    'features': ([Pastry.features_json], None),
+    'whatsapp_link': (_API_LINK_COLUMNS, lambda row, links: links['whatsapp_link']),
+    'url': (_API_LINK_COLUMNS, lambda row, links: links['detail_url']),
+}
+API_RAW_JSON_FIELDS = {'ingredients': 'ingredients_json', 'allergens': 'allergens_json',
+                       'features': 'features_json'}
+# query args /api/pastries understands; they make up its cache key and its next links
+API_LIST_ARGS = ('fields', 'available', 'category', 'after', 'per_page')
+
+def api_error(status, message):
+    abort(make_response({'error': message}, status))
+
+def parse_api_fields():
+    """Field names from ?fields=a,b,c (all fields when absent), in request order"""
+    raw = request.args.get('fields')
+    if not raw:
+        return list(API_FIELDS)
+    fields = list(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+    unknown = [name for name in fields if name not in API_FIELDS]
+    if unknown or not fields:
+        api_error(400, f"unknown fields: {', '.join(unknown) or raw}; available: {', '.join(API_FIELDS)}")
+    return fields
+
+def api_columns(fields, *extra):
+    columns = {}
+    for column in [*extra, *(column for name in fields for column in API_FIELDS[name][0])]:
+        columns.setdefault(column.key, column)
+    return list(columns.values())
+
+def pastry_serializer(fields):
+    """A function turning a row with api_columns(fields) into JSON object text"""
+    values = [(name, API_FIELDS[name][1]) for name in fields if name not in API_RAW_JSON_FIELDS]
+    raw = [(name, API_RAW_JSON_FIELDS[name]) for name in fields if name in API_RAW_JSON_FIELDS]
+    needs_links = any(API_FIELDS[name][0] is _API_LINK_COLUMNS for name in fields)
+
+    def serialize(row):
+        links = pastry_links.get(row) if needs_links else None
+        text = _encode_json({name: value(row, links) for name, value in values})
+        if not raw:
+            return text
+        spliced = ','.join(f'"{name}":{getattr(row, column) or "[]"}' for name, column in raw)
+        return f'{text[:-1]},{spliced}}}' if values else f'{{{spliced}}}'
+    return serialize
+
+def api_pastry_page(fields, per_page, category=None, available=None, after=None):
+    """JSON text of one page of pastries ordered by (category, id), and the next cursor"""
+    query = db.select(*api_columns(fields, Pastry.id, Pastry.category))
+    if category:
+        query = query.where(Pastry.category == category)
+    if available is not None:
+        query = query.where(Pastry.available == available)
+    after = decode_cursor(after)
+    if after:
+        query = query.where(tuple_(Pastry.category, Pastry.id) > after)
+    rows = db.session.execute(query.order_by(Pastry.category, Pastry.id).limit(per_page + 1)).all()
+    items = rows[:per_page]
+    next_cursor = encode_cursor(items[-1].category, items[-1].id) if len(rows) > per_page else None
+    serialize = pastry_serializer(fields)
+    return '[' + ','.join(serialize(row) for row in items) + ']', next_cursor
+
+def compressed(view):
+    """Compress a view's 200 responses with brotli or gzip, whichever the client prefers.
+
+    ETags become weak, since the bytes on the wire differ per encoding.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        response = make_response(view(*args, **kwargs))
+        response.vary.add('Accept-Encoding')
+        if response.status_code != 200 or response.is_streamed or 'Content-Encoding' in response.headers:
+            return response
+        accepted = request.accept_encodings
+        encodings = [encoding for encoding in ('br', 'gzip')
+                     if accepted[encoding] and (encoding != 'br' or brotli is not None)]
+        body = response.get_data()
+        if not encodings or len(body) < app.config['COMPRESS_MIN_BYTES']:
+            return response
+        encoding = max(encodings, key=lambda encoding: accepted[encoding])
+        if encoding == 'br':
+            body = brotli.compress(body, quality=app.config['COMPRESS_BROTLI_QUALITY'])
+        else:
+            body = gzip.compress(body, compresslevel=app.config['COMPRESS_GZIP_LEVEL'], mtime=0)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        etag, _ = response.get_etag()
+        if etag:
+            response.set_etag(etag, weak=True)
+        return response
+    return wrapper
+
+# --- Cart & Orders ---
+# The cart lives in the session as {pastry id: quantity}. Stock is only held at
+# checkout, where each line is decremented by a guarded UPDATE.
+class OutOfStock(Exception):
+    def __init__(self, name):
+        super().__init__(f'Sorry, there is not enough "{name}" left for your order.')
+
+def get_cart():
+    return {int(pastry_id): quantity for pastry_id, quantity in session.get('cart', {}).items()}
+
+def save_cart(cart):
+    session['cart'] = {str(pastry_id): quantity for pastry_id, quantity in cart.items() if quantity > 0}
+
+def parse_stock(value):
+    """Stock from an admin form field; blank means not tracked"""
+    value = (value or '').strip()
+    return max(0, int(value)) if value else None
+
+def clamp_quantity(value):
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        return 0
+    return max(0, min(quantity, app.config['CART_MAX_QUANTITY']))
+
+def cart_lines(cart):
+    """(pastry, quantity) for every cart entry whose pastry still exists"""
+    return [(pastry, cart[pastry.id]) for pastry in get_pastries_by_ids(list(cart))]
+
+def place_order(cart, customer_name, phone, email=None, note=None):
+    """Turn a cart into an Order, holding stock atomically.
+
+    Each line runs `UPDATE pastry SET stock = stock - qty WHERE ... stock >= qty`,
+    so two checkouts can never both take the last units: the loser's UPDATE
+    matches no row and the whole order rolls back with OutOfStock. Untracked
+    stock (NULL) stays NULL. Lines are updated in id order so concurrent
+    orders lock rows in the same order on databases with row locks. The
+    UPDATE returns the stock left, so an order that sells a pastry out also
+    marks the pages showing its card stale.
+    """
+    lines = sorted(cart_lines(cart), key=lambda line: line[0].id)
+    if not lines:
+        raise ValueError('Your cart is empty.')
+    order = Order(customer_name=customer_name, phone=phone, email=email or None, note=note or None,
+                  total=sum(pastry.price * quantity for pastry, quantity in lines))
+    stock_changed = []
+    sold_out = False
+    for pastry, quantity in lines:
+        result = db.session.execute(
+            db.update(Pastry)
+            .where(Pastry.id == pastry.id, Pastry.available.is_(True),
+                   db.or_(Pastry.stock.is_(None), Pastry.stock >= quantity))
+            .values(stock=Pastry.stock - quantity)
+            .returning(Pastry.stock)
+            .execution_options(synchronize_session=False)).first()
+        if result is None:
+            name = pastry.name
+            db.session.rollback()
+            raise OutOfStock(name)
+        if result.stock is not None:
+            stock_changed.append(pastry.id)
+            sold_out = sold_out or result.stock == 0
+        order.items.append(OrderItem(pastry_id=pastry.id, name=pastry.name,
+                                     unit_price=pastry.price, quantity=quantity))
+    db.session.add(order)
+    db.session.flush()
+    # Queued in the same transaction, so the emails exist if and only if the order does
+    for msg in order_emails(order):
+        send_email(msg, commit=False)
+    db.session.commit()
+    if stock_changed:
+        # Detail pages show the stock left; cards only whether there is any
+        bump_pastry_versions(stock_changed, listings=sold_out)
+    return order
+
+def order_summary(order):
+    lines = [f"{item.quantity} x {item.name} - ₦{item.subtotal:,.0f}" for item in order.items]
+    return '\n'.join(lines + [f"Total: ₦{order.total:,.0f}"])
+
+def generate_order_whatsapp_link(order):
+    """One WhatsApp message covering every item of an order"""
+    message = (f"Hello! I'd like to confirm my order {order.reference}:\n{order_summary(order)}\n"
+               f"Name: {order.customer_name}\nPhone: {order.phone}")
+    if order.note:
+        message += f"\nNote: {order.note}"
+    return f"https://wa.me/{WHATSAPP_NUMBER}?text={quote(message)}"
+
+def order_emails(order):
+    """The shop's notification and, if the customer left an address, their confirmation"""
+    details = f"Order {order.reference}\n\n{order_summary(order)}\n\nName: {order.customer_name}\nPhone: {order.phone}"
+    if order.email:
+        details += f"\nEmail: {order.email}"
+    if order.note:
+        details += f"\nNote: {order.note}"
+    messages = [Message(subject=f"New order {order.reference} (₦{order.total:,.0f})",
+                        recipients=[app.config['ORDER_NOTIFY_EMAIL']], body=details,
+                        reply_to=order.email)]
+    if order.email:
+        messages.append(Message(subject=f"Your Sweet Treats order {order.reference}", recipients=[order.email],
+                                body=f"Thank you for your order! We'll contact you shortly to confirm.\n\n{details}"))
+    return messages
+
+# --- Page Cache ---
+class CachedPage:
+    __slots__ = ('body', 'content_type', 'etag', 'last_modified')
 
-def send_email(msg):
-    """Run email sending in a background thread."""
-    Thread(target=send_async_email, args=(app, msg)).start()
+    def __init__(self, body, content_type, etag, last_modified):
+        self.body = body
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
 
-# --- Mail Configuration ---
-app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS'] = True
-app.config['MAIL_USERNAME'] = 'your_email@gmail.com'  # Replace with your Gmail
-app.config['MAIL_PASSWORD'] = 'your_app_password'      # Use App Password
-app.config['MAIL_DEFAULT_SENDER'] = ('Sweet Treats Bakery', 'your_email@gmail.com')
+class MemoryPageCache:
+    """In-process LRU of rendered pages, bounded by total body size"""
 
-mail = Mail(app)
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
 
-# --- Configuration ---
-app.config['SECRET_KEY'] = 'your_super_secret_key_change_in_production'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///pastrystore.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    def get(self, key):
+        with self._lock:
+            page = self._entries.get(key)
+            if page is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return page
 
-# WhatsApp Business Configuration
-WHATSAPP_NUMBER = '2348012345678'  # Replace with your WhatsApp number (include country code, no + or spaces)
+    def set(self, key, page):
+        if len(page.body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old.body)
+            self._entries[key] = page
+            self._size += len(page.body)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.body)
 
-# Directory for uploaded images
-UPLOAD_FOLDER = 'static/uploads'
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
 
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+    def stats(self):
+        with self._lock:
+            return {'backend': 'memory', 'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self._entries), 'bytes': self._size}
 
-db = SQLAlchemy(app)
-login_manager = LoginManager(app)
-login_manager.login_view = 'admin_login'
-login_manager.login_message_category = 'info'
+class FileSystemPageCache:
+    """Rendered pages stored as files, shared by every worker on the host.
 
-# --- Helper Functions ---
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    Bounded by total size like the memory backend: a hit refreshes the
+    file's mtime (at most once a minute), and once the directory outgrows
+    max_bytes the least recently used files are deleted. Each worker
+    rescans the directory after writing a tenth of the budget, so pages
+    written by other workers are counted too.
+    """
 
-def save_uploaded_file(file):
-    if file and allowed_file(file.filename):
-        filename_base, file_extension = os.path.splitext(secure_filename(file.filename))
-        unique_filename = str(uuid.uuid4()) + file_extension
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(file_path)
-        return unique_filename
-    return None
+    TOUCH_AFTER = 60  # seconds; a hit on an older file marks it recently used
 
-def download_and_save_image(image_url):
-    if not image_url:
-        return None
-    try:
-        response = requests.get(image_url, stream=True, timeout=10)
-        response.raise_for_status()
-        
-        content_type = response.headers.get('Content-Type')
-        extension = '.jpg'
-        if content_type and 'image/' in content_type:
-            extension = '.' + content_type.split('/')[-1].replace('jpeg', 'jpg')
-        elif '.' in image_url:
-            extension = os.path.splitext(image_url)[1]
-
-        unique_filename = str(uuid.uuid4()) + extension
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-
-        with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        return unique_filename
-    except Exception as e:
-        print(f"Error downloading image {image_url}: {e}")
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._scan())
+        self._written = 0  # bytes written since the last scan
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def _scan(self):
+        """(path, size, mtime) of every cached page, temp files excluded"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.tmp'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                header = json.loads(f.readline())
+                body = f.read()
+                if os.fstat(f.fileno()).st_mtime < time.time() - self.TOUCH_AFTER:
+                    os.utime(f.fileno())
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return CachedPage(body, header['content_type'], header['etag'], header['last_modified'])
+
+    def set(self, key, page):
+        header = json.dumps({'content_type': page.content_type, 'etag': page.etag,
+                             'last_modified': page.last_modified}).encode('utf-8') + b'\n'
+        size = len(header) + len(page.body)
+        if size > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(header + page.body)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._size += size
+            self._written += size
+            if self._size > self.max_bytes or self._written > self.max_bytes // 10:
+                self._evict()
+
+    def _evict(self):
+        """Recount the directory and delete the oldest pages until it is back under 90% of the budget"""
+        entries = self._scan()
+        self._size = sum(size for _, size, _ in entries)
+        self._written = 0
+        if self._size <= self.max_bytes:
+            return
+        for path, size, _ in sorted(entries, key=lambda entry: entry[2]):
+            if self._size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # another worker evicted it
+            self._size -= size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+        with self._lock:
+            self._size = 0
+            self._written = 0
+
+    def stats(self):
+        entries = self._scan()
+        return {'backend': 'filesystem', 'hits': self.hits, 'misses': self.misses,
+                'entries': len(entries), 'bytes': sum(size for _, size, _ in entries)}
+
+class NullPageCache:
+    def get(self, key):
         return None
 
-def generate_whatsapp_link(pastry_name, pastry_price):
-    """Generate WhatsApp link with pre-filled message"""
-    message = f"Hello! I'm interested in ordering {pastry_name} priced at ₦{pastry_price:,.0f}. Is it available?"
-    encoded_message = quote(message)
-    return f"https://wa.me/{WHATSAPP_NUMBER}?text={encoded_message}"
+    def set(self, key, page):
+        pass
 
-# --- Database Models ---
-class User(db.Model, UserMixin):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(20), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
+    def clear(self):
+        pass
 
-    def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+    def stats(self):
+        return {'backend': 'none'}
 
-    def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+def create_page_cache():
+    backend = app.config['PAGE_CACHE_BACKEND']
+    if backend == 'memory':
+        return MemoryPageCache(app.config['PAGE_CACHE_MAX_BYTES'])
+    if backend == 'filesystem':
+        return FileSystemPageCache(app.config['PAGE_CACHE_DIR'] or os.path.join(app.instance_path, 'page_cache'),
+                                   app.config['PAGE_CACHE_MAX_BYTES'])
+    return NullPageCache()
 
-class Pastry(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    category = db.Column(db.String(50), nullable=False)  # Cakes, Cookies, Bread, Donuts, etc.
-    price = db.Column(db.Float, nullable=False)
-    image = db.Column(db.String(200), nullable=False)
-    description = db.Column(db.Text, nullable=False)
-    serving_size = db.Column(db.String(50), nullable=True)  # e.g., "Serves 10-12", "6 pieces", etc.
-    available = db.Column(db.Boolean, default=True)  # Is it currently available?
-    
-    gallery_json = db.Column(db.Text, nullable=True)
-    ingredients_json = db.Column(db.Text, nullable=True)  # List of ingredients
-    allergens_json = db.Column(db.Text, nullable=True)  # List of allergens
-    features_json = db.Column(db.Text, nullable=True)  # Special features (e.g., "Sugar-free", "Gluten-free")
+page_cache = create_page_cache()
 
-    @property
-    def gallery(self):
-        return json.loads(self.gallery_json) if self.gallery_json else []
+def page_cache_key(version, endpoint, view_args, query_args):
+    """Cache key for a page: catalog version, endpoint, view args and (name, value) query args"""
+    return f'{version}|{endpoint}|{sorted(view_args.items())}|{sorted(query_args)}'
 
-    @gallery.setter
-    def gallery(self, value):
-        self.gallery_json = json.dumps(value)
+def page_version(view, view_args):
+    """Version a cached page is keyed and dated on: the catalog version, or the
+    view's own stamp (see cached_page) if that has moved past it"""
+    version = catalog_version()
+    if view.page_stamp is not None:
+        version = max(version, view.page_stamp(**view_args))
+    return version
 
-    @property
-    def ingredients(self):
-        return json.loads(self.ingredients_json) if self.ingredients_json else []
+def page_query_args(view, args):
+    """The (name, value) query args that go into `view`'s cache key, or None if the page can't be cached.
 
-    @ingredients.setter
-    def ingredients(self, value):
-        self.ingredients_json = json.dumps(value)
+    Only args the view declared with cached_page(args=...) are kept; tracking
+    args are dropped. Any other arg makes the request uncacheable, so random
+    query strings can't fill the cache with copies of the same page.
+    """
+    allowed = view.page_cache_args
+    ignored = app.config['PAGE_CACHE_IGNORED_ARGS']
+    query_args = []
+    for name, value in args.items(multi=True):
+        if name in allowed:
+            query_args.append((name, value))
+        elif name not in ignored:
+            return None
+    return query_args
 
-    @property
-    def allergens(self):
-        return json.loads(self.allergens_json) if self.allergens_json else []
+def serve_cached_page(page):
+    response = make_response(page.body)
+    response.content_type = page.content_type
+    response.set_etag(page.etag)
+    response.last_modified = page.last_modified
+    response.headers['Cache-Control'] = 'public, no-cache'
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
 
-    @allergens.setter
-    def allergens(self, value):
-        self.allergens_json = json.dumps(value)
+def cached_page(view=None, *, args=(), stamp=None):
+    """Serve a public page from the page cache, answering conditional GETs with 304.
 
-    @property
-    def features(self):
-        return json.loads(self.features_json) if self.features_json else []
+    `args` names the query args the page depends on; requests carrying any
+    other (tracking args aside) are rendered but not cached. `stamp`, called
+    with the view args, returns a version for data that changes without a
+    catalog bump, such as stock. Logged-in admins and requests with pending
+    flash messages always bypass the cache, as do non-200 responses.
+    """
+    if view is None:
+        return lambda view: cached_page(view, args=args, stamp=stamp)
 
-    @features.setter
-    def features(self, value):
-        self.features_json = json.dumps(value)
-    
-    @property
-    def image_url(self):
-        return url_for('static', filename=f'uploads/{self.image}') if self.image else 'https://placehold.co/400x400/cccccc/333333?text=No+Image'
+    @wraps(view)
+    def wrapper(*view_args, **kwargs):
+        if request.method != 'GET' or '_flashes' in session or current_user.is_authenticated:
+            return view(*view_args, **kwargs)
+        query_args = page_query_args(wrapper, request.args)
+        if query_args is None:
+            return view(*view_args, **kwargs)
 
-    @property
-    def gallery_urls(self):
-        return [url_for('static', filename=f'uploads/{filename}') for filename in self.gallery]
-    
-    @property
-    def whatsapp_link(self):
-        return generate_whatsapp_link(self.name, self.price)
+        version = page_version(wrapper, request.view_args or {})
+        key = page_cache_key(version, request.endpoint, request.view_args or {}, query_args)
+        page = page_cache.get(key)
+        if page is None:
+            response = make_response(view(*view_args, **kwargs))
+            if response.status_code != 200 or '_flashes' in session:
+                return response
+            body = response.get_data()
+            page = CachedPage(body, response.content_type, hashlib.sha256(body).hexdigest(),
+                              version // 1_000_000_000)
+            page_cache.set(key, page)
+        return serve_cached_page(page)
+    wrapper.page_cache_args = frozenset(args)  # also tells asgi.py it may serve hits for this endpoint itself
+    wrapper.page_stamp = stamp
+    return wrapper
+
+# --- Query Budget ---
+PUBLIC_ENDPOINTS = {'home', 'pastries', 'pastry_detail', 'search', 'about', 'contact', 'api_pastries', 'api_pastry'}
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_sql_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.sql_statements = g.get('sql_statements', 0) + 1
+        conn.info['statement_started'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def time_sql_statement(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('statement_started', None)
+    if started is not None and has_request_context():
+        g.sql_seconds = g.get('sql_seconds', 0.0) + time.perf_counter() - started
+
+@app.before_request
+def reset_sql_statement_count():
+    g.sql_statements = 0
+    g.sql_seconds = 0.0
+
+@app.after_request
+def check_query_budget(response):
+    count = g.get('sql_statements', 0)
+    budget = app.config['PUBLIC_QUERY_BUDGET']
+    if request.endpoint in PUBLIC_ENDPOINTS and count > budget:
+        message = f"{request.method} {request.full_path} issued {count} SQL statements (budget {budget})"
+        if app.config['ENFORCE_QUERY_BUDGET']:
+            raise QueryBudgetExceeded(message)
+        print(f"Query budget exceeded: {message}")
+    return response
+
+# --- Metrics ---
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+STATEMENT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._metrics = OrderedDict()  # name -> (kind, help, buckets, {label items: value})
+
+    def counter(self, name, help_text):
+        self._metrics[name] = ('counter', help_text, None, {})
+
+    def histogram(self, name, help_text, buckets):
+        self._metrics[name] = ('histogram', help_text, tuple(buckets), {})
+
+    def inc(self, name, labels, amount=1):
+        series = self._metrics[name][3]
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        _, _, buckets, series = self._metrics[name]
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            state = series.get(key)
+            if state is None:
+                # Per-bucket counts (the last one past every bound), sum, count
+                state = series[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    @staticmethod
+    def _labels(items, extra=()):
+        pairs = []
+        for key, value in (*items, *extra):
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            pairs.append(f'{key}="{value}"')
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, buckets, series) in self._metrics.items():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for key, value in sorted(series.items()):
+                    if kind == 'counter':
+                        lines.append(f'{name}{self._labels(key)} {value}')
+                        continue
+                    counts, total, count = value
+                    cumulative = 0
+                    for bound, bucket_count in zip(buckets, counts):
+                        cumulative += bucket_count
+                        lines.append(f'{name}_bucket{self._labels(key, [("le", bound)])} {cumulative}')
+                    lines.append(f'{name}_bucket{self._labels(key, [("le", "+Inf")])} {count}')
+                    lines.append(f'{name}_sum{self._labels(key)} {total}')
+                    lines.append(f'{name}_count{self._labels(key)} {count}')
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+metrics.counter('pastry_http_requests_total', 'HTTP requests by endpoint, method and status.')
+metrics.histogram('pastry_http_request_duration_seconds', 'Request latency.', LATENCY_BUCKETS)
+metrics.histogram('pastry_http_response_size_bytes', 'Response body size, when known up front.', SIZE_BUCKETS)
+metrics.histogram('pastry_sql_statements_per_request', 'SQL statements issued per request.', STATEMENT_BUCKETS)
+metrics.counter('pastry_sql_seconds_total', 'Time spent executing SQL statements.')
+metrics.histogram('pastry_template_render_seconds', 'Jinja render time per top-level template.', LATENCY_BUCKETS)
+
+class SlowRequestProfiler:
+    """Samples the stacks of in-flight requests from a background thread.
+
+    Requests slower than PROFILE_SLOW_REQUEST_MS get their samples written
+    to PROFILE_DIR as folded stacks ("frame;frame;frame count" per line),
+    which flamegraph.pl and speedscope read directly.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._active = {}  # thread id -> Counter of folded stacks
+        self._thread = None
+
+    def start_request(self):
+        with self._lock:
+            self._active[get_ident()] = Counter()
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread.start()
+
+    def finish_request(self, duration, label):
+        with self._lock:
+            samples = self._active.pop(get_ident(), None)
+        if samples and duration * 1000 >= app.config['PROFILE_SLOW_REQUEST_MS']:
+            self._dump(samples, label, duration)
+
+    @staticmethod
+    def _fold(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            path = os.path.join(*code.co_filename.split(os.sep)[-2:])  # flask/app.py vs package/app.py
+            names.append(f'{code.co_name} ({path}:{frame.f_lineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _run(self):
+        while True:
+            time.sleep(app.config['PROFILE_SAMPLE_INTERVAL_MS'] / 1000)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, samples in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[self._fold(frame)] += 1
+
+    def _dump(self, samples, label, duration):
+        directory = app.config['PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{secure_filename(label)}-{int(duration * 1000)}ms.folded"
+        with open(os.path.join(directory, name), 'w') as f:
+            for stack, count in samples.most_common():
+                f.write(f'{stack} {count}\n')
+        dumps = sorted(os.listdir(directory))
+        for old in dumps[:max(0, len(dumps) - app.config['PROFILE_MAX_DUMPS'])]:
+            os.remove(os.path.join(directory, old))
+
+request_profiler = SlowRequestProfiler()
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    if app.config['PROFILE_SLOW_REQUEST_MS']:
+        request_profiler.start_request()
+
+@app.after_request
+def note_response_metrics(response):
+    g.response_status = response.status_code
+    g.response_size = response.content_length
+    return response
+
+@app.teardown_request
+def record_request_metrics(exc):
+    # Teardown also runs when a view raises, which after_request hooks do not see
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    duration = time.perf_counter() - started
+    endpoint = request.endpoint or 'unmatched'  # keeps 404 paths out of the label set
+    labels = {'endpoint': endpoint, 'method': request.method}
+    status = 500 if exc is not None else g.get('response_status', 500)
+    metrics.inc('pastry_http_requests_total', {**labels, 'status': status})
+    metrics.observe('pastry_http_request_duration_seconds', labels, duration)
+    if exc is None and g.get('response_size') is not None:
+        metrics.observe('pastry_http_response_size_bytes', {'endpoint': endpoint}, g.response_size)
+    metrics.observe('pastry_sql_statements_per_request', {'endpoint': endpoint}, g.get('sql_statements', 0))
+    metrics.inc('pastry_sql_seconds_total', {'endpoint': endpoint}, g.get('sql_seconds', 0.0))
+    if app.config['PROFILE_SLOW_REQUEST_MS']:
+        request_profiler.finish_request(duration, endpoint)
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    g.setdefault('template_started', []).append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def record_template_render(sender, template, context, **extra):
+    started = g.get('template_started')
+    if started:
+        metrics.observe('pastry_template_render_seconds', {'template': template.name or 'string'},
+                        time.perf_counter() - started.pop())
+
+# --- Rate Limiting ---
+class MemoryRateLimitStore:
+    """Sliding-window log per key: the expiry time of each counted request, oldest first"""
+
+    SWEEP_EVERY = 1024  # calls between passes dropping keys whose requests have all expired
+
+    def __init__(self):
+        self._hits = {}
+        self._lock = Lock()
+        self._calls = 0
+
+    def _active(self, key, now):
+        hits = self._hits.get(key)
+        while hits and hits[0] <= now:
+            hits.popleft()
+        return hits
+
+    def _sweep(self, now):
+        self._calls += 1
+        if self._calls % self.SWEEP_EVERY == 0:
+            for key in [key for key, hits in self._hits.items() if not hits or hits[-1] <= now]:
+                del self._hits[key]
+
+    def hit(self, key, limit, window):
+        """Count a request; returns 0, or the seconds until one is allowed (not counted)"""
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            hits = self._active(key, now)
+            if hits and len(hits) >= limit:
+                return hits[0] - now
+            self._hits.setdefault(key, deque()).append(now + window)
+            return 0
+
+    def clear(self, key):
+        with self._lock:
+            self._hits.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'memory', 'keys': len(self._hits)}
+
+class SQLiteRateLimitStore:
+    """Sliding-window log per key in a SQLite file, shared by every worker on the host.
+
+    Kept out of the catalog database so an attack doesn't queue up behind,
+    or hold up, checkout writes.
+    """
+
+    SWEEP_EVERY = 1024
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading_local()
+        self._calls = 0
+        self._connection().execute('CREATE TABLE IF NOT EXISTS rate_limit_hit (key TEXT NOT NULL, expires REAL NOT NULL)')
+        self._connection().execute('CREATE INDEX IF NOT EXISTS ix_rate_limit_hit_key ON rate_limit_hit (key, expires)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def hit(self, key, limit, window):
+        now = time.time()
+        connection = self._connection()
+        # IMMEDIATE takes the write lock up front, so two workers can't both see the last free slot
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            count, oldest = connection.execute(
+                'SELECT count(*), min(expires) FROM rate_limit_hit WHERE key = ? AND expires > ?', (key, now)).fetchone()
+            if count >= limit:
+                retry_after = oldest - now
+            else:
+                connection.execute('INSERT INTO rate_limit_hit (key, expires) VALUES (?, ?)', (key, now + window))
+                retry_after = 0
+            self._calls += 1
+            if self._calls % self.SWEEP_EVERY == 0:
+                connection.execute('DELETE FROM rate_limit_hit WHERE expires <= ?', (now,))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return retry_after
+
+    def clear(self, key):
+        self._connection().execute('DELETE FROM rate_limit_hit WHERE key = ?', (key,))
+
+    def stats(self):
+        keys, = self._connection().execute('SELECT count(DISTINCT key) FROM rate_limit_hit WHERE expires > ?',
+                                           (time.time(),)).fetchone()
+        return {'backend': 'sqlite', 'keys': keys}
+
+class NullRateLimitStore:
+    def hit(self, key, limit, window):
+        return 0
+
+    def clear(self, key):
+        pass
+
+    def stats(self):
+        return {'backend': 'none'}
+
+def create_rate_limit_store():
+    backend = app.config['RATE_LIMIT_BACKEND']
+    if backend == 'memory':
+        return MemoryRateLimitStore()
+    if backend == 'sqlite':
+        os.makedirs(app.instance_path, exist_ok=True)
+        return SQLiteRateLimitStore(app.config['RATE_LIMIT_DB'] or os.path.join(app.instance_path, 'ratelimit.db'))
+    return NullRateLimitStore()
+
+rate_limits = create_rate_limit_store()
+metrics.counter('pastry_rate_limited_total', 'Requests refused with 429 by rate limit rule.')
+
+if app.config['PROXY_FIX_X_FOR']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+
+def rate_limit(rule, identity):
+    """Count a request by `identity` against the RATE_LIMITS `rule`, or abort with 429 and Retry-After"""
+    limit, window = app.config['RATE_LIMITS'][rule]
+    retry_after = rate_limits.hit(f'{rule}:{identity}', limit, window)
+    if retry_after > 0:
+        metrics.inc('pastry_rate_limited_total', {'rule': rule})
+        raise TooManyRequests(retry_after=math.ceil(retry_after))
+
+def reset_rate_limit(rule, identity):
+    """Forget `identity`'s requests under `rule`, e.g. a username's attempts once it logs in"""
+    rate_limits.clear(f'{rule}:{identity}')
+
+# --- Background Jobs ---
+JOB_HANDLERS = {}
+
+def job_handler(kind, batch_size=1):
+    """Register a job handler.
+
+    Handlers take a list of payloads (at most `batch_size`) and return a list
+    of the same length holding None for success or an exception for failure.
+    Raising fails the whole batch.
+    """
+    def decorator(fn):
+        JOB_HANDLERS[kind] = (fn, batch_size)
+        return fn
+    return decorator
+
+def enqueue_job(kind, payload, delay=0, max_attempts=None, commit=True):
+    """Persist a job and wake the local workers. With commit=False the job
+    is only added to the session, committing with the caller's transaction."""
+    job = Job(kind=kind, payload_json=json.dumps(payload), run_at=time.time() + delay,
+              max_attempts=max_attempts or app.config['JOB_MAX_ATTEMPTS'])
+    db.session.add(job)
+    if commit:
+        db.session.commit()
+    start_job_workers()
+    job_workers.wake.set()
+    return job
+
+def requeue_stale_jobs():
+    """Return jobs stranded in 'running' by a crashed or restarted worker to the queue"""
+    cutoff = time.time() - app.config['JOB_LOCK_TIMEOUT']
+    count = Job.query.filter(Job.status == 'running', Job.locked_at < cutoff).update(
+        {'status': 'pending', 'locked_by': None, 'locked_at': None}, synchronize_session=False)
+    db.session.commit()
+    return count
+
+def purge_done_jobs(older_than=None, batch_size=1000):
+    """Delete done jobs that ran more than `older_than` seconds ago, returning how many.
+
+    Deletes in batches so a large backlog doesn't hold the write lock for long.
+    """
+    if older_than is None:
+        older_than = app.config['JOB_RETENTION_SECONDS']
+    cutoff = time.time() - older_than
+    total = 0
+    while True:
+        ids = [row[0] for row in db.session.query(Job.id).filter(
+            Job.status == 'done', Job.run_at < cutoff).limit(batch_size)]
+        if not ids:
+            return total
+        Job.query.filter(Job.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        total += len(ids)
+
+def claim_jobs(worker_id):
+    """Atomically claim a batch of due jobs of one kind, oldest first"""
+    now = time.time()
+    first = Job.query.filter(Job.status == 'pending', Job.run_at <= now).order_by(Job.run_at).first()
+    if first is None:
+        return []
+    _, batch_size = JOB_HANDLERS.get(first.kind, (None, 1))
+    ids = [row[0] for row in db.session.query(Job.id).filter(
+        Job.status == 'pending', Job.run_at <= now, Job.kind == first.kind
+    ).order_by(Job.run_at).limit(batch_size)]
+    # The status guard makes the claim safe against other workers and processes
+    Job.query.filter(Job.id.in_(ids), Job.status == 'pending').update(
+        {'status': 'running', 'locked_by': worker_id, 'locked_at': now}, synchronize_session=False)
+    db.session.commit()
+    return Job.query.filter(Job.id.in_(ids), Job.locked_by == worker_id,
+                            Job.status == 'running').order_by(Job.run_at).all()
+
+def finish_job(job, error):
+    if error is None:
+        job.status = 'done'
+        job.last_error = None
+    else:
+        job.attempts += 1
+        job.last_error = f'{type(error).__name__}: {error}'
+        if job.attempts >= job.max_attempts:
+            job.status = 'dead'
+            print(f"Job {job.id} ({job.kind}) dead-lettered after {job.attempts} attempts: {error}")
+        else:
+            job.status = 'pending'
+            backoff = app.config['JOB_BACKOFF_SECONDS'] * (2 ** (job.attempts - 1))
+            job.run_at = time.time() + backoff * random.uniform(0.8, 1.2)
+    job.locked_by = None
+    job.locked_at = None
+
+def run_jobs_once(worker_id):
+    """Claim and run one batch, returning the number of jobs processed"""
+    jobs = claim_jobs(worker_id)
+    if not jobs:
+        return 0
+    handler = JOB_HANDLERS.get(jobs[0].kind)
+    if handler is None:
+        errors = [LookupError(f'no handler for {jobs[0].kind!r}')] * len(jobs)
+    else:
+        try:
+            errors = handler[0]([job.payload for job in jobs])
+        except Exception as e:
+            # Drop the handler's partial writes; a failed flush would also block the commit below
+            db.session.rollback()
+            errors = [e] * len(jobs)
+    for job, error in zip(jobs, errors):
+        finish_job(job, error)
+    db.session.commit()
+    return len(jobs)
+
+class JobWorkers:
+    """A bounded pool of threads draining the job table"""
+
+    def __init__(self):
+        self.wake = Event()
+        self._threads = []
+        self._lock = Lock()
+        self._stopping = Event()
+
+    def start(self, count):
+        with self._lock:
+            if self._threads or count <= 0:
+                return
+            self._stopping.clear()
+            for i in range(count):
+                worker_id = f'{socket.gethostname()}:{os.getpid()}:{i}'
+                # The first thread periodically requeues stale jobs and purges old done ones, keeping
+                # those writes off the request that started the pool
+                thread = Thread(target=self._run, args=(worker_id, i == 0), name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        self._stopping.set()
+        self.wake.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _run(self, worker_id, maintain=False):
+        next_requeue = next_purge = time.monotonic()
+        while not self._stopping.is_set():
+            try:
+                with app.app_context():
+                    if maintain and time.monotonic() >= next_requeue:
+                        next_requeue = time.monotonic() + app.config['JOB_REQUEUE_INTERVAL']
+                        requeue_stale_jobs()
+                    if maintain and time.monotonic() >= next_purge:
+                        next_purge = time.monotonic() + app.config['JOB_PURGE_INTERVAL']
+                        purge_done_jobs()
+                    processed = run_jobs_once(worker_id)
+            except Exception as e:
+                print(f"Job worker {worker_id} error: {e}")
+                processed = 0
+            if not processed:
+                self.wake.wait(app.config['JOB_POLL_SECONDS'])
+                self.wake.clear()
+
+job_workers = JobWorkers()
+
+def start_job_workers():
+    job_workers.start(app.config['JOB_WORKERS'])
+
+@app.before_request
+def ensure_job_workers():
+    # Picks up jobs left over from before a restart as soon as the worker serves traffic
+    if not job_workers._threads and app.config['JOB_WORKERS'] > 0:
+        start_job_workers()
+
+@job_handler('send_email', batch_size=app.config['EMAIL_BATCH_SIZE'])
+def send_email_batch(payloads):
+    """Send queued emails over a single SMTP connection"""
+    errors = []
+    with mail.connect() as connection:
+        for payload in payloads:
+            try:
+                sender = payload.get('sender')
+                connection.send(Message(
+                    subject=payload['subject'],
+                    recipients=payload['recipients'],
+                    body=payload.get('body'),
+                    html=payload.get('html'),
+                    sender=tuple(sender) if isinstance(sender, list) else sender,
+                    reply_to=payload.get('reply_to'),
+                ))
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+    return errors
+
+@job_handler('generate_derivatives', batch_size=4)
+def generate_derivatives_batch(payloads):
+    filenames = [payload['filename'] for payload in payloads if generate_derivatives(payload['filename'])]
+    # Cached pages rendered before the variants existed have no srcset for them
+    pastry_ids, cards = pastries_showing_images(filenames)
+    if pastry_ids:
+        bump_pastry_versions(pastry_ids, listings=cards)
+    return [None] * len(payloads)
+
+@job_handler('refresh_similarity', batch_size=50)
+def refresh_similarity_batch(payloads):
+    # Cached detail pages show the old related items
+    bump_pastry_versions(refresh_similarity([payload['pastry_id'] for payload in payloads]))
+    return [None] * len(payloads)
+
+@job_handler('rebuild_similarity')
+def rebuild_similarity_job(payloads):
+    rebuild_similarity()
+    bump_pastry_versions(None)
+    return [None] * len(payloads)
+
+@job_handler('download_image')
+def download_image_job(payloads):
+    """Download an image URL, optionally attaching it to a pastry's image or gallery"""
+    errors = []
+    for payload in payloads:
+        downloaded = download_and_save_image(payload['url'])
+        if downloaded is None:
+            errors.append(IOError(f"download failed: {payload['url']}"))
+            continue
+        filename, _ = downloaded
+        schedule_derivatives(filename)
+        pastry = db.session.get(Pastry, payload['pastry_id']) if payload.get('pastry_id') else None
+        if pastry is not None:
+            if payload.get('field') == 'gallery':
+                pastry.gallery = pastry.gallery + [filename]
+            else:
+                pastry.image = filename
+        db.session.commit()
+        if pastry is not None:
+            bump_pastry_versions([payload['pastry_id']], listings=payload.get('field') != 'gallery')
+        errors.append(None)
+    return errors
 
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
 # --- Initial Data ---
-initial_pastry_data = {
-    'Cakes': [
-        {
-            'name': 'Chocolate Fudge Cake',
-            'category': 'Cakes',
-            'price': 15000,
-            'serving_size': 'Serves 10-12',
-            'available': True,
-            'image': 'https://images.unsplash.com/photo-1578985545062-69928b1d9587?w=400',
-            'gallery': [
-                'https://images.unsplash.com/photo-1578985545062-69928b1d9587?w=600',
-                'https://images.unsplash.com/photo-1606890737304-57a1ca8a5b62?w=600'
-            ],
-            'description': 'Rich, moist chocolate cake with creamy fudge frosting',
-            'ingredients': ['Flour', 'Cocoa powder', 'Eggs', 'Sugar', 'Butter', 'Milk', 'Vanilla extract'],
-            'allergens': ['Eggs', 'Dairy', 'Gluten'],
-            'features': ['Freshly baked', 'Custom message available', 'Perfect for celebrations']
-        },
-        {
-            'name': 'Red Velvet Cake',
-            'category': 'Cakes',
-            'price': 18000,
-            'serving_size': 'Serves 12-15',
-            'available': True,
-            'image': 'https://images.unsplash.com/photo-1586985289688-ca3cf47d3e6e?w=400',
-            'gallery': [
-                'https://images.unsplash.com/photo-1586985289688-ca3cf47d3e6e?w=600'
-            ],
-            'description': 'Classic red velvet with cream cheese frosting',
-            'ingredients': ['Flour', 'Cocoa powder', 'Buttermilk', 'Eggs', 'Sugar', 'Cream cheese', 'Red food coloring'],
-            'allergens': ['Eggs', 'Dairy', 'Gluten'],
-            'features': ['Signature recipe', 'Smooth cream cheese frosting', 'Instagram-worthy']
-        },
-        {
-            'name': 'Vanilla Sponge Cake',
-            'category': 'Cakes',
-            'price': 12000,
-            'serving_size': 'Serves 8-10',
-            'available': True,
-            'image': 'https://images.unsplash.com/photo-1588195538326-c5b1e5b80c18?w=400',
-            'gallery': [
-                'https://images.unsplash.com/photo-1588195538326-c5b1e5b80c18?w=600'
-            ],
-            'description': 'Light and fluffy vanilla sponge cake with buttercream',
-            'ingredients': ['Flour', 'Eggs', 'Sugar', 'Butter', 'Vanilla extract', 'Milk'],
-            'allergens': ['Eggs', 'Dairy', 'Gluten'],
-            'features': ['Light and fluffy', 'Perfect for any occasion', 'Can be customized']
-        }
-    ],
-    'Cookies': [
-        {
-            'name': 'Chocolate Chip Cookies',
-            'category': 'Cookies',
-            'price': 3500,
-            'serving_size': '12 pieces',
-            'available': True,
-            'image': 'https://images.unsplash.com/photo-1499636136210-6f4ee915583e?w=400',
-            'gallery': [
-                'https://images.unsplash.com/photo-1499636136210-6f4ee915583e?w=600'
-            ],
-            'description': 'Classic homemade chocolate chip cookies, crispy outside, chewy inside',
-            'ingredients': ['Flour', 'Chocolate chips', 'Butter', 'Brown sugar', 'Eggs', 'Vanilla'],
-            'allergens': ['Eggs', 'Dairy', 'Gluten'],
-            'features': ['Freshly baked daily', 'Crispy edges, chewy center', 'Perfect with milk']
-        },
-        {
-            'name': 'Oatmeal Raisin Cookies',
-            'category': 'Cookies',
-            'price': 3000,
-            'serving_size': '12 pieces',
-            'available': True,
-            'image': 'https://images.unsplash.com/photo-1618897996318-5a901fa6ca71?w=400',
-            'gallery': [
-                'https://images.unsplash.com/photo-1618897996318-5a901fa6ca71?w=600'
-            ],
-            'description': 'Hearty oatmeal cookies with plump raisins',
-            'ingredients': ['Oats', 'Raisins', 'Flour', 'Butter', 'Brown sugar', 'Eggs', 'Cinnamon'],
-            'allergens': ['Eggs', 'Dairy', 'Gluten'],
-            'features': ['Healthy option', 'No artificial flavors', 'Great for breakfast']
-        }
-    ],
-    'Bread': [
-        {
-            'name': 'Artisan Sourdough Bread',
-            'category': 'Bread',
-            'price': 2500,
-            'serving_size': '1 loaf',
-            'available': True,
-            'image': 'https://images.unsplash.com/photo-1509440159596-0249088772ff?w=400',
-            'gallery': [
-                'https://images.unsplash.com/photo-1509440159596-0249088772ff?w=600'
-            ],
-            'description': 'Crusty sourdough bread with a tangy flavor and chewy texture',
-            'ingredients': ['Flour', 'Water', 'Salt', 'Sourdough starter'],
-            'allergens': ['Gluten'],
-            'features': ['No yeast added', 'Long fermentation', 'Crusty exterior']
-        },
-        {
-            'name': 'Whole Wheat Bread',
-            'category': 'Bread',
-            'price': 1800,
-            'serving_size': '1 loaf',
-            'available': True,
-            'image': 'https://images.unsplash.com/photo-1549931319-a545dcf3bc0c?w=400',
-            'gallery': [
-                'https://images.unsplash.com/photo-1549931319-a545dcf3bc0c?w=600'
-            ],
-            'description': 'Nutritious whole wheat bread, perfect for sandwiches',
-            'ingredients': ['Whole wheat flour', 'Water', 'Yeast', 'Salt', 'Honey'],
-            'allergens': ['Gluten'],
-            'features': ['High fiber', 'No preservatives', 'Freshly baked']
-        }
-    ],
-    'Donuts': [
-        {
-            'name': 'Glazed Donuts',
-            'category': 'Donuts',
-            'price': 2000,
-            'serving_size': '6 pieces',
-            'available': True,
-            'image': 'https://images.unsplash.com/photo-1551024506-0bccd828d307?w=400',
-            'gallery': [
-                'https://images.unsplash.com/photo-1551024506-0bccd828d307?w=600'
-            ],
-            'description': 'Classic glazed donuts with a sweet, shiny coating',
-            'ingredients': ['Flour', 'Sugar', 'Eggs', 'Milk', 'Butter', 'Yeast', 'Vanilla'],
-            'allergens': ['Eggs', 'Dairy', 'Gluten'],
-            'features': ['Melt-in-your-mouth', 'Perfect morning treat', 'Kids favorite']
-        },
-        {
-            'name': 'Chocolate Frosted Donuts',
-            'category': 'Donuts',
-            'price': 2500,
-            'serving_size': '6 pieces',
-            'available': True,
-            'image': 'https://images.unsplash.com/photo-1527515637462-cff94eecc1ac?w=400',
-            'gallery': [
-                'https://images.unsplash.com/photo-1527515637462-cff94eecc1ac?w=600'
-            ],
-            'description': 'Soft donuts topped with rich chocolate frosting and sprinkles',
-            'ingredients': ['Flour', 'Cocoa powder', 'Sugar', 'Eggs', 'Milk', 'Butter', 'Sprinkles'],
-            'allergens': ['Eggs', 'Dairy', 'Gluten'],
-            'features': ['Rich chocolate flavor', 'Colorful sprinkles', 'Party favorite']
-        }
-    ],
-    'Pastries': [
-        {
-            'name': 'Croissants',
-            'category': 'Pastries',
-            'price': 1500,
-            'serving_size': '4 pieces',
-            'available': True,
-            'image': 'https://images.unsplash.com/photo-1555507036-ab1f4038808a?w=400',
-            'gallery': [
-                'https://images.unsplash.com/photo-1555507036-ab1f4038808a?w=600'
-            ],
-            'description': 'Buttery, flaky French croissants',
-            'ingredients': ['Flour', 'Butter', 'Milk', 'Sugar', 'Yeast', 'Salt'],
-            'allergens': ['Dairy', 'Gluten'],
-            'features': ['Authentic French recipe', 'Layered and flaky', 'Perfect with coffee']
-        },
-        {
-            'name': 'Meat Pies',
-            'category': 'Pastries',
-            'price': 2500,
-            'serving_size': '6 pieces',
-            'available': True,
-            'image': 'https://images.unsplash.com/photo-1509042239860-f550ce710b93?w=400',
-            'gallery': [
-                'https://images.unsplash.com/photo-1509042239860-f550ce710b93?w=600'
-            ],
-            'description': 'Savory meat pies with seasoned beef filling',
-            'ingredients': ['Flour', 'Ground beef', 'Onions', 'Spices', 'Butter'],
-            'allergens': ['Gluten', 'Dairy'],
-            'features': ['Nigerian favorite', 'Perfectly seasoned', 'Great for snacking']
-        }
-    ]
-}
+# A seed snapshot is a directory holding catalog.jsonl (the catalog export
+# format) and optionally images/: the uploads it references, with their
+# derivatives under images/derived/. The shipped seed/ snapshot refers to
+# images by URL; `flask seed-snapshot` writes one with the images bundled,
+# so seeding from it needs no network.
+SEED_CATALOG_FILE = 'catalog.jsonl'
 
-def populate_initial_data():
-    with app.app_context():
+def load_seed_snapshot(directory):
+    """Copy a snapshot's bundled images into the upload folder and import its catalog"""
+    images = os.path.join(directory, 'images')
+    copied = []
+    bundled = {}  # {stem: {format: [widths]}} of the derivatives in the snapshot
+    for root, _, names in os.walk(images):
+        for name in names:
+            source = os.path.join(root, name)
+            relative = os.path.relpath(source, images)
+            match = re.match(r'(.+)-(\d+)w\.(\w+)$', name)
+            if match and os.path.dirname(relative) == 'derived':
+                bundled.setdefault(match.group(1), {}).setdefault(match.group(3), []).append(int(match.group(2)))
+            target = os.path.join(app.config['UPLOAD_FOLDER'], relative)
+            # Uploads are content-addressed, so an existing file already has these bytes
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copyfile(source, target)
+                copied.append(relative)
+    if copied:
+        print(f"Copied {len(copied)} bundled image files.")
+        record_derivatives(bundled)
+        for filename in copied:
+            if os.sep not in filename:
+                schedule_derivatives(filename)  # only generates variants the snapshot lacked
+    with open(os.path.join(directory, SEED_CATALOG_FILE), encoding='utf-8') as f:
+        return import_catalog(f, 'jsonl', allow_missing_images=True)
+
+def write_seed_snapshot(directory):
+    """Export the catalog, the uploads it references and their derivatives; returns the number of images"""
+    images = os.path.join(directory, 'images')
+    os.makedirs(images, exist_ok=True)
+    with open(os.path.join(directory, SEED_CATALOG_FILE), 'w', encoding='utf-8') as f:
+        for chunk in export_catalog('jsonl'):
+            f.write(chunk)
+
+    filenames = set()
+    for image, gallery_json in db.session.execute(db.select(Pastry.image, Pastry.gallery_json)):
+        filenames.update([image, *json.loads(gallery_json or '[]')])
+    bundled = 0
+    for filename in sorted(name for name in filenames if name):
+        if not os.path.isfile(os.path.join(app.config['UPLOAD_FOLDER'], filename)):
+            continue
+        names = [filename] + [os.path.join('derived', derivative_name(filename, width, fmt))
+                              for fmt, widths in derivative_index.variants(filename).items() for width in widths]
+        for name in names:
+            target = os.path.join(images, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(os.path.join(app.config['UPLOAD_FOLDER'], name), target)
+        bundled += 1
+    return bundled
+
+def ensure_columns():
+    """Add nullable columns missing from a database built before they existed"""
+    inspector = sa_inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                with db.engine.begin() as conn:
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                print(f"Added column {table.name}.{column.name}")
+
+def ensure_indexes():
+    """Create any Pastry indexes missing from a database built before they existed"""
+    for index in Pastry.__table__.indexes:
+        index.create(bind=db.engine, checkfirst=True)
+
+def migrate_schema():
+    """Create missing tables, columns and indexes and the search index.
+
+    Each step checks what exists first, so it is cheap to run on every start;
+    a file lock keeps workers starting together from racing on ALTER TABLE.
+    """
+    os.makedirs(app.instance_path, exist_ok=True)
+    with open(os.path.join(app.instance_path, 'migrate.lock'), 'w') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)  # released when the file is closed
         db.create_all()
+        ensure_columns()
+        ensure_indexes()
+        ensure_search_index()
+        if ImageDerivatives.query.first() is None:
+            record_derivatives(scan_derived_folder())  # derivatives written before the table existed
+
+def populate_initial_data(snapshot=None):
+    with app.app_context():
+        migrate_schema()
+
+        if app.config['MATERIALIZED_STATS'] and CategoryStats.query.first() is None:
+            rebuild_category_stats()
 
         if User.query.filter_by(username='admin').first() is None:
             print("Creating default admin user...")
@@ -364,68 +3529,286 @@ def populate_initial_data():
             print("Default admin user created (username: admin, password: admin123)")
 
         if Pastry.query.count() == 0:
-            print("Populating initial pastry data...")
-            for category_name, pastries in initial_pastry_data.items():
-                for pastry_data in pastries:
-                    main_image_filename = download_and_save_image(pastry_data['image'])
-                    
-                    gallery_filenames = []
-                    for img_url in pastry_data.get('gallery', []):
-                        filename = download_and_save_image(img_url)
-                        if filename:
-                            gallery_filenames.append(filename)
-
-                    pastry = Pastry(
-                        name=pastry_data['name'],
-                        category=pastry_data['category'],
-                        price=pastry_data['price'],
-                        image=main_image_filename if main_image_filename else 'placeholder.png',
-                        description=pastry_data['description'],
-                        serving_size=pastry_data.get('serving_size'),
-                        available=pastry_data.get('available', True),
-                        gallery=gallery_filenames,
-                        ingredients=pastry_data.get('ingredients', []),
-                        allergens=pastry_data.get('allergens', []),
-                        features=pastry_data.get('features', [])
-                    )
-                    db.session.add(pastry)
-            db.session.commit()
-            print("Initial pastry data populated.")
+            snapshot = snapshot or app.config['SEED_SNAPSHOT']
+            print(f"Seeding the catalog from {snapshot}...")
+            report = load_seed_snapshot(snapshot)
+            for line, message in report.errors:
+                print(f"{SEED_CATALOG_FILE} line {line}: {message}")
+            print(f"Catalog seeded: {report.summary()}.")
+
+        attribute_index.rebuild()
+        if (PastryNeighbor.query.first() is None
+                and Job.query.filter_by(kind='rebuild_similarity', status='pending').first() is None):
+            rebuild_similarity()
+
+@app.cli.command('seed')
+@click.option('--snapshot', type=click.Path(exists=True, file_okay=False), default=None,
+              help='Snapshot directory (defaults to SEED_SNAPSHOT, the bundled seed/).')
+def seed_command(snapshot):
+    """Create the schema and admin user, and load a seed snapshot into an empty catalog."""
+    start = time.perf_counter()
+    populate_initial_data(snapshot)
+    # Run what the import queued (similarity, derivatives) here, so workers start with nothing to do
+    job_workers.stop()
+    processed = 0
+    while True:
+        count = run_jobs_once(f'seed:{os.getpid()}')
+        if not count:
+            break
+        processed += count
+    print(f"Seeded in {time.perf_counter() - start:.1f}s ({processed} background jobs run).")
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Add the tables, columns and indexes an older database is missing."""
+    migrate_schema()
+    print("Schema up to date.")
+
+@app.cli.command('seed-snapshot')
+@click.argument('directory', type=click.Path(file_okay=False))
+def seed_snapshot_command(directory):
+    """Write the current catalog and its images as a seed snapshot for `flask seed`."""
+    bundled = write_seed_snapshot(directory)
+    print(f"Wrote {Pastry.query.count()} pastries and {bundled} images to {directory}.")
+
+@app.cli.command('migrate-attributes')
+def migrate_attributes_command():
+    """Copy ingredients/allergens/features from the *_json columns into link tables."""
+    migrate_normalized_attributes()
+    print("Normalized attributes migrated.")
+
+@app.cli.command('backfill-derivatives')
+def backfill_derivatives_command():
+    """Generate missing thumbnails/WebP/AVIF variants for everything in the uploads folder."""
+    if Image is None:
+        print("Pillow is not installed; nothing to do.")
+        return
+    filenames = [name for name in os.listdir(app.config['UPLOAD_FOLDER'])
+                 if os.path.isfile(os.path.join(app.config['UPLOAD_FOLDER'], name)) and allowed_file(name)]
+    created = 0
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 2) as pool:
+        for i, count in enumerate(pool.map(generate_derivatives, filenames), 1):
+            created += count
+            print(f"[{i}/{len(filenames)}] {filenames[i - 1]}: {count} new")
+    if created:
+        bump_catalog_version()
+    print(f"Created {created} derivatives.")
+
+@app.cli.command('run-jobs')
+@click.option('--workers', type=int, default=None, help='Worker threads (defaults to JOB_WORKERS, minimum 1).')
+def run_jobs_command(workers):
+    """Run background job workers in the foreground until interrupted."""
+    count = max(1, workers or app.config['JOB_WORKERS'])
+    job_workers.start(count)
+    print(f"Running {count} job workers. Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        job_workers.stop()
+
+@app.cli.command('requeue-dead-jobs')
+def requeue_dead_jobs_command():
+    """Give dead-lettered jobs a fresh set of attempts."""
+    count = Job.query.filter_by(status='dead').update(
+        {'status': 'pending', 'attempts': 0, 'run_at': time.time()}, synchronize_session=False)
+    db.session.commit()
+    print(f"Requeued {count} jobs.")
+
+@app.cli.command('purge-jobs')
+@click.option('--older-than', type=int, default=None,
+              help='Seconds since a done job ran (defaults to JOB_RETENTION_SECONDS).')
+def purge_jobs_command(older_than):
+    """Delete finished jobs; the job workers also do this every JOB_PURGE_INTERVAL."""
+    count = purge_done_jobs(older_than)
+    print(f"Purged {count} done jobs.")
+
+@app.cli.group('catalog')
+def catalog_cli():
+    """Bulk catalog import and export."""
+
+# The files are opened in binary and wrapped, because click.File can't pass newline='' (csv needs it)
+@catalog_cli.command('import')
+@click.argument('source', type=click.File('rb'))
+@click.option('--format', 'fmt', type=click.Choice(CATALOG_FORMATS), default=None,
+              help='Defaults to the file extension (.csv, .jsonl), else csv.')
+@click.option('--dry-run', is_flag=True, help='Validate every row without writing anything.')
+def catalog_import_command(source, fmt, dry_run):
+    """Import pastries from a CSV or JSON Lines file ('-' for stdin)."""
+    start = time.perf_counter()
+    stream = io.TextIOWrapper(source, encoding='utf-8-sig', newline='')
+    report = import_catalog(stream, fmt or catalog_format(source.name), dry_run=dry_run)
+    for line, message in report.errors:
+        print(f"line {line}: {message}")
+    if report.error_count > len(report.errors):
+        print(f"... and {report.error_count - len(report.errors)} more errors")
+    print(f"{'Validated' if dry_run else 'Imported'} in {time.perf_counter() - start:.1f}s: {report.summary()}")
+    if report.error_count:
+        sys.exit(1)
+
+@catalog_cli.command('export')
+@click.argument('target', type=click.File('wb'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(CATALOG_FORMATS), default=None,
+              help='Defaults to the file extension (.csv, .jsonl), else csv.')
+def catalog_export_command(target, fmt):
+    """Export every pastry to a CSV or JSON Lines file (stdout by default)."""
+    stream = io.TextIOWrapper(target, encoding='utf-8', newline='')
+    for chunk in export_catalog(fmt or catalog_format(target.name)):
+        stream.write(chunk)
+    stream.flush()
+    stream.detach()  # click closes `target` itself
+
+@app.cli.command('rebuild-similarity')
+def rebuild_similarity_command():
+    """Recompute every pastry's related-pastries list."""
+    start = time.perf_counter()
+    count = rebuild_similarity()
+    bump_catalog_version()
+    print(f"Rebuilt neighbour lists for {count} pastries in {time.perf_counter() - start:.1f}s.")
+
+@app.cli.command('check-query-budget')
+def check_query_budget_command():
+    """Request every public page and fail if any exceeds PUBLIC_QUERY_BUDGET SQL statements."""
+    global page_cache
+    pastry = Pastry.query.order_by(Pastry.id).first()
+    category = pastry.category if pastry else 'Cakes'
+    word = pastry.name.split()[0] if pastry else 'cake'
+    urls = ['/', '/pastries', f'/pastries/{category}', '/pastries?allergen=Gluten',
+            '/pastries?exclude_allergen=Dairy&feature=Fresh', f'/search?q={word}',
+            f'/search?q={word}&format=json', '/about', '/contact']
+    urls += ['/api/pastries', f'/api/pastries?category={category}&fields=id,name,price']
+    if pastry:
+        urls += [f'/pastry/{pastry.id}', f'/api/pastries/{pastry.id}']
+
+    failures = []
+    saved_cache, page_cache = page_cache, NullPageCache()
+    try:
+        client = app.test_client()
+        for url in urls:
+            client.get(url)  # warm the in-process caches first
+            with client:
+                response = client.get(url)
+                count = g.get('sql_statements', 0)
+            over = count > app.config['PUBLIC_QUERY_BUDGET'] or response.status_code != 200
+            print(f"{'FAIL' if over else 'ok  '} {count:3d} statements  {response.status_code}  {url}")
+            if over:
+                failures.append(url)
+    finally:
+        page_cache = saved_cache
+    if failures:
+        print(f"{len(failures)} pages over budget ({app.config['PUBLIC_QUERY_BUDGET']} statements).")
+        sys.exit(1)
+    print("All public pages within the query budget.")
+
+@app.cli.command('compile-templates')
+def compile_templates_command():
+    """Fill the template bytecode cache so workers started afterwards skip compiling."""
+    if not app.config['TEMPLATE_BYTECODE_DIR']:
+        print("TEMPLATE_BYTECODE_DIR is not set; nothing to do.")
+        return
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    print(f"Compiled {len(names)} templates into {app.config['TEMPLATE_BYTECODE_DIR']}.")
+
+@app.cli.command('gc-uploads')
+@click.option('--dry-run', is_flag=True, help='Only report what would be deleted.')
+@click.option('--grace', type=int, default=None, help='Skip files modified in the last N seconds.')
+def gc_uploads_command(dry_run, grace):
+    """Delete uploaded images and derivatives no pastry references any more."""
+    orphans = collect_upload_garbage(dry_run=dry_run, grace_seconds=grace)
+    for path, size in orphans:
+        print(f"{'would delete' if dry_run else 'deleted'} {path} ({size:,} bytes)")
+    total = sum(size for _, size in orphans)
+    print(f"{len(orphans)} orphaned files, {total:,} bytes{' (dry run)' if dry_run else ' reclaimed'}.")
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recompute the materialized category_stats table."""
+    rebuild_category_stats()
+    print("Category stats rebuilt.")
 
 # --- Frontend Routes ---
 @app.route('/')
+@cached_page(stamp=listing_version)
+@read_only_view
 def home():
-    featured_pastries = Pastry.query.filter_by(available=True).limit(6).all()
-    categories = db.session.query(Pastry.category).distinct().all()
-    categories = [c[0] for c in categories]
+    featured_pastries = get_featured_pastries()
+    categories = category_cache.get()
     return render_template('home.html', featured_pastries=featured_pastries, categories=categories)
 
 @app.route('/pastries')
 @app.route('/pastries/<category>')
+@cached_page(args=('after', 'before', 'per_page', 'allergen', 'exclude_allergen', 'feature', 'exclude_feature'),
+             stamp=listing_version)
+@read_only_view
 def pastries(category=None):
-    if category:
-        pastries_list = Pastry.query.filter_by(category=category).all()
+    filters = get_attribute_filters()
+    per_page = get_page_size('PASTRIES_PER_PAGE')
+    matching_ids = attribute_index.match(**filters)
+    if matching_ids is None:
+        query = Pastry.query
+        if category:
+            query = query.filter_by(category=category)
+        pastries_list, next_cursor, prev_cursor = paginate_pastries(
+            query, per_page, after=request.args.get('after'), before=request.args.get('before'))
     else:
-        pastries_list = Pastry.query.all()
+        page_ids, next_cursor, prev_cursor = attribute_index.page(
+            matching_ids, category, per_page,
+            after=request.args.get('after'), before=request.args.get('before'))
+        pastries_list = get_pastries_by_ids(page_ids)
     
-    all_categories = db.session.query(Pastry.category).distinct().all()
-    all_categories = [c[0] for c in all_categories]
+    all_categories = category_cache.get()
 
+    filter_args = {'allergen': filters['allergens'], 'exclude_allergen': filters['exclude_allergens'],
+                   'feature': filters['features'], 'exclude_feature': filters['exclude_features']}
     return render_template('pastries.html', pastries=pastries_list, category=category, 
-                         all_categories=all_categories)
+                         all_categories=all_categories,
+                         next_cursor=next_cursor, prev_cursor=prev_cursor,
+                         filters=filters, filter_args=filter_args,
+                         all_allergens=attribute_index.labels('allergens'),
+                         all_features=attribute_index.labels('features'))
 
 @app.route('/pastry/<int:pastry_id>')
+@cached_page(stamp=detail_version)
+@read_only_view
 def pastry_detail(pastry_id):
-    pastry = Pastry.query.get_or_404(pastry_id)
-    
-    related_pastries = Pastry.query.filter(
-        Pastry.category == pastry.category,
-        Pastry.id != pastry_id
-    ).limit(3).all()
-    
+    pastry, related_pastries = get_pastry_with_related(pastry_id)
     return render_template('pastry_detail.html', pastry=pastry, related_pastries=related_pastries)
 
+@app.route('/search')
+@cached_page(args=('q', 'format'), stamp=listing_version)
+@read_only_view
+def search():
+    q = request.args.get('q', '').strip()[:100]
+    if request.args.get('format') == 'json':
+        return {'query': q, 'results': autocomplete_pastries(q, app.config['AUTOCOMPLETE_LIMIT'])}
+
+    results = []
+    if q:
+        ids = search_pastry_ids(q, app.config['SEARCH_RESULTS_LIMIT'])
+        results = get_pastries_by_ids(ids)
+    return render_template('search.html', q=q, results=results)
+
+@app.route('/uploads/<path:filename>')
+def uploaded_file(filename):
+    # Dot-files are store_upload's temporaries, still being written and not yet sniffed
+    if any(part.startswith('.') for part in filename.split('/')):
+        abort(404)
+    return send_immutable(app.config['UPLOAD_FOLDER'], filename)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    token = app.config['METRICS_TOKEN']
+    authorized = token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not authorized and not current_user.is_authenticated:
+        # Route, SQL and job data isn't public: without a token the endpoint doesn't exist for visitors
+        abort(401 if token else 404)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/about')
+@cached_page
+@read_only_view
 def about():
     return render_template('about.html')
 
@@ -433,6 +3816,7 @@ def about():
 def contact():
     message_sent = False
     if request.method == 'POST':
+        rate_limit('contact_ip', request.remote_addr)
         name = request.form.get('name')
         email = request.form.get('email')
         subject = request.form.get('subject')
@@ -465,6 +3849,96 @@ def contact():
 
     return render_template('contact.html', message_sent=message_sent, whatsapp_number=WHATSAPP_NUMBER)
 
+# --- Cart Routes ---
+@app.route('/cart')
+def cart():
+    lines = cart_lines(get_cart())
+    total = sum(pastry.price * quantity for pastry, quantity in lines)
+    return render_template('cart.html', lines=lines, total=total)
+
+@app.route('/cart/add/<int:pastry_id>', methods=['POST'])
+def cart_add(pastry_id):
+    pastry = Pastry.query.get_or_404(pastry_id)
+    cart = get_cart()
+    if not pastry.in_stock:
+        flash(f'"{pastry.name}" is sold out.', 'error')
+    elif pastry_id not in cart and len(cart) >= app.config['CART_MAX_LINES']:
+        flash('Your cart is full.', 'error')
+    else:
+        cart[pastry_id] = clamp_quantity(cart.get(pastry_id, 0) + clamp_quantity(request.form.get('quantity', 1)))
+        save_cart(cart)
+        flash(f'Added "{pastry.name}" to your cart.', 'success')
+    return redirect(url_for('pastry_detail', pastry_id=pastry_id))
+
+@app.route('/cart/update', methods=['POST'])
+def cart_update():
+    cart = get_cart()
+    for pastry_id in list(cart):
+        if f'quantity_{pastry_id}' in request.form:
+            cart[pastry_id] = clamp_quantity(request.form[f'quantity_{pastry_id}'])
+    save_cart(cart)
+    return redirect(url_for('cart'))
+
+@app.route('/cart/remove/<int:pastry_id>', methods=['POST'])
+def cart_remove(pastry_id):
+    cart = get_cart()
+    cart.pop(pastry_id, None)
+    save_cart(cart)
+    return redirect(url_for('cart'))
+
+@app.route('/checkout', methods=['POST'])
+def checkout():
+    customer_name = request.form.get('name', '').strip()[:100]
+    phone = request.form.get('phone', '').strip()[:30]
+    if not customer_name or not phone:
+        flash('Please enter your name and phone number.', 'error')
+        return redirect(url_for('cart'))
+    try:
+        order = place_order(get_cart(), customer_name, phone,
+                            email=request.form.get('email', '').strip()[:120],
+                            note=request.form.get('note', '').strip()[:1000])
+    except (OutOfStock, ValueError) as e:
+        flash(str(e), 'error')
+        return redirect(url_for('cart'))
+    save_cart({})
+    return redirect(url_for('order_confirmation', reference=order.reference))
+
+@app.route('/order/<reference>')
+def order_confirmation(reference):
+    order = Order.query.filter_by(reference=reference).first_or_404()
+    return render_template('order_confirmation.html', order=order,
+                           whatsapp_link=generate_order_whatsapp_link(order))
+
+# --- API Routes ---
+@app.route('/api/pastries')
+@compressed
+@cached_page(args=API_LIST_ARGS, stamp=listing_version)
+@read_only_view
+def api_pastries():
+    fields = parse_api_fields()
+    available = request.args.get('available')
+    body, next_cursor = api_pastry_page(
+        fields, get_page_size('API_PAGE_SIZE'), category=request.args.get('category'),
+        available=None if available is None else available.lower() in ('1', 'true', 'yes', 'on'),
+        after=request.args.get('after'))
+    next_url = None
+    if next_cursor:
+        query = {name: value for name, value in request.args.items() if name in API_LIST_ARGS}
+        next_url = url_for('api_pastries', **{**query, 'after': next_cursor})
+    return Response(f'{{"data":{body},"next_cursor":{_encode_json(next_cursor)},"next":{_encode_json(next_url)}}}',
+                    mimetype='application/json')
+
+@app.route('/api/pastries/<int:pastry_id>')
+@compressed
+@cached_page(args=('fields',), stamp=pastry_version)
+@read_only_view
+def api_pastry(pastry_id):
+    fields = parse_api_fields()
+    row = db.session.execute(db.select(*api_columns(fields)).where(Pastry.id == pastry_id)).first()
+    if row is None:
+        api_error(404, 'pastry not found')
+    return Response(pastry_serializer(fields)(row), mimetype='application/json')
+
 # --- Admin Routes ---
 @app.route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
@@ -474,9 +3948,13 @@ def admin_login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
+        # Counted before the (deliberately slow) password hash, so parallel guesses can't all slip under the limit
+        rate_limit('login_ip', request.remote_addr)
+        rate_limit('login_user', username)
         user = User.query.filter_by(username=username).first()
         
         if user and user.check_password(password):
+            reset_rate_limit('login_user', username)
             login_user(user)
             flash('Logged in successfully!', 'success')
             return redirect(url_for('admin_dashboard'))
@@ -494,48 +3972,132 @@ def admin_logout():
 @app.route('/admin')
 @login_required
 def admin_dashboard():
-    total_pastries = Pastry.query.count()
-    categories = db.session.query(Pastry.category).distinct().all()
-    total_categories = len(categories)
-    
-    pastries = Pastry.query.all()
-    total_value = sum(pastry.price for pastry in pastries)
-    
-    available = Pastry.query.filter_by(available=True).count()
-    
-    category_counts = {}
-    for category in categories:
-        count = Pastry.query.filter_by(category=category[0]).count()
-        category_counts[category[0]] = count
-    
-    return render_template('admin_dashboard.html',
-        total_pastries=total_pastries,
-        total_categories=total_categories,
-        total_value=total_value,
-        available=available,
-        category_counts=category_counts
-    )
+    stats = get_catalog_stats()
+    return render_template('admin_dashboard.html', **stats)
+
+@app.route('/admin/cache-stats')
+@login_required
+def admin_cache_stats():
+    return {'categories': category_cache.stats(), 'pages': page_cache.stats(), 'cards': card_fragments.stats()}
+
+@app.route('/admin/jobs')
+@login_required
+def admin_jobs():
+    counts = db.session.query(Job.kind, Job.status, func.count(Job.id)).group_by(Job.kind, Job.status).all()
+    dead = Job.query.filter_by(status='dead').order_by(Job.id.desc()).limit(20).all()
+    return {
+        'counts': [{'kind': kind, 'status': status, 'count': count} for kind, status, count in counts],
+        'dead': [{'id': job.id, 'kind': job.kind, 'attempts': job.attempts, 'error': job.last_error}
+                 for job in dead],
+    }
+
+@app.route('/admin/orders')
+@login_required
+def admin_orders():
+    orders = Order.query.options(db.selectinload(Order.items)).order_by(Order.created_at.desc()).limit(200).all()
+    return render_template('admin_orders.html', orders=orders)
+
+@app.route('/admin/catalog', methods=['GET', 'POST'])
+@login_required
+def admin_catalog():
+    report = None
+    request.max_content_length = app.config['IMPORT_MAX_CONTENT_LENGTH']
+    if request.method == 'POST':
+        upload = request.files.get('catalog_file')
+        if not upload or not upload.filename:
+            flash('Choose a CSV or JSON Lines file to import.', 'error')
+            return redirect(url_for('admin_catalog'))
+        fmt = catalog_format(upload.filename, request.form.get('format', 'csv'))
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        report = import_catalog(stream, fmt, dry_run=request.form.get('dry_run') == 'on')
+        flash(f'Import finished: {report.summary()}', 'error' if report.error_count else 'success')
+    return render_template('admin_catalog.html', report=report)
+
+@app.route('/admin/catalog/export.<fmt>')
+@login_required
+def admin_catalog_export(fmt):
+    if fmt not in CATALOG_FORMATS:
+        abort(404)
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(export_catalog(fmt)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=catalog.{fmt}'})
+
+@app.route('/admin/uploads', methods=['POST'])
+@login_required
+def admin_upload_create():
+    """Start a resumable upload: {"size": <bytes>} -> {"upload_id", "offset", "chunk_size"}"""
+    data = request.get_json(silent=True) or request.form
+    try:
+        upload_id = create_upload_session(int(data.get('size', 0)))
+    except (TypeError, ValueError) as e:
+        return {'error': str(e) if isinstance(e, UploadRejected) else 'size is required'}, 400
+    return {'upload_id': upload_id, 'offset': 0, 'chunk_size': app.config['UPLOAD_CHUNK_BYTES'],
+            'url': url_for('admin_upload_chunk', upload_id=upload_id)}, 201
+
+@app.route('/admin/uploads/<upload_id>', methods=['GET', 'PATCH', 'DELETE'])
+@login_required
+def admin_upload_chunk(upload_id):
+    """GET: the offset to resume from. PATCH: append the body at the Upload-Offset
+    header's position; the chunk that completes the file returns its filename."""
+    info = get_upload_session(upload_id)
+    if info is None:
+        return {'error': 'unknown or finished upload'}, 404
+    if request.method == 'DELETE':
+        discard_upload_session(upload_id)
+        return '', 204
+    if request.method == 'GET':
+        return {'offset': info['offset'], 'size': info['size']}
+
+    if request.headers.get('Upload-Offset', type=int) != info['offset']:
+        # A retried or out-of-order chunk: tell the client where to resume
+        return {'error': 'offset mismatch', 'offset': info['offset'], 'size': info['size']}, 409
+    try:
+        offset = append_upload_chunk(upload_id, info, request.stream, info['offset'])
+        if offset < info['size']:
+            return {'offset': offset, 'size': info['size']}
+        filename, is_new = finish_upload_session(upload_id)
+    except UploadOffsetMismatch as e:
+        return {'error': 'offset mismatch', 'offset': e.offset, 'size': info['size']}, 409
+    except FileNotFoundError:
+        return {'error': 'unknown or finished upload'}, 404
+    except UploadRejected as e:
+        return {'error': str(e)}, 422
+    if is_new:
+        schedule_derivatives(filename)
+        db.session.commit()
+    return {'offset': offset, 'size': info['size'], 'filename': filename}
+
+@app.errorhandler(413)
+def request_too_large(e):
+    limit = f'{request.max_content_length / (1024 * 1024):g} MB'
+    if request.path.startswith('/admin/uploads'):
+        return {'error': f'request body larger than {limit}'}, 413
+    flash(f'Upload too large: requests are limited to {limit}.', 'error')
+    return redirect(request.url)
 
 @app.route('/admin/pastries')
 @app.route('/admin/pastries/<category>')
 @login_required
 def admin_pastries(category=None):
-    all_categories = db.session.query(Pastry.category).distinct().all()
-    all_categories = [c[0] for c in all_categories]
+    all_categories = category_cache.get()
     
+    query = Pastry.query
     if category:
-        all_pastries = Pastry.query.filter_by(category=category).all()
-    else:
-        all_pastries = Pastry.query.all()
+        query = query.filter_by(category=category)
+    total_count = query.count()
+    all_pastries, next_cursor, prev_cursor = paginate_pastries(
+        query, get_page_size('ADMIN_PASTRIES_PER_PAGE'),
+        after=request.args.get('after'), before=request.args.get('before'))
     
     return render_template('admin_pastries.html', pastries=all_pastries, 
-                         categories=all_categories, selected_category=category)
+                         categories=all_categories, selected_category=category,
+                         total_count=total_count,
+                         next_cursor=next_cursor, prev_cursor=prev_cursor)
 
 @app.route('/admin/pastries/add', methods=['GET', 'POST'])
 @login_required
 def admin_add_pastry():
-    all_categories = db.session.query(Pastry.category).distinct().all()
-    all_categories = [c[0] for c in all_categories]
+    all_categories = category_cache.get()
 
     if request.method == 'POST':
         try:
@@ -544,6 +4106,7 @@ def admin_add_pastry():
             description = request.form['description']
             serving_size = request.form.get('serving_size', '')
             available = request.form.get('available') == 'on'
+            stock = parse_stock(request.form.get('stock'))
             
             category = request.form['category']
             if category == 'new_category':
@@ -553,19 +4116,16 @@ def admin_add_pastry():
                     return redirect(url_for('admin_add_pastry'))
                 category = new_category_input
             
-            main_image_file = request.files.get('image_file')
-            main_image_filename = save_uploaded_file(main_image_file)
+            # Every file lands (temp file + rename) before the pastry row is committed.
+            # Images sent earlier through /admin/uploads arrive as filenames.
+            main_image_filename = (save_uploaded_file(request.files.get('image_file'))
+                                   or finished_upload(request.form.get('image_upload')))
             if not main_image_filename:
                 flash('No valid image file uploaded.', 'error')
                 return redirect(url_for('admin_add_pastry'))
 
-            gallery_files = request.files.getlist('gallery_files')
-            gallery_filenames = []
-            for file in gallery_files:
-                if file.filename:
-                    filename = save_uploaded_file(file)
-                    if filename:
-                        gallery_filenames.append(filename)
+            gallery_filenames = save_uploaded_files(request.files.getlist('gallery_files'))
+            gallery_filenames += [name for name in request.form.getlist('gallery_uploads') if finished_upload(name)]
             
             new_pastry = Pastry(
                 name=name,
@@ -575,6 +4135,7 @@ def admin_add_pastry():
                 description=description,
                 serving_size=serving_size,
                 available=available,
+                stock=stock,
                 gallery=gallery_filenames,
                 ingredients=json.loads(request.form.get('ingredients', '[]')),
                 allergens=json.loads(request.form.get('allergens', '[]')),
@@ -582,8 +4143,16 @@ def admin_add_pastry():
             )
             db.session.add(new_pastry)
             db.session.commit()
+            attribute_index.update(new_pastry)
+            bump_catalog_version()
+            enqueue_job('refresh_similarity', {'pastry_id': new_pastry.id})
             flash(f'Pastry "{name}" added successfully!', 'success')
             return redirect(url_for('admin_pastries'))
+        except UploadRejected as e:
+            db.session.rollback()
+            flash(f'Image rejected: {e}.', 'error')
+        except HTTPException:
+            raise  # e.g. 413 for an oversized body
         except Exception as e:
             flash(f'An error occurred: {e}', 'error')
 
@@ -593,8 +4162,7 @@ def admin_add_pastry():
 @login_required
 def admin_edit_pastry(pastry_id):
     pastry = Pastry.query.get_or_404(pastry_id)
-    all_categories = db.session.query(Pastry.category).distinct().all()
-    all_categories = [c[0] for c in all_categories]
+    all_categories = category_cache.get()
 
     if request.method == 'POST':
         try:
@@ -603,6 +4171,8 @@ def admin_edit_pastry(pastry_id):
             pastry.description = request.form['description']
             pastry.serving_size = request.form.get('serving_size', '')
             pastry.available = request.form.get('available') == 'on'
+            if 'stock' in request.form:
+                pastry.stock = parse_stock(request.form['stock'])
             
             category = request.form['category']
             if category == 'new_category':
@@ -614,20 +4184,13 @@ def admin_edit_pastry(pastry_id):
             else:
                 pastry.category = category
             
-            main_image_file = request.files.get('image_file')
-            if main_image_file and main_image_file.filename != '':
-                new_main_image = save_uploaded_file(main_image_file)
-                if new_main_image:
-                    pastry.image = new_main_image
-            
-            gallery_files = request.files.getlist('gallery_files')
-            new_gallery = []
-            for file in gallery_files:
-                if file.filename:
-                    filename = save_uploaded_file(file)
-                    if filename:
-                        new_gallery.append(filename)
-            
+            new_main_image = (save_uploaded_file(request.files.get('image_file'))
+                              or finished_upload(request.form.get('image_upload')))
+            if new_main_image:
+                pastry.image = new_main_image
+
+            new_gallery = save_uploaded_files(request.files.getlist('gallery_files'))
+            new_gallery += [name for name in request.form.getlist('gallery_uploads') if finished_upload(name)]
             if new_gallery:
                 pastry.gallery = new_gallery
             
@@ -636,8 +4199,18 @@ def admin_edit_pastry(pastry_id):
             pastry.features = json.loads(request.form.get('features', '[]'))
 
             db.session.commit()
+            attribute_index.update(pastry)
+            pastry_links.invalidate(pastry.id)
+            card_fragments.invalidate(pastry.id)
+            bump_catalog_version()
+            enqueue_job('refresh_similarity', {'pastry_id': pastry.id})
             flash(f'Pastry "{pastry.name}" updated successfully!', 'success')
             return redirect(url_for('admin_pastries'))
+        except UploadRejected as e:
+            db.session.rollback()
+            flash(f'Image rejected: {e}.', 'error')
+        except HTTPException:
+            raise  # e.g. 413 for an oversized body
         except Exception as e:
             db.session.rollback()
             flash(f'An error occurred: {e}', 'error')
@@ -657,6 +4230,11 @@ def admin_delete_pastry(pastry_id):
     try:
         db.session.delete(pastry)
         db.session.commit()
+        attribute_index.remove(pastry_id)
+        pastry_links.invalidate(pastry_id)
+        card_fragments.invalidate(pastry_id)
+        bump_catalog_version()
+        enqueue_job('refresh_similarity', {'pastry_id': pastry_id})
         flash(f'Pastry "{pastry_name}" deleted successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -0,0 +1,277 @@
+"""ASGI entry point: `uvicorn asgi:app` (or any ASGI server).
+
+Anonymous GETs of cached pages are answered on the event loop straight from
+the page cache, without a thread or a Flask request, so thousands of idle
+or slow keep-alive connections cost a socket each rather than a worker
+thread. When such a page misses, one request renders it and the others for
+the same page wait for that render instead of rendering it again.
+
+Everything else, the admin included, runs the unchanged Flask app on a pool
+of ASGI_THREADS threads. Responses up to ASGI_BUFFER_BYTES are collected in
+the thread and written from the loop, so a slow client doesn't hold a thread
+while it reads them.
+"""
+import asyncio
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from itsdangerous import BadSignature
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import http_date, is_resource_modified, quote_etag
+
+import app as store
+
+flask_app = store.create_app()
+store.metrics.counter('pastry_asgi_requests_total',
+                      'ASGI requests by how they were served: cache (event loop), coalesced or thread.')
+
+executor = ThreadPoolExecutor(flask_app.config['ASGI_THREADS'], thread_name_prefix='asgi')
+_inflight = {}  # page cache key -> future resolved once the render that fills it finishes
+
+
+# --- WSGI Bridge ---
+class RequestBody(io.RawIOBase):
+    """wsgi.input for a worker thread, reading http.request messages from the event loop"""
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._chunk = memoryview(b'')
+        self._more = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._chunk and self._more:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message['type'] == 'http.disconnect':
+                raise OSError('client disconnected')
+            self._chunk = memoryview(message.get('body', b''))
+            self._more = message.get('more_body', False)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+def build_environ(scope):
+    script_name = scope.get('root_path', '').encode('utf-8').decode('latin-1')
+    path_info = scope['path'].encode('utf-8').decode('latin-1')
+    if script_name and path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': None,  # set when the request goes to a thread
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin-1')
+        if name in environ:
+            value = environ[name] + ('; ' if name == 'HTTP_COOKIE' else ',') + value
+        environ[name] = value
+    return environ
+
+
+def run_wsgi(environ, send, loop):
+    """Run the Flask app in this (pool) thread.
+
+    Returns (status, headers, body) when the response fit in ASGI_BUFFER_BYTES,
+    or None once a larger response has been streamed to the client from here.
+    """
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [int(status.split(' ', 1)[0]),
+                      [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]]
+
+    def send_sync(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    limit = flask_app.config['ASGI_BUFFER_BYTES']
+    iterable = flask_app(environ, start_response)
+    try:
+        chunks, size, streaming = [], 0, False
+        for chunk in iterable:
+            if not chunk:
+                continue
+            if streaming:
+                send_sync({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                continue
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > limit:
+                streaming = True
+                send_sync({'type': 'http.response.start', 'status': started[0], 'headers': started[1]})
+                send_sync({'type': 'http.response.body', 'body': b''.join(chunks), 'more_body': True})
+                chunks = None
+        if streaming:
+            send_sync({'type': 'http.response.body', 'body': b''})
+            return None
+        return started[0], started[1], b''.join(chunks)
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
+
+
+async def respond_from_thread(environ, receive, send, key=None):
+    """Serve the request with Flask on the pool, as the render other requests for `key` wait on"""
+    loop = asyncio.get_running_loop()
+    environ['wsgi.input'] = io.BufferedReader(RequestBody(receive, loop), 64 * 1024)
+    store.metrics.inc('pastry_asgi_requests_total', {'path': 'thread'})
+    leader = None
+    if key is not None and key not in _inflight:
+        leader = _inflight[key] = loop.create_future()
+    try:
+        result = await loop.run_in_executor(executor, run_wsgi, environ, send, loop)
+    finally:
+        if leader is not None:
+            # cached_page has stored the page by now, so waiters can be answered before we send ours
+            del _inflight[key]
+            leader.set_result(None)
+    if result is not None:
+        status, headers, body = result
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+
+# --- Event Loop Fast Path ---
+def is_anonymous(request):
+    """The checks cached_page makes, from the cookies alone: no login, no pending flashes"""
+    if flask_app.config.get('REMEMBER_COOKIE_NAME', 'remember_token') in request.cookies:
+        return False
+    cookie = request.cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if not cookie:
+        return True
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        data = serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return True  # Flask starts an empty session for it too
+    return '_user_id' not in data and '_flashes' not in data
+
+
+def cache_key(environ):
+    """(endpoint, page cache key) if cached_page would serve this request from the cache, else None"""
+    if environ['REQUEST_METHOD'] != 'GET':
+        return None
+    request = flask_app.request_class(environ)
+    try:
+        endpoint, view_args = flask_app.create_url_adapter(request).match()
+    except HTTPException:  # 404, 405 and redirects are Flask's to answer
+        return None
+    view = flask_app.view_functions[endpoint]
+    if not hasattr(view, 'page_cache_args') or not is_anonymous(request):
+        return None
+    query_args = store.page_query_args(view, request.args)
+    if query_args is None:
+        return None
+    return endpoint, store.page_cache_key(store.page_version(view, view_args), endpoint, view_args, query_args)
+
+
+async def lookup_page(key):
+    if isinstance(store.page_cache, store.MemoryPageCache):
+        page = store.page_cache.get(key)
+    else:
+        page = await asyncio.get_running_loop().run_in_executor(executor, store.page_cache.get, key)
+    # Compressed API responses vary by Accept-Encoding; those go through Flask
+    if page is None or not page.content_type.startswith('text/html'):
+        return None
+    return page
+
+
+async def send_page(environ, send, page):
+    """Same headers serve_cached_page sets; returns (status, body size)"""
+    etag = quote_etag(page.etag)
+    last_modified = http_date(page.last_modified)
+    cache_headers = [(b'cache-control', b'public, no-cache'), (b'vary', b'Cookie')]
+    if not is_resource_modified(environ, etag, None, last_modified):
+        await send({'type': 'http.response.start', 'status': 304,
+                    'headers': [(b'etag', etag.encode('latin-1')), *cache_headers]})
+        await send({'type': 'http.response.body', 'body': b''})
+        return 304, None
+    headers = [(b'content-type', page.content_type.encode('latin-1')),
+               (b'content-length', str(len(page.body)).encode('latin-1')),
+               (b'etag', etag.encode('latin-1')), (b'last-modified', last_modified.encode('latin-1')),
+               *cache_headers]
+    await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': page.body})
+    return 200, len(page.body)
+
+
+def record_metrics(endpoint, status, size, started, path):
+    labels = {'endpoint': endpoint, 'method': 'GET'}
+    store.metrics.inc('pastry_http_requests_total', {**labels, 'status': status})
+    store.metrics.observe('pastry_http_request_duration_seconds', labels, time.perf_counter() - started)
+    if size is not None:
+        store.metrics.observe('pastry_http_response_size_bytes', {'endpoint': endpoint}, size)
+    store.metrics.observe('pastry_sql_statements_per_request', {'endpoint': endpoint}, 0)
+    store.metrics.inc('pastry_asgi_requests_total', {'path': path})
+
+
+async def serve_http(scope, receive, send):
+    started = time.perf_counter()
+    environ = build_environ(scope)
+    matched = None if isinstance(store.page_cache, store.NullPageCache) else cache_key(environ)
+    if matched is None:
+        await respond_from_thread(environ, receive, send)
+        return
+
+    endpoint, key = matched
+    page = await lookup_page(key)
+    path = 'cache'
+    if page is None and key in _inflight:
+        await asyncio.shield(_inflight[key])
+        page = await lookup_page(key)
+        path = 'coalesced'
+    if page is None:  # a miss, or a render that wasn't cacheable (an error page, say)
+        await respond_from_thread(environ, receive, send, key)
+        return
+    status, size = await send_page(environ, send, page)
+    record_metrics(endpoint, status, size, started, path)
+
+
+# --- Lifespan ---
+async def lifespan(receive, send):
+    loop = asyncio.get_running_loop()
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Cached hits never reach ensure_job_workers, so start them with the server
+            store.start_job_workers()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await loop.run_in_executor(None, store.job_workers.stop)
+            executor.shutdown(wait=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'http':
+        await serve_http(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    else:
+        raise RuntimeError(f"Unsupported ASGI scope type: {scope['type']}")
@@ -0,0 +1,275 @@
+"""Many concurrent keep-alive connections: WSGI server vs `uvicorn asgi:app`.
+
+Usage: python benchmarks/bench_asgi.py [--connections 200] [--seconds 10] [--slow 50] [--bump-every 0] [--mode both]
+       python benchmarks/bench_asgi.py --target http://127.0.0.1:8000 [...]
+
+Seeds a synthetic catalog and serves it from a fresh process per mode:
+"wsgi" is werkzeug's threaded server (a thread per connection, as app.run
+serves), "asgi" is uvicorn running asgi:app. uvicorn is not a dependency of
+the store; the asgi mode is skipped if it isn't installed. --target load-tests
+a server that is already running instead.
+
+--connections clients each hold one keep-alive connection and request pages
+back to back, like the traffic after a WhatsApp broadcast: --hot-share of the
+requests go to the home page, the listing and a few featured pastries, the
+rest to random pastries. --slow of those connections have a small receive
+buffer and read each response a few KB at a time, like phones on a poor
+network. --bump-every SECONDS bumps the catalog version (this checkout's
+instance/catalog.version) so every cached page misses at once.
+
+Prints requests/s, latency p50/p99 and errors per mode, and for asgi how
+many requests were answered from the event loop, coalesced or threaded.
+"""
+import argparse
+import asyncio
+import importlib.util
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+
+from common import ROOT, seed_catalog, use_scratch_database
+
+WSGI_SERVER = '''
+import logging, sys
+import app as store
+from werkzeug.serving import make_server
+logging.getLogger('werkzeug').setLevel(logging.WARNING)  # no access log, like uvicorn --no-access-log
+make_server('127.0.0.1', int(sys.argv[1]), store.create_app(), threaded=True).serve_forever()
+'''
+
+HOT_PATHS = ['/', '/pastries', '/pastry/1', '/pastry/2', '/pastry/3', '/pastry/4', '/pastry/5']
+SLOW_RCVBUF = 4096
+SLOW_READ = 2048
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_serving(base_url, server, timeout=60):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            with urlopen(base_url + '/', timeout=30) as response:
+                response.read()
+            return
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError(f'server exited with status {server.returncode}')
+            if time.perf_counter() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+
+
+async def open_connection(host, port, slow):
+    if not slow:
+        return await asyncio.open_connection(host, port)
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SLOW_RCVBUF)
+    sock.setblocking(False)
+    try:
+        await asyncio.get_running_loop().sock_connect(sock, (host, port))
+    except OSError:
+        sock.close()
+        raise
+    return await asyncio.open_connection(sock=sock)
+
+
+async def read_exactly(reader, size, slow, delay):
+    if not slow:
+        await reader.readexactly(size)
+        return
+    while size:
+        size -= len(await reader.readexactly(min(size, SLOW_READ)))
+        await asyncio.sleep(delay)
+
+
+async def fetch(reader, writer, host, path, slow, delay):
+    """GET one page; (status, keep-alive)"""
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept-Encoding: identity\r\n\r\n'.encode('latin-1'))
+    await writer.drain()
+    head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+    status = int(head[0].split()[1])
+    headers = {}
+    for line in head[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if 'content-length' in headers:
+        await read_exactly(reader, int(headers['content-length']), slow, delay)
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            await read_exactly(reader, size + 2, slow, delay)
+            if not size:
+                break
+    else:
+        await reader.read()
+        return status, False
+    keep_alive = headers.get('connection', '').lower() != 'close' and head[0].startswith('HTTP/1.1')
+    return status, keep_alive
+
+
+async def client(host, port, pick_path, deadline, slow, delay, stats):
+    while time.perf_counter() < deadline:
+        try:
+            reader, writer = await open_connection(host, port, slow)
+        except OSError:
+            stats.errors += 1
+            await asyncio.sleep(0.05)
+            continue
+        try:
+            keep_alive = True
+            while keep_alive and time.perf_counter() < deadline:
+                start = time.perf_counter()
+                status, keep_alive = await asyncio.wait_for(fetch(reader, writer, host, pick_path(), slow, delay), 30)
+                stats.latencies.append((time.perf_counter() - start) * 1000)
+                if status != 200:
+                    stats.errors += 1
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ValueError):
+            stats.errors += 1
+        finally:
+            writer.close()
+
+
+async def bump_catalog(every, deadline):
+    from app import app, bump_catalog_version
+
+    def bump():
+        with app.app_context():
+            bump_catalog_version()
+
+    loop = asyncio.get_running_loop()
+    while time.perf_counter() + every < deadline:
+        await asyncio.sleep(every)
+        await loop.run_in_executor(None, bump)
+
+
+async def load(base_url, args, seconds):
+    url = urlsplit(base_url)
+    host, port = url.hostname, url.port or 80
+    rng = random.Random(42)
+
+    def pick_path():
+        if rng.random() < args.hot_share:
+            return rng.choice(HOT_PATHS)
+        return f'/pastry/{rng.randint(1, args.rows)}'
+
+    stats = Stats()
+    deadline = time.perf_counter() + seconds
+    tasks = [client(host, port, pick_path, deadline, i < args.slow, args.slow_delay_ms / 1000, stats)
+             for i in range(args.connections)]
+    if args.bump_every:
+        tasks.append(bump_catalog(args.bump_every, deadline))
+    await asyncio.gather(*tasks)
+    return stats
+
+
+def asgi_paths(base_url, token):
+    """pastry_asgi_requests_total by path, from /metrics"""
+    request = Request(base_url + '/metrics', headers={'Authorization': f'Bearer {token}'} if token else {})
+    try:
+        with urlopen(request, timeout=10) as response:
+            text = response.read().decode('utf-8')
+    except OSError:
+        return {}
+    counts = {}
+    for line in text.splitlines():
+        if line.startswith('pastry_asgi_requests_total{'):
+            labels, value = line.rsplit(' ', 1)
+            counts[labels.split('"')[1]] = int(float(value))
+    return counts
+
+
+def run(mode, base_url, args):
+    if args.warmup:
+        asyncio.run(load(base_url, args, args.warmup))
+    before = asgi_paths(base_url, args.metrics_token)
+    started = time.perf_counter()
+    stats = asyncio.run(load(base_url, args, args.seconds))
+    wall = time.perf_counter() - started
+    latencies = sorted(stats.latencies) or [0.0]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f'{mode:<8}{len(stats.latencies) / wall:>10,.0f}{statistics.median(latencies):>10.1f}{p99:>10.1f}'
+          f'{stats.errors:>8}')
+    after = asgi_paths(base_url, args.metrics_token)
+    if after:
+        served = {path: count - before.get(path, 0) for path, count in after.items()}
+        print(f'{"":<8}served: ' + ', '.join(f'{path} {count:,}' for path, count in sorted(served.items())))
+
+
+def start_server(mode, port, env):
+    if mode == 'wsgi':
+        command = [sys.executable, '-c', WSGI_SERVER, str(port)]
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(port),
+                   '--log-level', 'warning', '--no-access-log']
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--connections', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=2, help='seconds of load before measuring')
+    parser.add_argument('--slow', type=int, default=50, help='connections that read slowly')
+    parser.add_argument('--slow-delay-ms', type=float, default=20, help='pause between slow reads')
+    parser.add_argument('--hot-share', type=float, default=0.8)
+    parser.add_argument('--bump-every', type=float, default=0, help='seconds between catalog version bumps')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--mode', choices=['wsgi', 'asgi', 'both'], default='both')
+    parser.add_argument('--target', help='load-test this running server instead')
+    parser.add_argument('--metrics-token', default=os.environ.get('METRICS_TOKEN'),
+                        help="the --target server's METRICS_TOKEN, to report how asgi served requests")
+    args = parser.parse_args()
+
+    print(f'{args.connections} connections ({args.slow} slow), {args.seconds:.0f}s, '
+          f'{args.hot_share:.0%} hot links' + (f', catalog bump every {args.bump_every:g}s' if args.bump_every else ''))
+    header = f'\n{"mode":<8}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"errors":>8}'
+    if args.target:
+        print(header)
+        run('target', args.target.rstrip('/'), args)
+        return
+
+    use_scratch_database()
+    os.environ['JOB_WORKERS'] = '0'
+    from app import app, db, Pastry, ensure_indexes
+    with app.app_context():
+        db.create_all()
+        ensure_indexes()
+        seed_catalog(db, Pastry, args.rows)
+    args.metrics_token = args.metrics_token or 'bench'
+    env = dict(os.environ, METRICS_TOKEN=args.metrics_token)
+
+    modes = ['wsgi', 'asgi'] if args.mode == 'both' else [args.mode]
+    if 'asgi' in modes and importlib.util.find_spec('uvicorn') is None:
+        print('uvicorn is not installed (pip install uvicorn): skipping asgi')
+        modes.remove('asgi')
+    print(header)
+    for mode in modes:
+        port = free_port()
+        server = start_server(mode, port, env)
+        try:
+            base_url = f'http://127.0.0.1:{port}'
+            wait_until_serving(base_url, server)
+            run(mode, base_url, args)
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Compare allergen/feature filtering via the inverted index against a naive scan.
+
+Usage: python benchmarks/bench_attribute_filter.py [--rows 50000]
+
+The naive path is what filtering would cost without the index: load every
+row's allergens_json/features_json, decode it and test it in Python.
+"""
+import argparse
+import json
+import statistics
+import time
+
+from common import seed_catalog, use_scratch_database
+
+QUERIES = [
+    {'exclude_allergens': ['Gluten']},
+    {'exclude_allergens': ['Gluten', 'Dairy']},
+    {'features': ['Vegan']},
+    {'allergens': ['Nuts'], 'exclude_features': ['Sugar-free']},
+]
+
+
+def naive_match(db, Pastry, allergens=(), exclude_allergens=(), features=(), exclude_features=()):
+    ids = set()
+    rows = db.session.query(Pastry.id, Pastry.allergens_json, Pastry.features_json)
+    for pastry_id, allergens_json, features_json in rows:
+        have_allergens = {a.lower() for a in json.loads(allergens_json or '[]')}
+        have_features = {f.lower() for f in json.loads(features_json or '[]')}
+        if not all(a.lower() in have_allergens for a in allergens):
+            continue
+        if any(a.lower() in have_allergens for a in exclude_allergens):
+            continue
+        if not all(f.lower() in have_features for f in features):
+            continue
+        if any(f.lower() in have_features for f in exclude_features):
+            continue
+        ids.add(pastry_id)
+    return ids
+
+
+def timed(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=50_000)
+    parser.add_argument('--per-page', type=int, default=24)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    use_scratch_database()
+    from app import app, db, Pastry, attribute_index, ensure_indexes
+
+    with app.app_context():
+        db.create_all()
+        ensure_indexes()
+        seed_catalog(db, Pastry, args.rows)
+
+        _, build_ms = timed(attribute_index.rebuild, 1)
+        print(f'Index rebuild over {args.rows:,} pastries: {build_ms:.1f} ms')
+        print(f'{"filter":<62} {"matches":>8} {"naive ms":>9} {"index ms":>9}')
+
+        for filters in QUERIES:
+            naive_ids, naive_ms = timed(lambda: naive_match(db, Pastry, **filters), args.repeat)
+
+            def indexed():
+                ids = attribute_index.match(**filters)
+                page_ids, _, _ = attribute_index.page(ids, None, args.per_page)
+                Pastry.query.filter(Pastry.id.in_(page_ids)).all()
+                return ids
+            index_ids, index_ms = timed(indexed, args.repeat)
+
+            assert naive_ids == index_ids, filters
+            print(f'{json.dumps(filters):<62} {len(index_ids):>8,} {naive_ms:>9.2f} {index_ms:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Worker cold start: process launch to first response, after `flask seed` from a snapshot.
+
+Usage: python benchmarks/bench_boot.py [--rows 1000] [--runs 10] [--target-ms 1000]
+
+Builds a synthetic catalog, writes it out with `flask seed-snapshot` and
+times `flask seed` loading it into a fresh database, as a new deployment
+would. Then it starts --runs fresh worker processes against that database,
+each serving create_app() from werkzeug's WSGI server. The parent times
+from spawning the process to the first complete response from /, then
+the first (cold) request to each of the other pages. Workers report how
+long importing app.py and create_app() took.
+
+The first worker starts with an empty template bytecode cache and is
+reported on its own; later workers reuse what it wrote. The exit status
+is 1 if the median boot-to-first-response of the later workers is over
+--target-ms.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from urllib.error import URLError
+from urllib.request import urlopen
+
+from common import ROOT, seed_catalog, use_scratch_database
+
+WORKER = '''
+import json, sys, time
+start = time.perf_counter()
+import app as store
+imported = time.perf_counter()
+application = store.create_app()
+ready = time.perf_counter()
+from werkzeug.serving import make_server
+server = make_server('127.0.0.1', int(sys.argv[1]), application, threaded=True)
+print(json.dumps({'import_ms': (imported - start) * 1000, 'create_app_ms': (ready - imported) * 1000}), flush=True)
+server.serve_forever()
+'''
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def fetch_ms(url):
+    start = time.perf_counter()
+    with urlopen(url, timeout=30) as response:
+        response.read()
+    return (time.perf_counter() - start) * 1000
+
+
+def boot_once(env, paths):
+    """(boot-to-first-response ms, {path: first request ms}, worker phase timings)"""
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    started = time.perf_counter()
+    worker = subprocess.Popen([sys.executable, '-c', WORKER, str(port)], cwd=ROOT, env=env,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        while True:
+            try:
+                with urlopen(base_url + paths[0], timeout=30) as response:
+                    response.read()
+                break
+            except URLError as e:
+                if not isinstance(e.reason, ConnectionRefusedError):
+                    raise
+                if worker.poll() is not None:
+                    raise RuntimeError(f'worker exited with status {worker.returncode}')
+                time.sleep(0.005)
+        boot_ms = (time.perf_counter() - started) * 1000
+        first_hits = {path: fetch_ms(base_url + path) for path in paths[1:]}
+        phases = json.loads(worker.stdout.readline())
+    finally:
+        worker.terminate()
+        worker.wait()
+    return boot_ms, first_hits, phases
+
+
+def flask(env, *args):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', *args], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=10, help='worker processes to start')
+    parser.add_argument('--paths', nargs='+', default=['/', '/pastries', '/pastry/1', '/api/pastries'],
+                        help='the first is polled until it answers')
+    parser.add_argument('--target-ms', type=float, default=1000)
+    args = parser.parse_args()
+
+    tmpdir = use_scratch_database()
+    os.environ['JOB_WORKERS'] = '0'
+    from app import app, db, Pastry
+    with app.app_context():
+        db.create_all()
+        seed_catalog(db, Pastry, args.rows)
+    env = dict(os.environ, JOB_WORKERS='0', TEMPLATE_BYTECODE_DIR=os.path.join(tmpdir, 'jinja_cache'))
+    snapshot = os.path.join(tmpdir, 'snapshot')
+    flask(env, 'seed-snapshot', snapshot)
+
+    env['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmpdir, 'boot.db')
+    seconds = flask(env, 'seed', '--snapshot', snapshot)
+    print(f'flask seed: {args.rows:,} pastries from a snapshot in {seconds:.2f}s')
+
+    # Workers run as deployed, with their job threads
+    env.pop('JOB_WORKERS')
+    columns = ['boot', 'import', 'create_app'] + args.paths[1:]
+    print(f'\n{"run":<6}' + ''.join(f'{column:>14}' for column in columns) + '  (ms)')
+    boots = []
+    for run in range(args.runs):
+        boot_ms, first_hits, phases = boot_once(env, args.paths)
+        values = [boot_ms, phases['import_ms'], phases['create_app_ms']] + list(first_hits.values())
+        label = 'cold' if run == 0 else str(run)
+        print(f'{label:<6}' + ''.join(f'{value:>14.1f}' for value in values))
+        if run:
+            boots.append(boot_ms)
+
+    if not boots:
+        return
+    median = statistics.median(boots)
+    print(f'\nBoot to first response: p50 {median:.0f} ms, max {max(boots):.0f} ms '
+          f'(target {args.target_ms:.0f} ms)')
+    if median > args.target_ms:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Time bulk catalog import (insert, then update) and export at scale.
+
+Usage: python benchmarks/bench_catalog_import.py [--rows 100000] [--format csv]
+
+The input file is generated from the synthetic catalog and streamed from
+disk, the same way `flask catalog import` reads it. Memory is the growth
+of the process's peak RSS during the import, which stays flat as the file
+grows because rows are streamed and written in fixed-size batches.
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import resource
+import time
+
+from common import synthetic_pastry, use_scratch_database
+
+
+def write_input(path, fmt, rows):
+    rng = random.Random(42)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f) if fmt == 'csv' else None
+        if writer:
+            writer.writerow(['name', 'category', 'price', 'description', 'serving_size', 'available',
+                             'ingredients', 'allergens', 'features'])
+        for i in range(rows):
+            row = synthetic_pastry(i, rng)
+            lists = {key: json.loads(row[f'{key}_json']) for key in ('ingredients', 'allergens', 'features')}
+            if writer:
+                writer.writerow([row['name'], row['category'], row['price'], row['description'],
+                                 row['serving_size'], int(row['available']),
+                                 *('|'.join(lists[key]) for key in ('ingredients', 'allergens', 'features'))])
+            else:
+                f.write(json.dumps({'name': row['name'], 'category': row['category'], 'price': row['price'],
+                                    'description': row['description'], 'available': row['available'],
+                                    **lists}) + '\n')
+
+
+def timed_import(import_catalog, path, fmt):
+    peak_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        report = import_catalog(f, fmt)
+    elapsed = time.perf_counter() - start
+    growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - peak_before
+    return report, elapsed, growth * 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+    args = parser.parse_args()
+
+    tmpdir = use_scratch_database()
+    from app import app, db, ensure_indexes, export_catalog, import_catalog
+
+    source = os.path.join(tmpdir, f'catalog.{args.format}')
+    write_input(source, args.format, args.rows)
+    print(f'Input: {args.rows:,} rows, {os.path.getsize(source) / 1e6:.1f} MB {args.format}')
+
+    with app.app_context():
+        db.create_all()
+        ensure_indexes()
+
+        report, elapsed, peak = timed_import(import_catalog, source, args.format)
+        print(f'Import (insert): {elapsed:.1f} s, {args.rows / elapsed:,.0f} rows/s, '
+              f'peak RSS +{peak / 1e6:.1f} MB, {report.summary()}')
+
+        exported = os.path.join(tmpdir, f'export.{args.format}')
+        start = time.perf_counter()
+        with open(exported, 'w', encoding='utf-8') as f:
+            for chunk in export_catalog(args.format):
+                f.write(chunk)
+        print(f'Export: {time.perf_counter() - start:.1f} s, {os.path.getsize(exported) / 1e6:.1f} MB')
+
+        report, elapsed, peak = timed_import(import_catalog, exported, args.format)
+        print(f'Import (update by id): {elapsed:.1f} s, {args.rows / elapsed:,.0f} rows/s, '
+              f'peak RSS +{peak / 1e6:.1f} MB, {report.summary()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""Parallel checkouts against limited stock: no order may oversell.
+
+Usage: python benchmarks/bench_checkout.py [--workers 8] [--orders 50] [--stock 40] [--hot 3] [--mode both]
+
+Each worker is a separate process (like a gunicorn worker) with its own
+test client. It fills a session cart with 1-3 of the --hot pastries, 1-3
+units each, and POSTs /checkout. Every hot pastry starts with --stock units.
+Once all workers finish, the script checks that each pastry's stock
+decrease equals the quantity in its order items and that stock never went
+negative. The exit status is 1 if either check fails.
+
+"atomic" is the real checkout (place_order's guarded UPDATE). "naive"
+replaces it with a read-check-write of `pastry.stock` through the ORM, with
+--think-ms between the read and the write, to show the oversell the guard
+prevents.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import statistics
+import time
+
+from common import seed_catalog, use_scratch_database
+
+
+def naive_place_order(cart, customer_name, phone, email=None, note=None):
+    """Check stock, then write it back: two checkouts can both see the last units"""
+    import app as store
+    lines = store.cart_lines(cart)
+    for pastry, quantity in lines:
+        if pastry.stock is not None and pastry.stock < quantity:
+            raise store.OutOfStock(pastry.name)
+    time.sleep(naive_place_order.think_seconds)
+    order = store.Order(customer_name=customer_name, phone=phone,
+                        total=sum(pastry.price * quantity for pastry, quantity in lines))
+    for pastry, quantity in lines:
+        if pastry.stock is not None:
+            pastry.stock -= quantity
+        order.items.append(store.OrderItem(pastry_id=pastry.id, name=pastry.name,
+                                           unit_price=pastry.price, quantity=quantity))
+    store.db.session.add(order)
+    store.db.session.commit()
+    return order
+
+
+def seed(rows, hot, stock):
+    from app import app, db, Pastry, ensure_indexes
+    with app.app_context():
+        db.create_all()
+        ensure_indexes()
+        seed_catalog(db, Pastry, rows)
+        Pastry.query.filter(Pastry.id <= hot).update({Pastry.stock: stock, Pastry.available: True})
+        db.session.commit()
+
+
+def worker(mode, orders, hot, think_ms, results):
+    import app as store
+    if mode == 'naive':
+        naive_place_order.think_seconds = think_ms / 1000
+        store.place_order = naive_place_order
+
+    rng = random.Random(os.getpid())
+    client = store.app.test_client()
+    outcomes = {'placed': 0, 'out_of_stock': 0, 'error': 0}
+    latencies = []
+    for _ in range(orders):
+        for pastry_id in rng.sample(range(1, hot + 1), rng.randint(1, min(3, hot))):
+            client.post(f'/cart/add/{pastry_id}', data={'quantity': rng.randint(1, 3)})
+        start = time.perf_counter()
+        response = client.post('/checkout', data={'name': 'Load test', 'phone': '08000000000'})
+        latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code == 302 and '/order/' in response.location:
+            outcomes['placed'] += 1
+        elif response.status_code == 302:
+            outcomes['out_of_stock'] += 1
+            with client.session_transaction() as session:
+                session.pop('cart', None)
+        else:
+            outcomes['error'] += 1
+    results.put((outcomes, latencies))
+
+
+def verify(hot, stock):
+    """(pastry id, stock left, units in orders) for each hot pastry"""
+    from app import app, db, Pastry, OrderItem
+    with app.app_context():
+        ordered = dict(db.session.query(OrderItem.pastry_id, db.func.sum(OrderItem.quantity))
+                       .filter(OrderItem.pastry_id <= hot).group_by(OrderItem.pastry_id).all())
+        return [(pastry.id, pastry.stock, ordered.get(pastry.id, 0))
+                for pastry in Pastry.query.filter(Pastry.id <= hot).order_by(Pastry.id)]
+
+
+def run(mode, args):
+    use_scratch_database()
+    ctx = multiprocessing.get_context('spawn')
+    seeder = ctx.Process(target=seed, args=(args.rows, args.hot, args.stock))
+    seeder.start()
+    seeder.join()
+
+    results = ctx.Queue()
+    workers = [ctx.Process(target=worker, args=(mode, args.orders, args.hot, args.think_ms, results))
+               for _ in range(args.workers)]
+    wall = time.perf_counter()
+    for process in workers:
+        process.start()
+    totals = {'placed': 0, 'out_of_stock': 0, 'error': 0}
+    latencies = []
+    for _ in workers:
+        outcomes, worker_latencies = results.get()
+        latencies += worker_latencies
+        for key, count in outcomes.items():
+            totals[key] += count
+    for process in workers:
+        process.join()
+    wall = time.perf_counter() - wall
+
+    checker = ctx.Pool(1)
+    rows = checker.apply(verify, (args.hot, args.stock))
+    checker.close()
+    print(f'\n{mode}: {totals["placed"]} orders placed, {totals["out_of_stock"]} refused (out of stock), '
+          f'{totals["error"]} errors in {wall:.1f}s; checkout p50 {statistics.median(latencies):.1f} ms')
+    failed = totals['error'] > 0
+    for pastry_id, left, ordered in rows:
+        sold = args.stock - left
+        ok = left >= 0 and sold == ordered
+        failed = failed or not ok
+        print(f'  pastry {pastry_id}: stock {args.stock} -> {left}, units in orders {ordered}'
+              f'{"" if ok else "  OVERSOLD" if ordered > args.stock else "  MISMATCH"}')
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--orders', type=int, default=50, help='checkouts per worker')
+    parser.add_argument('--stock', type=int, default=40, help='starting stock of each hot pastry')
+    parser.add_argument('--hot', type=int, default=3, help='pastries with limited stock')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--think-ms', type=float, default=5, help='naive mode: delay between check and write')
+    parser.add_argument('--mode', choices=['atomic', 'naive', 'both'], default='both')
+    args = parser.parse_args()
+
+    os.environ['JOB_WORKERS'] = '0'  # order emails stay queued
+    modes = ['naive', 'atomic'] if args.mode == 'both' else [args.mode]
+    failures = {mode: run(mode, args) for mode in modes}
+    if failures.get('atomic', False) or (args.mode == 'naive' and failures['naive']):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Concurrent readers and writers against one SQLite file, default vs tuned engine settings.
+
+Usage: python benchmarks/bench_concurrency.py [--rows 20000] [--readers 6] [--writers 2] [--seconds 10]
+
+Each reader and writer is a separate process, like gunicorn workers sharing
+a database. Readers run the detail and catalog-page queries through the
+read-only bind the way public views do. Writers update single pastries
+like admin edits, and every tenth write is a 2,000-row transaction like
+a catalog import.
+
+"default" is the app before engine tuning: rollback journal, pysqlite's
+default busy handling and every query on the primary engine. "tuned" uses
+the current settings (WAL, synchronous=NORMAL, busy_timeout, mmap, the
+query-only read bind).
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import statistics
+import time
+
+from common import seed_catalog, use_scratch_database
+
+
+def configure(mode):
+    from app import app
+    if mode == 'default':
+        app.config['SQLITE_PRAGMAS'] = {}
+        app.config['READ_ONLY_PUBLIC_ROUTES'] = False
+    return app
+
+
+def reader(mode, seconds, rows, results):
+    app = configure(mode)
+    from flask import g
+    from sqlalchemy.exc import OperationalError
+    from app import Pastry, get_pastry_with_related, paginate_pastries
+
+    rng = random.Random(os.getpid())
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            with app.test_request_context():
+                g.db_read_only = app.config['READ_ONLY_PUBLIC_ROUTES']
+                get_pastry_with_related(rng.randint(1, rows))
+                paginate_pastries(Pastry.query.filter_by(category='Cakes'), 24)
+        except OperationalError:
+            errors += 1
+        latencies.append((time.perf_counter() - start) * 1000)
+    results.put(('read', latencies, errors))
+
+
+def writer(mode, seconds, rows, results):
+    app = configure(mode)
+    from sqlalchemy.exc import OperationalError
+    from app import db, Pastry
+
+    rng = random.Random(os.getpid())
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + seconds
+    count = 0
+    while time.perf_counter() < deadline:
+        count += 1
+        start = time.perf_counter()
+        try:
+            with app.app_context():
+                if count % 10 == 0:
+                    first = rng.randint(1, max(1, rows - 2000))
+                    Pastry.query.filter(Pastry.id.between(first, first + 1999)).update(
+                        {Pastry.price: Pastry.price + 1}, synchronize_session=False)
+                else:
+                    pastry = db.session.get(Pastry, rng.randint(1, rows))
+                    pastry.price += 1
+                db.session.commit()
+        except OperationalError:
+            errors += 1
+        latencies.append((time.perf_counter() - start) * 1000)
+        time.sleep(0.005)
+    results.put(('write', latencies, errors))
+
+
+def seed(mode, rows):
+    app = configure(mode)
+    from app import db, Pastry, ensure_indexes
+    with app.app_context():
+        db.create_all()
+        ensure_indexes()
+        seed_catalog(db, Pastry, rows)
+
+
+def run(mode, args):
+    # Each mode gets a fresh file (WAL mode persists in it); the app is only
+    # imported in child processes so they all see this DATABASE_URL
+    use_scratch_database()
+    ctx = multiprocessing.get_context('spawn')
+    seeder = ctx.Process(target=seed, args=(mode, args.rows))
+    seeder.start()
+    seeder.join()
+
+    results = ctx.Queue()
+    workers = [ctx.Process(target=reader, args=(mode, args.seconds, args.rows, results))
+               for _ in range(args.readers)]
+    workers += [ctx.Process(target=writer, args=(mode, args.seconds, args.rows, results))
+                for _ in range(args.writers)]
+    for worker in workers:
+        worker.start()
+    collected = {'read': ([], 0), 'write': ([], 0)}
+    for _ in workers:
+        kind, latencies, errors = results.get()
+        all_latencies, all_errors = collected[kind]
+        collected[kind] = (all_latencies + latencies, all_errors + errors)
+    for worker in workers:
+        worker.join()
+
+    for kind, (latencies, errors) in collected.items():
+        p99 = statistics.quantiles(latencies, n=100)[98] if len(latencies) > 1 else 0
+        print(f'{mode:<8} {kind:<6} {len(latencies) / args.seconds:>9.1f} {statistics.median(latencies):>9.2f} '
+              f'{p99:>9.2f} {max(latencies):>9.1f} {errors:>7}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20_000)
+    parser.add_argument('--readers', type=int, default=6)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    print(f'{"mode":<8} {"op":<6} {"ops/s":>9} {"p50 ms":>9} {"p99 ms":>9} {"max ms":>9} {"errors":>7}')
+    for mode in ('default', 'tuned'):
+        run(mode, args)
+
+
+if __name__ == '__main__':
+    main()
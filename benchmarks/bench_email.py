@@ -0,0 +1,195 @@
+"""Contact-form email burst delivered by the job queue to a local SMTP debug server.
+
+Usage: python benchmarks/bench_email.py [--messages 200] [--workers 2] [--delay-ms 5]
+
+Starts a small SMTP debug server on a free port (it accepts every message
+after --delay-ms, except those addressed to reject@example.com, which get a
+550) and points MAIL_SERVER at it. Then, in a scratch database:
+
+1. --messages contact forms are posted with the job workers stopped, as if
+   the process died mid-burst: the emails must be queued, not sent, and no
+   thread may be started per message.
+2. --workers job workers drain the queue. Every message must reach the
+   server, over no more SMTP connections than there are batches of
+   EMAIL_BATCH_SIZE.
+3. A message the server refuses is retried until JOB_MAX_ATTEMPTS and
+   dead-lettered, without holding up the rest.
+4. purge_done_jobs deletes the done jobs and keeps the dead one.
+
+Prints the drain time, messages/s and SMTP connections; the exit status is
+1 if any check fails.
+"""
+import argparse
+import math
+import os
+import socketserver
+import threading
+import time
+from threading import Lock, Thread
+
+from common import use_scratch_database
+
+REJECTED = 'reject@example.com'
+
+
+class SMTPDebugServer(socketserver.ThreadingTCPServer):
+    """Just enough SMTP for Flask-Mail: counts connections and accepted messages"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, delay):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.delay = delay
+        self.lock = Lock()
+        self.connections = 0
+        self.messages = []
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply('220 localhost debug SMTP')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip()
+            verb = command[:4].upper()
+            if verb == 'EHLO':
+                self.reply('250-localhost')
+                self.reply('250 8BITMIME')
+            elif verb == 'HELO':
+                self.reply('250 localhost')
+            elif verb == 'MAIL':
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                address = command.split(':', 1)[1].strip().strip('<>')
+                if address == REJECTED:
+                    self.reply('550 No such user')
+                else:
+                    recipients.append(address)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                for line in iter(self.rfile.readline, b''):
+                    if line in (b'.\r\n', b'.\n'):
+                        break
+                    data.append(line)
+                time.sleep(server.delay)
+                with server.lock:
+                    server.messages.append((recipients, b''.join(data)))
+                self.reply('250 OK queued')
+            elif verb == 'RSET' or verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+def wait_for_queue(Job, app, timeout):
+    """Seconds until no job is pending or running"""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        with app.app_context():
+            if not Job.query.filter(Job.status.in_(['pending', 'running'])).count():
+                return time.perf_counter() - start
+        time.sleep(0.05)
+    raise TimeoutError(f'jobs still queued after {timeout}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200, help='contact forms to post')
+    parser.add_argument('--workers', type=int, default=2, help='job worker threads')
+    parser.add_argument('--delay-ms', type=float, default=5, help='server time per message')
+    parser.add_argument('--timeout', type=float, default=120)
+    args = parser.parse_args()
+
+    smtp = SMTPDebugServer(args.delay_ms / 1000)
+    Thread(target=smtp.serve_forever, daemon=True).start()
+
+    use_scratch_database()
+    os.environ.update({'JOB_WORKERS': '0', 'RATE_LIMIT_BACKEND': 'none', 'PAGE_CACHE_BACKEND': 'none',
+                       'MAIL_SERVER': '127.0.0.1', 'MAIL_PORT': str(smtp.port), 'MAIL_USE_TLS': '0'})
+    from flask_mail import Message
+    from app import app, db, Job, job_workers, purge_done_jobs, send_email
+    app.config.update(MAIL_USERNAME=None, MAIL_PASSWORD=None, JOB_BACKOFF_SECONDS=0, JOB_POLL_SECONDS=0.05)
+    with app.app_context():
+        db.create_all()
+
+    failures = []
+
+    def check(condition, message):
+        if not condition:
+            failures.append(message)
+
+    # 1. The burst is queued with the workers stopped
+    client = app.test_client()
+    threads = threading.active_count()
+    start = time.perf_counter()
+    for i in range(args.messages):
+        client.post('/contact', data={'name': f'Customer {i}', 'email': f'customer{i}@example.com',
+                                      'subject': 'Birthday cake', 'message': 'Do you deliver on Sundays?'})
+    posted = time.perf_counter() - start
+    with app.app_context():
+        queued = Job.query.filter_by(kind='send_email', status='pending').count()
+    check(queued >= args.messages, f'{queued} emails queued for {args.messages} contact forms')
+    check(not smtp.messages, f'{len(smtp.messages)} emails sent with the workers stopped')
+    check(threading.active_count() == threads, f'{threading.active_count() - threads} threads started by the burst')
+
+    # 2. The workers drain it over batched connections
+    job_workers.start(args.workers)
+    drained = wait_for_queue(Job, app, args.timeout)
+    batches = math.ceil(queued / app.config['EMAIL_BATCH_SIZE'])
+    check(len(smtp.messages) == queued, f'{len(smtp.messages)} of {queued} emails reached the server')
+    check(smtp.connections <= batches + args.workers,
+          f'{smtp.connections} SMTP connections for {batches} batches of {app.config["EMAIL_BATCH_SIZE"]}')
+    print(f'{args.messages} contact forms in {posted:.2f}s, {queued} emails queued')
+    print(f'\n{"workers":>8}{"drain s":>10}{"emails/s":>10}{"SMTP conns":>12}')
+    print(f'{args.workers:>8}{drained:>10.2f}{queued / drained:>10.0f}{smtp.connections:>12}')
+
+    # 3. A refused message is retried, then dead-lettered
+    sent = len(smtp.messages)
+    with app.app_context():
+        send_email(Message(subject='Bounce', recipients=[REJECTED], body='x', sender='shop@example.com'))
+        send_email(Message(subject='Fine', recipients=['fine@example.com'], body='x', sender='shop@example.com'))
+    wait_for_queue(Job, app, args.timeout)
+    with app.app_context():
+        dead = Job.query.filter_by(status='dead').all()
+        check(len(dead) == 1 and dead[0].attempts == app.config['JOB_MAX_ATTEMPTS'],
+              f'refused email: {[(job.status, job.attempts) for job in dead]}, '
+              f'expected one dead job after {app.config["JOB_MAX_ATTEMPTS"]} attempts')
+    check(len(smtp.messages) == sent + 1, 'the email queued after the refused one was not delivered')
+    job_workers.stop()
+
+    # 4. Retention: done jobs are purged, the dead one is kept
+    with app.app_context():
+        done = Job.query.filter_by(status='done').count()
+        purged = purge_done_jobs(older_than=0)
+        check(purged == done, f'purged {purged} of {done} done jobs')
+        check(Job.query.filter_by(status='dead').count() == 1, 'the dead job was purged')
+    print(f'refused email dead-lettered after {app.config["JOB_MAX_ATTEMPTS"]} attempts; purged {purged} done jobs')
+
+    smtp.shutdown()
+    for message in failures:
+        print(f'FAILED: {message}')
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
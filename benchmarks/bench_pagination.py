@@ -0,0 +1,65 @@
+"""Seed a large synthetic catalog and time keyset-paginated listing pages.
+
+Usage: python benchmarks/bench_pagination.py [--rows 100000] [--per-page 24]
+
+Per-page latency should stay flat regardless of how deep into the catalog
+the cursor points, since every page is an index range scan on (category, id).
+"""
+import argparse
+import os
+import statistics
+import time
+
+from common import seed_catalog, use_scratch_database
+
+
+def time_requests(client, url, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get(url)
+        samples.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.status_code
+    return statistics.median(samples), max(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--per-page', type=int, default=24)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    use_scratch_database()
+    os.environ['PAGE_CACHE_BACKEND'] = 'none'  # measure the query path, not cache hits
+    from app import app, db, Pastry, encode_cursor, ensure_indexes
+
+    with app.app_context():
+        db.create_all()
+        ensure_indexes()
+        start = time.perf_counter()
+        seed_catalog(db, Pastry, args.rows)
+        print(f'Seeded {args.rows:,} pastries in {time.perf_counter() - start:.1f}s')
+
+        ordered = db.session.query(Pastry.category, Pastry.id).order_by(Pastry.category, Pastry.id)
+        depths = [0, args.rows // 100, args.rows // 10, args.rows // 2, args.rows - args.per_page - 1]
+        cursors = {}
+        for depth in depths:
+            if depth <= 0:
+                cursors[depth] = None
+            else:
+                category, pastry_id = ordered.offset(depth - 1).limit(1).one()
+                cursors[depth] = encode_cursor(category, pastry_id)
+
+    client = app.test_client()
+    print(f'{"offset":>10} {"median ms":>10} {"max ms":>10}')
+    for depth, cursor in cursors.items():
+        url = f'/pastries?per_page={args.per_page}'
+        if cursor:
+            url += f'&after={cursor}'
+        median, worst = time_requests(client, url, args.repeat)
+        print(f'{depth:>10,} {median:>10.2f} {worst:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
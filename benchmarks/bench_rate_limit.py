@@ -0,0 +1,170 @@
+"""Credential stuffing and contact-form spam, replayed with and without rate limits.
+
+Usage: python benchmarks/bench_rate_limit.py [--attackers 8] [--attempts 20] [--spam 20] [--rate 40] [--backend memory]
+
+Seeds a catalog and the admin user, then replays an attack from --attackers
+client IPs at once, --rate requests/s between them. Each IP sends --attempts
+login POSTs, mostly wrong passwords for the admin account plus guesses at
+other usernames, and --spam contact-form POSTs, ignoring 429s and
+Retry-After as a real attacker would. Meanwhile a visitor loads the home
+page and pastry pages at --visitor-rate requests/s, with the page cache off
+so those requests do real work.
+
+Each mode runs in its own process. "open" sets RATE_LIMIT_BACKEND=none;
+"limited" uses --backend with the default RATE_LIMITS. For each mode the
+script reports how long the replay took, the CPU time it cost, the
+password hashes computed, emails queued, responses refused with 429 and the
+visitor's latency before and during the attack. Without limits the hashes
+alone outrun one core and the replay falls behind its rate. The exit
+status is 1 if the limited run hashed more passwords than login_user allows
+or queued more emails than contact_ip allows per IP.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import statistics
+import time
+from threading import Event, Thread
+
+from common import seed_catalog, use_scratch_database
+
+PASSWORDS = ['123456', 'password', 'admin', 'qwerty', 'letmein', 'welcome', 'bakery2024', 'sweettreats',
+             'P@ssw0rd', 'iloveyou', 'admin1234', 'monkey', 'dragon', 'sunshine', 'football', 'abc123']
+
+
+def seed(rows):
+    from app import app, db, Pastry, User, ensure_indexes
+    with app.app_context():
+        db.create_all()
+        ensure_indexes()
+        seed_catalog(db, Pastry, rows)
+        admin = User(username='admin')
+        admin.set_password('a-long-correct-password')
+        db.session.add(admin)
+        db.session.commit()
+
+
+def attacker(client, rng, attempts, spam, interval, statuses):
+    actions = ['login'] * attempts + ['contact'] * spam
+    rng.shuffle(actions)
+    start = time.perf_counter() + rng.random() * interval
+    for i, action in enumerate(actions):
+        delay = start + i * interval - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        if action == 'login':
+            username = 'admin' if rng.random() < 0.8 else rng.choice(['root', 'administrator', 'owner', 'test'])
+            response = client.post('/admin/login', data={'username': username, 'password': rng.choice(PASSWORDS)})
+        else:
+            response = client.post('/contact', data={'name': 'Buy now', 'email': 'spam@example.com',
+                                                      'subject': 'Cheap followers', 'message': 'x' * 500})
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+
+def visitor(client, rows, interval, stop, latencies):
+    rng = random.Random(7)
+    while not stop.wait(interval):
+        path = '/' if rng.random() < 0.3 else f'/pastry/{rng.randint(1, rows)}'
+        start = time.perf_counter()
+        client.get(path)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+
+def replay(mode, args, rate_limit_db, results):
+    os.environ['RATE_LIMIT_BACKEND'] = 'none' if mode == 'open' else args.backend
+    os.environ['RATE_LIMIT_DB'] = rate_limit_db
+    os.environ['PAGE_CACHE_BACKEND'] = 'none'
+    import app as store
+
+    hashes = [0]
+    check_password = store.User.check_password
+
+    def counted_check_password(user, password):
+        hashes[0] += 1
+        return check_password(user, password)
+
+    store.User.check_password = counted_check_password
+    with store.app.app_context():
+        emails_before = store.Job.query.filter_by(kind='send_email').count()
+
+    stop = Event()
+    latencies = []
+    visitor_thread = Thread(target=visitor, args=(store.app.test_client(), args.rows, 1 / args.visitor_rate,
+                                                  stop, latencies))
+    visitor_thread.start()
+    time.sleep(args.baseline)  # visitor latency before the attack starts
+    baseline = len(latencies)
+
+    statuses = {}
+    threads = []
+    for i in range(args.attackers):
+        client = store.app.test_client()
+        client.environ_base['REMOTE_ADDR'] = f'203.0.113.{i + 1}'
+        threads.append(Thread(target=attacker, args=(client, random.Random(i), args.attempts, args.spam,
+                                                     args.attackers / args.rate, statuses)))
+    cpu, wall = time.process_time(), time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    stop.set()
+    visitor_thread.join()
+
+    with store.app.app_context():
+        emails = store.Job.query.filter_by(kind='send_email').count() - emails_before
+    results.put({'cpu': cpu, 'wall': wall, 'hashes': hashes[0], 'emails': emails, 'statuses': statuses,
+                 'baseline': latencies[:baseline], 'attacked': latencies[baseline:]})
+
+
+def percentile(values, fraction):
+    values = sorted(values) or [0.0]
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--attackers', type=int, default=8, help='client IPs attacking at once')
+    parser.add_argument('--attempts', type=int, default=20, help='login POSTs per attacker')
+    parser.add_argument('--spam', type=int, default=20, help='contact-form POSTs per attacker')
+    parser.add_argument('--rate', type=float, default=40, help='attack requests per second, all attackers together')
+    parser.add_argument('--visitor-rate', type=float, default=20, help='visitor requests per second')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--baseline', type=float, default=2, help='seconds of visitor traffic before the attack')
+    parser.add_argument('--backend', choices=['memory', 'sqlite'], default='memory')
+    parser.add_argument('--mode', choices=['open', 'limited', 'both'], default='both')
+    args = parser.parse_args()
+
+    tmpdir = use_scratch_database()
+    os.environ['JOB_WORKERS'] = '0'  # spam stays queued, so it can be counted
+    ctx = multiprocessing.get_context('spawn')
+    seeder = ctx.Process(target=seed, args=(args.rows,))
+    seeder.start()
+    seeder.join()
+
+    print(f'{args.attackers} attackers x ({args.attempts} logins + {args.spam} contact posts) at {args.rate:g} req/s')
+    print(f'\n{"mode":<9}{"wall s":>8}{"cpu s":>8}{"hashes":>8}{"emails":>8}{"429s":>7}'
+          f'{"visitor p50/p99 ms: before":>30}{"during":>16}')
+    failed = False
+    for mode in (['open', 'limited'] if args.mode == 'both' else [args.mode]):
+        results = ctx.Queue()
+        process = ctx.Process(target=replay, args=(mode, args, os.path.join(tmpdir, f'{mode}-ratelimit.db'), results))
+        process.start()
+        run = results.get()
+        process.join()
+        before = f'{statistics.median(run["baseline"] or [0]):.1f}/{percentile(run["baseline"], 0.99):.1f}'
+        during = f'{statistics.median(run["attacked"] or [0]):.1f}/{percentile(run["attacked"], 0.99):.1f}'
+        print(f'{mode:<9}{run["wall"]:>8.1f}{run["cpu"]:>8.1f}{run["hashes"]:>8}{run["emails"]:>8}'
+              f'{run["statuses"].get(429, 0):>7}{before:>30}{during:>16}')
+        if mode == 'limited':
+            from app import app
+            limits = app.config['RATE_LIMITS']
+            failed = run['hashes'] > limits['login_user'][0] or \
+                run['emails'] > args.attackers * limits['contact_ip'][0]
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Time /search JSON autocomplete and full results on a large catalog.
+
+Usage: python benchmarks/bench_search.py [--rows 100000]
+
+Replays type-ahead sequences ("c", "ch", "cho", ...) through the Flask test
+client with the page cache disabled and reports p50/p99 latency. The
+autocomplete target is p99 under 10 ms at 100k pastries.
+"""
+import argparse
+import os
+import statistics
+import time
+
+from common import seed_catalog, use_scratch_database
+
+TYPED = ['chocolate', 'vanilla cake', 'crispy coconut', 'honey almond muffins', 'mango', 'cinn']
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def replay(client, make_url, repeat):
+    samples = []
+    for _ in range(repeat):
+        for word in TYPED:
+            for end in range(2, len(word) + 1):
+                start = time.perf_counter()
+                response = client.get(make_url(word[:end]))
+                samples.append((time.perf_counter() - start) * 1000)
+                assert response.status_code == 200, response.status_code
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    use_scratch_database()
+    os.environ['PAGE_CACHE_BACKEND'] = 'none'
+    from app import app, db, Pastry, ensure_indexes, ensure_search_index
+
+    with app.app_context():
+        db.create_all()
+        ensure_indexes()
+        seed_catalog(db, Pastry, args.rows)
+        start = time.perf_counter()
+        ensure_search_index()
+        print(f'Built FTS5 index over {args.rows:,} pastries in {time.perf_counter() - start:.2f}s')
+
+    client = app.test_client()
+    for label, make_url in (('autocomplete (json)', lambda q: f'/search?format=json&q={q}'),
+                            ('results page (html)', lambda q: f'/search?q={q}')):
+        samples = replay(client, make_url, args.repeat)
+        print(f'{label:<22} n={len(samples):<5} p50={statistics.median(samples):6.2f} ms  '
+              f'p99={percentile(samples, 99):6.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""Seed image downloads against a local image server: retries, concurrency and manifest reuse.
+
+Usage: python benchmarks/bench_seed_download.py [--images 40] [--delay-ms 50] [--workers 8]
+
+Starts a ThreadingHTTPServer that serves --images small PNGs, each after
+--delay-ms, plus URLs that misbehave: one answers 503 twice before serving,
+one answers 429 once, one always answers 500, and one always answers 404. It then runs
+download_images (the seed downloader behind populate_initial_data) into a
+scratch upload folder, first with one worker and then with --workers, and
+reports the wall time and the requests the server saw.
+
+It checks that 5xx and 429 responses are retried up to
+SEED_DOWNLOAD_RETRIES times, that 4xx responses are not retried, and that
+a second run reuses the manifest: it requests nothing already downloaded,
+only the URLs that failed and an image whose file was damaged, which it
+must replace. The exit status is 1 if any check fails.
+"""
+import argparse
+import os
+import time
+from collections import Counter
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+from common import use_scratch_database
+
+PNG_MAGIC = b'\x89PNG\r\n\x1a\n'
+
+
+def image_bytes(name):
+    return PNG_MAGIC + name.encode('utf-8') * 200
+
+
+class ImageServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # path -> (status, how many requests get it before the image is served; None: all of them)
+    FAILURES = {'/flaky.png': (503, 2), '/throttled.png': (429, 1), '/broken.png': (500, None),
+                '/missing.png': (404, None)}
+
+    def __init__(self, delay):
+        super().__init__(('127.0.0.1', 0), ImageHandler)
+        self.delay = delay
+        self.requests = Counter()
+        self.lock = Lock()
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.server_address[1]}{path}'
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests[self.path] += 1
+            status, count = server.FAILURES.get(self.path, (200, 0))
+            if count is not None and server.requests[self.path] > count:
+                status = 200
+        if status != 200:
+            self.send_response(status)
+            if status == 429:
+                self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        time.sleep(server.delay)
+        body = image_bytes(self.path)
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def download(download_images, urls, workers, manifest_path):
+    """download_images without its per-image progress lines; (results, wall seconds)"""
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        results = download_images(urls, workers=workers, manifest_path=manifest_path)
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--images', type=int, default=40, help='well-behaved images to serve')
+    parser.add_argument('--delay-ms', type=float, default=50, help='server time per image')
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    tmpdir = use_scratch_database()
+    os.environ['JOB_WORKERS'] = '0'
+    from app import app, download_images
+    app.config['SEED_DOWNLOAD_BACKOFF'] = 0.01
+    retries = app.config['SEED_DOWNLOAD_RETRIES']
+
+    failures = []
+
+    def check(condition, message):
+        if not condition:
+            failures.append(message)
+
+    print(f'{args.images} images + {len(ImageServer.FAILURES)} misbehaving URLs, {args.delay_ms:g} ms per image, '
+          f'{retries} retries')
+    print(f'\n{"run":<12}{"workers":>8}{"wall s":>10}{"requests":>10}{"saved":>8}')
+    for label, workers in (('serial', 1), ('concurrent', args.workers)):
+        server = ImageServer(args.delay_ms / 1000)
+        Thread(target=server.serve_forever, daemon=True).start()
+        run_dir = os.path.join(tmpdir, label)
+        app.config['UPLOAD_FOLDER'] = os.path.join(run_dir, 'uploads')
+        os.makedirs(app.config['UPLOAD_FOLDER'])
+        manifest_path = os.path.join(run_dir, 'seed_manifest.json')
+        images = [server.url(f'/image-{i}.png') for i in range(args.images)]
+        urls = images + [server.url(path) for path in ImageServer.FAILURES]
+        expected = set(images) | {server.url('/flaky.png'), server.url('/throttled.png')}
+
+        results, wall = download(download_images, urls, workers, manifest_path)
+        requests = server.requests
+        print(f'{label:<12}{workers:>8}{wall:>10.2f}{sum(requests.values()):>10}{len(results):>8}')
+        check(set(results) == expected, f'{label}: saved {sorted(set(results) ^ expected)} unexpectedly')
+        check(requests['/flaky.png'] == 3, f'{label}: 503, 503, 200 took {requests["/flaky.png"]} requests, not 3')
+        check(requests['/throttled.png'] == 2, f'{label}: 429, 200 took {requests["/throttled.png"]} requests, not 2')
+        check(requests['/broken.png'] == retries + 1,
+              f'{label}: a persistent 500 took {requests["/broken.png"]} requests, not {retries + 1}')
+        check(requests['/missing.png'] == 1, f'{label}: a 404 took {requests["/missing.png"]} requests, not 1')
+        if label == 'serial':
+            server.shutdown()
+            server.server_close()
+
+    # Rerun the concurrent seed against its manifest, with one image's file damaged
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], results[images[0]]), 'ab') as f:
+        f.write(b'damaged')
+    requests.clear()  # /flaky.png and /throttled.png would fail again, but they are in the manifest
+    results, wall = download(download_images, urls, args.workers, manifest_path)
+    print(f'{"rerun":<12}{args.workers:>8}{wall:>10.2f}{sum(requests.values()):>10}{len(results):>8}')
+    check(set(results) == expected, f'rerun: saved {sorted(set(results) ^ expected)} unexpectedly')
+    check(set(requests) == {'/image-0.png', '/broken.png', '/missing.png'},
+          f'rerun: requested {sorted(requests)}, not just the damaged image and the failed URLs')
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], results[images[0]]), 'rb') as f:
+        check(f.read() == image_bytes('/image-0.png'), 'rerun: the damaged image was not replaced')
+    server.shutdown()
+    server.server_close()
+
+    for message in failures:
+        print(f'FAILED: {message}')
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Time the related-pastries similarity index: full rebuild, incremental refresh and lookup.
+
+Usage: python benchmarks/bench_similarity.py [--rows 100000] [--sample 50]
+
+Recall is measured against an exact all-pairs search for a sample of
+pastries: the share of the exact top-K similarity score that the stored
+neighbour list reaches.
+"""
+import argparse
+import random
+import statistics
+import time
+
+from common import seed_catalog, use_scratch_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--sample', type=int, default=50)
+    parser.add_argument('--edits', type=int, default=10)
+    args = parser.parse_args()
+
+    use_scratch_database()
+    from app import (app, db, Pastry, PastryNeighbor, rebuild_similarity, refresh_similarity,
+                     load_similarity_corpus, top_neighbors, get_pastry_with_related)
+
+    with app.app_context():
+        db.create_all()
+        seed_catalog(db, Pastry, args.rows)
+
+        start = time.perf_counter()
+        rebuild_similarity()
+        print(f'Rebuild over {args.rows:,} pastries: {time.perf_counter() - start:.1f} s '
+              f'({PastryNeighbor.query.count():,} neighbour rows)')
+
+        ids, vectors = load_similarity_corpus()
+        rng = random.Random(1)
+        ratios = []
+        for i in rng.sample(range(len(ids)), min(args.sample, len(ids))):
+            exact = sum(score for score, _ in top_neighbors(i, range(len(ids)), ids, vectors))
+            stored = db.session.query(db.func.sum(PastryNeighbor.score)).filter_by(pastry_id=ids[i]).scalar() or 0
+            ratios.append(stored / exact if exact else 1.0)
+        print(f'Recall vs exact top-K score: mean {statistics.mean(ratios):.3f}, min {min(ratios):.3f}')
+
+        samples = []
+        for pastry_id in rng.sample(ids, args.edits):
+            pastry = db.session.get(Pastry, pastry_id)
+            pastry.features = ['Vegan', 'Gluten-free']
+            db.session.commit()
+            start = time.perf_counter()
+            refresh_similarity([pastry_id])
+            samples.append((time.perf_counter() - start) * 1000)
+        print(f'Incremental refresh of one edit: median {statistics.median(samples):.0f} ms, '
+              f'max {max(samples):.0f} ms')
+
+        samples = []
+        with app.test_request_context():
+            for pastry_id in rng.sample(ids, 500):
+                start = time.perf_counter()
+                get_pastry_with_related(pastry_id)
+                samples.append((time.perf_counter() - start) * 1000)
+        print(f'Detail + related lookup: median {statistics.median(samples):.2f} ms, '
+              f'p99 {statistics.quantiles(samples, n=100)[98]:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
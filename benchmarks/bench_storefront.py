@@ -0,0 +1,279 @@
+"""Storefront benchmark suite: public pages and admin flows, in-process and over HTTP.
+
+Usage:
+    python benchmarks/bench_storefront.py [--size 1k|10k|100k] [--requests 200] [--concurrency 4]
+        [--baseline benchmarks/baselines/1k.json] [--save-baseline PATH] [--tolerance 0.25]
+
+Seeds a scratch database with a synthetic catalog (many categories, JSON
+ingredient/allergen/feature lists), then drives every scenario through
+Flask's test client and through werkzeug's threaded WSGI server over real
+HTTP connections. The page cache is off unless --page-cache is given, so
+the numbers measure the application rather than cache hits.
+
+Each scenario reports throughput, p50/p99 latency and process RSS. With
+--baseline, a scenario whose p50 or throughput is worse than the baseline
+by more than --tolerance (p99: --p99-tolerance), or whose RSS has grown by
+more than --tolerance, counts as a regression and the exit status is 1.
+Baselines depend on the machine, so record them with --save-baseline on
+the machine that runs the comparison.
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import CATEGORIES, MORE_CATEGORIES, seed_catalog, use_scratch_database
+
+SIZES = {'1k': 1_000, '10k': 10_000, '100k': 100_000}
+ADMIN_USER, ADMIN_PASSWORD = 'bench-admin', 'bench-password'
+
+# A 1x1 PNG for the add-pastry upload
+PIXEL_PNG = bytes.fromhex(
+    '89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c489'
+    '0000000d49444154789c6360f8cfc0f01f0005000201e5274fb90000000049454e44ae426082')
+
+
+def rss_mb():
+    """Current resident set size, falling back to the peak where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+
+def pastry_form(rng, categories):
+    return {
+        'name': f'Bench pastry {rng.randint(1, 10**9)}',
+        'category': rng.choice(categories),
+        'price': str(rng.randint(500, 20000)),
+        'description': 'A benchmark pastry with a realistic amount of description text.',
+        'serving_size': '6 pieces',
+        'available': 'on',
+        'ingredients': json.dumps(['Flour', 'Sugar', 'Butter', 'Eggs']),
+        'allergens': json.dumps(['Gluten', 'Dairy']),
+        'features': json.dumps(['Freshly baked']),
+    }
+
+
+def scenarios(rows, categories):
+    """name -> (needs_login, make_request(rng) -> (method, path, form, files), expected status)"""
+    def home(rng):
+        return 'GET', '/', None, None
+
+    def pastries(rng):
+        return 'GET', f'/pastries/{rng.choice(categories)}', None, None
+
+    def pastry_detail(rng):
+        return 'GET', f'/pastry/{rng.randint(1, rows)}', None, None
+
+    def admin_dashboard(rng):
+        return 'GET', '/admin', None, None
+
+    def admin_add(rng):
+        return 'POST', '/admin/pastries/add', pastry_form(rng, categories), {'image_file': ('bench.png', PIXEL_PNG)}
+
+    def admin_edit(rng):
+        return 'POST', f'/admin/pastries/edit/{rng.randint(1, rows)}', pastry_form(rng, categories), None
+
+    return {
+        'home': (False, home, 200),
+        'pastries': (False, pastries, 200),
+        'pastry_detail': (False, pastry_detail, 200),
+        'admin_dashboard': (True, admin_dashboard, 200),
+        'admin_add': (True, admin_add, 302),
+        'admin_edit': (True, admin_edit, 302),
+    }
+
+
+def summarize(latencies, wall_seconds):
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'rps': round(len(ordered) / wall_seconds, 1),
+        'p50_ms': round(statistics.median(ordered), 2),
+        'p99_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], 2),
+        'rss_mb': round(rss_mb(), 1),
+    }
+
+
+def run_test_client(app, scenario, count, seed):
+    needs_login, make_request, expected = scenario
+    client = app.test_client()
+    if needs_login:
+        client.post('/admin/login', data={'username': ADMIN_USER, 'password': ADMIN_PASSWORD})
+    rng = random.Random(seed)
+    latencies = []
+    wall = time.perf_counter()
+    for _ in range(count):
+        method, path, form, files = make_request(rng)
+        data = dict(form or {})
+        for field, (filename, content) in (files or {}).items():
+            data[field] = (io.BytesIO(content), filename)
+        start = time.perf_counter()
+        response = client.open(path, method=method, data=data or None,
+                               content_type='multipart/form-data' if files else None)
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == expected, (path, response.status_code)
+    return summarize(latencies, time.perf_counter() - wall)
+
+
+def run_http(base_url, scenario, count, concurrency, seed):
+    import requests
+
+    needs_login, make_request, expected = scenario
+    per_worker = max(1, count // concurrency)
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        latencies = []
+        with requests.Session() as http:
+            if needs_login:
+                http.post(f'{base_url}/admin/login', data={'username': ADMIN_USER, 'password': ADMIN_PASSWORD},
+                          allow_redirects=False)
+            for _ in range(per_worker):
+                method, path, form, files = make_request(rng)
+                start = time.perf_counter()
+                response = http.request(method, base_url + path, data=form, files=files, allow_redirects=False)
+                response.content  # read the whole body
+                latencies.append((time.perf_counter() - start) * 1000)
+                assert response.status_code == expected, (path, response.status_code)
+        return latencies
+
+    wall = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = [ms for result in pool.map(worker, range(concurrency)) for ms in result]
+    return summarize(latencies, time.perf_counter() - wall)
+
+
+def compare(results, baseline, tolerance, p99_tolerance):
+    """Print a comparison table and return the number of regressions"""
+    regressions = 0
+    print(f'\n{"scenario":<32} {"metric":<7} {"baseline":>10} {"current":>10} {"change":>8}')
+    for key, base in baseline['scenarios'].items():
+        current = results['scenarios'].get(key)
+        if current is None:
+            continue
+        for metric, worse_when_higher, limit in (('rps', False, tolerance), ('p50_ms', True, tolerance),
+                                                 ('p99_ms', True, p99_tolerance), ('rss_mb', True, tolerance)):
+            if not base.get(metric):
+                continue
+            change = current[metric] / base[metric] - 1
+            regressed = change > limit if worse_when_higher else change < -limit
+            regressions += regressed
+            flag = '  REGRESSION' if regressed else ''
+            print(f'{key:<32} {metric:<7} {base[metric]:>10} {current[metric]:>10} {change:>+7.0%}{flag}')
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', default='1k', help='1k, 10k, 100k or a number of pastries')
+    parser.add_argument('--categories', type=int, default=len(CATEGORIES) + len(MORE_CATEGORIES))
+    parser.add_argument('--requests', type=int, default=200, help='per scenario and driver')
+    parser.add_argument('--concurrency', type=int, default=4, help='HTTP client threads')
+    parser.add_argument('--page-cache', action='store_true', help='keep the page cache on')
+    parser.add_argument('--only', action='append', help='run only these scenarios (repeatable)')
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--baseline', help='compare against a results JSON file')
+    parser.add_argument('--save-baseline', help='write results as a new baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--p99-tolerance', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rows = SIZES.get(args.size) or int(args.size)
+    categories = (CATEGORIES + MORE_CATEGORIES)[:args.categories]
+
+    tmpdir = use_scratch_database()
+    os.environ.setdefault('JOB_WORKERS', '0')  # queued derivative/similarity jobs would skew timings
+    if not args.page_cache:
+        os.environ['PAGE_CACHE_BACKEND'] = 'none'
+    from werkzeug.serving import make_server
+    from app import app, db, Pastry, User, ensure_indexes, attribute_index, ensure_search_index, rebuild_similarity
+
+    app.config['UPLOAD_FOLDER'] = os.path.join(tmpdir, 'uploads')
+    os.makedirs(app.config['UPLOAD_FOLDER'])
+    with app.app_context():
+        db.create_all()
+        ensure_indexes()
+        start = time.perf_counter()
+        seed_catalog(db, Pastry, rows, seed=args.seed, categories=categories)
+        admin = User(username=ADMIN_USER)
+        admin.set_password(ADMIN_PASSWORD)
+        db.session.add(admin)
+        db.session.commit()
+        attribute_index.rebuild()
+        ensure_search_index()
+        rebuild_similarity()
+        print(f'Seeded {rows:,} pastries in {len(categories)} categories in {time.perf_counter() - start:.1f}s')
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # no per-request access log
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    results = {
+        'meta': {'rows': rows, 'categories': len(categories), 'requests': args.requests,
+                 'concurrency': args.concurrency, 'page_cache': args.page_cache, 'commit': git_commit(),
+                 'python': platform.python_version(), 'machine': platform.machine(),
+                 'cpus': os.cpu_count()},
+        'scenarios': {},
+    }
+    print(f'{"scenario":<32} {"rps":>8} {"p50 ms":>8} {"p99 ms":>8} {"rss MB":>8}')
+    try:
+        for name, scenario in scenarios(rows, categories).items():
+            if args.only and name not in args.only:
+                continue
+            for driver in ('test_client', 'http'):
+                if driver == 'test_client':
+                    summary = run_test_client(app, scenario, args.requests, args.seed)
+                else:
+                    summary = run_http(base_url, scenario, args.requests, args.concurrency, args.seed)
+                key = f'{driver}/{name}'
+                results['scenarios'][key] = summary
+                print(f'{key:<32} {summary["rps"]:>8} {summary["p50_ms"]:>8} {summary["p99_ms"]:>8} '
+                      f'{summary["rss_mb"]:>8}')
+    finally:
+        server.shutdown()
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2)
+                f.write('\n')
+            print(f'Wrote {path}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('rows') != rows:
+            print(f"Warning: baseline was recorded with {baseline['meta'].get('rows'):,} pastries")
+        regressions = compare(results, baseline, args.tolerance, args.p99_tolerance)
+        print(f'\n{regressions} regressions' if regressions else '\nNo regressions against the baseline.')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
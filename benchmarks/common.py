@@ -0,0 +1,65 @@
+"""Shared helpers for the benchmark scripts: scratch database and synthetic catalog."""
+import json
+import os
+import random
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+CATEGORIES = ['Cakes', 'Cookies', 'Bread', 'Donuts', 'Pastries', 'Pies', 'Tarts', 'Muffins']
+ALLERGENS = ['Gluten', 'Dairy', 'Eggs', 'Nuts', 'Soy', 'Sesame']
+FEATURES = ['Freshly baked', 'Vegan', 'Sugar-free', 'Gluten-free', 'Kids favorite', 'Party favorite']
+ADJECTIVES = ['Classic', 'Golden', 'Rustic', 'Velvet', 'Double', 'Mini', 'Glazed', 'Toasted',
+              'Spiced', 'Honey', 'Buttery', 'Frosted', 'Royal', 'Country', 'Chewy', 'Crispy']
+FLAVORS = ['Chocolate', 'Vanilla', 'Strawberry', 'Lemon', 'Caramel', 'Coconut', 'Banana',
+           'Almond', 'Cinnamon', 'Coffee', 'Orange', 'Pineapple', 'Mango', 'Blueberry', 'Plantain']
+NOUNS = {'Cakes': 'Cake', 'Cookies': 'Cookies', 'Bread': 'Loaf', 'Donuts': 'Donuts',
+         'Pastries': 'Puffs', 'Pies': 'Pie', 'Tarts': 'Tart', 'Muffins': 'Muffins'}
+# Extra categories for catalogs that want many of them (see seed_catalog)
+MORE_CATEGORIES = ['Cupcakes', 'Brownies', 'Cheesecakes', 'Croissants', 'Scones', 'Eclairs', 'Macarons',
+                   'Biscuits', 'Buns', 'Rolls', 'Waffles', 'Puff-puff', 'Chin chin', 'Meat pies',
+                   'Doughnut holes', 'Sausage rolls', 'Banana bread', 'Coconut candy', 'Cinnamon rolls',
+                   'Fruit cakes', 'Wedding cakes', 'Birthday cakes', 'Cookie boxes', 'Pastry trays']
+INGREDIENTS = ['Flour', 'Sugar', 'Butter', 'Eggs', 'Milk', 'Cocoa powder', 'Vanilla', 'Yeast',
+               'Salt', 'Honey', 'Oats', 'Raisins', 'Cinnamon', 'Almonds', 'Cream cheese']
+
+
+def use_scratch_database():
+    """Point DATABASE_URL at a fresh SQLite file; call before importing app."""
+    tmpdir = tempfile.mkdtemp(prefix='pastry-bench-')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmpdir, 'bench.db')
+    return tmpdir
+
+
+def synthetic_pastry(i, rng, categories=CATEGORIES):
+    category = categories[i % len(categories)]
+    return {
+        'name': f'{rng.choice(ADJECTIVES)} {rng.choice(FLAVORS)} {NOUNS.get(category, category)} #{i}',
+        'category': category,
+        'price': 1000 + (i % 50) * 250,
+        'image': 'placeholder.png',
+        'description': f'Synthetic pastry number {i} with {rng.choice(INGREDIENTS).lower()}',
+        'serving_size': '6 pieces',
+        'available': i % 7 != 0,
+        'gallery_json': '[]',
+        'ingredients_json': json.dumps(rng.sample(INGREDIENTS, 5)),
+        'allergens_json': json.dumps(rng.sample(ALLERGENS, rng.randint(0, 3))),
+        'features_json': json.dumps(rng.sample(FEATURES, rng.randint(1, 2))),
+    }
+
+
+def seed_catalog(db, Pastry, rows, seed=42, batch_size=5000, categories=CATEGORIES):
+    """Bulk-insert `rows` synthetic pastries."""
+    rng = random.Random(seed)
+    batch = []
+    for i in range(rows):
+        batch.append(synthetic_pastry(i, rng, categories))
+        if len(batch) == batch_size:
+            db.session.execute(db.insert(Pastry), batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(Pastry), batch)
+    db.session.commit()